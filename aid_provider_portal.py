@@ -1,40 +1,113 @@
 # aid_provider_interface.py - Run on aid provider's Jetson (!db29d0f4)
-import meshtastic.serial_interface
-from pubsub import pub
-from datetime import datetime
-from collections import defaultdict
 import threading
+import time
+from gemnet_dedup import DedupIndex
+from gemnet_matching import ResourceMatcher
+from gemnet_metrics import MESH_BUCKETS, Metrics
+from gemnet_outbox import NORMAL, URGENT, Outbox
+from gemnet_runtime import NodeRuntime
+from gemnet_store import STATES, MessageStore, TriageQueue, type_priority
+from gemnet_transport import SerialTransport
+from gemnet_wire import CATEGORIES, Reassembler, WireEncoder, WireError, add_trace, frame_from_packet, send_message, split_trace
 
 class AidProviderInterface:
-    def __init__(self, port="/dev/ttyUSB0"):
+    def __init__(self, port="/dev/ttyUSB0", wire_format="binary", store_path="aid_messages.db",
+                 outbox_path="aid_outbox.db", metrics_port=9103, metrics_snapshot="aid_metrics.json", transport=None):
         self.port = port
+        self.transport = transport or SerialTransport(port)  # Or a gemnet_transport.SimMesh node
         self.interface = None
-        self.messages = []  # List of all messages
-        self.conversations = defaultdict(list)  # Messages grouped by sender
-        self.message_counter = 0
+        self.wire_format = wire_format  # "binary" frames or legacy "text" for responses/broadcasts
+        self.encoder = WireEncoder()
+        self.reassembler = Reassembler()
+        self.outbox = Outbox(path=outbox_path)  # ACKed, retried, duty-cycle paced sends
+        self.store = MessageStore(store_path)  # All messages, indexed by id, sender, category, priority, ref
+        self.triage = TriageQueue(self.store.open_messages())  # Unanswered messages, most urgent first
+        self.dedup = DedupIndex(ring_size=512, ttl=600)  # Retransmissions and resends merge into the original
+        # Open offers and needs by resource, place and word, each new one is matched against the other side
+        self.matcher = ResourceMatcher()
+        for msg in self.store.unresolved(since=time.time() - 7 * 24 * 3600):
+            self.matcher.add(msg)
+        # Incident updates that overtook their route on the mesh, by route ref, applied once it is stored
+        self.early_incidents = {}
         
-    def connect(self):
+        # Arrivals, end-to-end latency from the user's send and triage depth
+        self.metrics = Metrics("aid_provider")
+        self.metrics.set_buckets("end_to_end_seconds", MESH_BUCKETS)
+        self.metrics.collector(self.metric_samples)
+        self.metrics.collector(self.outbox.metric_samples)
+        self.metrics_port = metrics_port
+        self.metrics_snapshot = metrics_snapshot
+        self.runtime = None  # gemnet_runtime loop when started by run(), the radio thread otherwise
+        
+    def connect(self, runtime=None):
+        """Open the radio; with a runtime, packets are handled on its loop (call from the loop)"""
         print("Connecting to V3...")
-        self.interface = meshtastic.serial_interface.SerialInterface(self.port)
-        pub.subscribe(self.on_receive, "meshtastic.receive")
+        self.runtime = runtime
+        self.interface = self.transport.open()
+        self.outbox.start(self.interface)
+        if self.metrics_port:
+            self.metrics.serve(self.metrics_port)
+        if self.metrics_snapshot:
+            self.metrics.start_snapshots(self.metrics_snapshot)
+        self.transport.subscribe(runtime.bridge(self.on_receive) if runtime else self.on_receive)
         print("Connected! Aid Provider Terminal Active\n")
         
+    def on_loop(self, callback):
+        """An outbox callback, moved onto the event loop when there is one"""
+        return self.runtime.threadsafe(callback) if self.runtime else callback
+        
     def on_receive(self, packet, interface):
         """Handle incoming messages"""
+        if self.dedup.seen_packet(packet.get('fromId', 'Unknown'), packet.get('id')):
+            return  # Mesh retransmission of a packet already handled
+            
+        frame = frame_from_packet(packet)
+        if frame is not None:
+            sender_id = packet.get('fromId', 'Unknown')
+            if sender_id == self.interface.myInfo.my_node_num:
+                return
+            try:
+                msg = self.reassembler.add(sender_id, frame)
+            except WireError as e:
+                print(f"\n[WIRE] {e}")
+                return
+            if msg:  # None until every fragment is in, or for a retransmission
+                self.handle_wire_message(msg, sender_id)
+            return
+            
         if 'decoded' in packet and 'text' in packet['decoded']:
-            message = packet['decoded']['text']
+            message, trace, sent = split_trace(packet['decoded']['text'])
             sender_id = packet.get('fromId', 'Unknown')
             
             # Skip our own messages
             if sender_id == self.interface.myInfo.my_node_num:
                 return
                 
+            if message.startswith("HEARTBEAT|"):
+                return  # Router announcing itself to the user portals
+                
+            if message.startswith("CORRECTION|"):
+                self.record_arrival("CORRECTION", sent)
+                self.apply_correction(message, sender_id)
+                return
+                
+            if message.startswith("REPEAT|"):
+                self.record_arrival("REPEAT", sent)
+                self.apply_repeat(message, sender_id, trace)
+                return
+                
+            if message.startswith("INCIDENT|"):
+                self.record_arrival("INCIDENT", sent)
+                self.apply_incident(message, sender_id)
+                return
+                
             # Parse enriched message from router
             msg_type = "GENERAL"
             category = "OTHER"
             original_sender = sender_id
             content = message
             summary = ""
+            ref = None
             
             if "|" in message:
                 parts = message.split("|")
@@ -44,163 +117,536 @@ class AidProviderInterface:
                     original_sender = parts[2]  # Original user
                     content = parts[3]
                     summary = parts[4]
+                    if len(parts) >= 6:  # Route ref for later corrections
+                        ref = self.route_key(sender_id, parts[5])
                 elif len(parts) == 2:  # Simple format
                     msg_type = parts[0]
                     content = parts[1]
+                    
+            self.record_arrival("ROUTED" if ref else msg_type, sent)
+            self.store_message(msg_type, category, original_sender, content, summary, ref, trace=trace)
             
-            # Store message
-            self.message_counter += 1
-            msg_data = {
-                'id': self.message_counter,
-                'sender': original_sender,  # Original user, not router
-                'type': msg_type,
-                'category': category,
-                'content': content,
-                'summary': summary,
-                'time': datetime.now().strftime("%H:%M:%S")
-            }
-            
-            self.messages.append(msg_data)
-            self.conversations[original_sender].append(msg_data)
-            
-            # Alert based on priority
-            if "URGENT" in msg_type or "P1" in msg_type or "P2" in msg_type:
-                print(f"\n🚨 {msg_type} #{msg_data['id']} [{category}] from {original_sender}")
-                print(f"   → {content[:60]}...")
-            else:
-                print(f"\n📨 {msg_type} #{msg_data['id']} [{category}] from {original_sender}: {content[:50]}...")
+    def handle_wire_message(self, msg, sender_id):
+        """Dispatch a reassembled binary message"""
+        if msg['kind'] == "HEARTBEAT":
+            return
+        self.record_arrival(msg['kind'], msg.get('sent'))
+        if msg['kind'] == "ROUTED":
+            msg_type = self.route_prefix(msg['msg_type'], msg['priority'])
+            self.store_message(msg_type, msg['category'], msg.get('origin', sender_id), msg['text'],
+                               msg.get('summary', ""), self.route_key(sender_id, msg.get('ref')), msg.get('urgency'),
+                               trace=msg.get('trace'), kind=msg['msg_type'])
+        elif msg['kind'] == "CORRECTION":
+            self.correct_route(self.route_key(sender_id, msg['ref']), self.route_prefix(msg['msg_type'], msg['priority']),
+                               msg['category'], msg.get('summary'), msg.get('text'), msg.get('members', []))
+        elif msg['kind'] == "REPEAT":
+            self.repeat_route(self.route_key(sender_id, msg['ref']), msg.get('count'), msg.get('origin', sender_id),
+                              msg.get('trace'))
+        elif msg['kind'] == "INCIDENT":
+            self.update_incident(self.route_key(sender_id, msg['ref']), msg.get('count'),
+                                 self.route_prefix(msg['msg_type'], msg['priority']), msg.get('urgency'),
+                                 msg.get('members', []))
+        elif msg['kind'] in ("EMERGENCY", "REQUEST", "OFFER", "GENERAL"):  # Sent to us directly
+            self.store_message(msg['kind'], "OTHER", sender_id, msg['text'], "", None, trace=msg.get('trace'),
+                               kind=msg['kind'])
+            
+    def record_arrival(self, kind, sent):
+        """Count an arrival and, if it carries the user's send time, its end-to-end latency"""
+        self.metrics.inc("messages_received_total", kind=kind)
+        if sent:
+            self.metrics.observe("end_to_end_seconds", max(time.time() - sent, 0), kind=kind)
+            
+    def metric_samples(self):
+        """Triage depth, message states and duplicates, for the metrics endpoint"""
+        dedup = self.dedup.stats()
+        samples = [
+            ("gauge", "triage_open", {}, len(self.triage)),
+            ("counter", "duplicates_total", {"kind": "packet"}, dedup['packet_duplicates']),
+            ("counter", "duplicates_total", {"kind": "content"}, dedup['content_duplicates'])
+        ]
+        matching = self.matcher.stats()
+        samples += [
+            ("gauge", "match_index_entries", {"role": "offer"}, matching['offers']),
+            ("gauge", "match_index_entries", {"role": "need"}, matching['needs']),
+            ("counter", "match_suggestions_total", {}, matching['suggestions'])
+        ]
+        for state, total in self.store.state_counts().items():
+            samples.append(("gauge", "messages_stored", {"state": state}, total))
+        return samples
+        
+    def route_key(self, router_id, ref):
+        """Stored form of a route ref; each router numbers its routes from 1, so refs are kept per router"""
+        return f"{router_id}/{ref}" if ref else None
+        
+    def route_prefix(self, msg_type, priority):
+        """Same type/priority label the router uses in the text format"""
+        if priority <= 2:
+            return f"🚨URGENT-P{priority}"
+        return f"{msg_type}-P{priority}"
+        
+    def store_message(self, msg_type, category, original_sender, content, summary, ref, urgency=None, trace=None,
+                      kind=None):
+        """Record a message, queue it for triage, alert the operator and suggest matching offers or needs
+        
+        kind is the user's original message type when the wire format
+        carries it; urgent route labels otherwise hide whether it was an offer.
+        """
+        # Also catches a message re-dispatched through another router after a failover
+        duplicate = self.dedup.duplicate_of(original_sender, msg_type, content, trace)
+        if duplicate:
+            self.merge_duplicate(duplicate['value'], ref, trace=trace)
+            self.apply_early_incidents(ref)
+            return
             
+        # Original user, not router
+        msg_data = self.store.add(msg_type, category, original_sender, content, summary, ref, urgency, trace)
+        self.dedup.remember(original_sender, msg_type, content, msg_data['id'], trace)
+        self.triage.push(msg_data)
+        
+        # Alert based on priority
+        if self.is_urgent(msg_data):
+            print(f"\n🚨 {msg_type} #{msg_data['id']} [{category}] from {original_sender}")
+            print(f"   → {content[:60]}...")
+        else:
+            print(f"\n📨 {msg_type} #{msg_data['id']} [{category}] from {original_sender}: {content[:50]}...")
+            
+        role = {"OFFER": "offer", "REQUEST": "need", "EMERGENCY": "need"}.get(kind) if kind else None
+        self.show_matches(msg_data['id'], self.matcher.add(msg_data, role))
+        print("> ", end="", flush=True)
+        self.apply_early_incidents(ref)
+        
+    def apply_early_incidents(self, ref):
+        """Apply incident updates held for a route that has just been stored"""
+        for update in self.early_incidents.pop(ref, []):
+            self.update_incident(ref, *update)
+        
+    def show_matches(self, msg_id, matches):
+        """Print ranked offer/need suggestions for a message"""
+        if not matches:
+            return
+        print(f"   🤝 Possible matches for #{msg_id}:")
+        for score, other_id, shared in matches:
+            other = self.store.get(other_id)
+            if other:
+                print(f"      #{other_id} {other['type']} [{other['category']}] {other['sender']}: "
+                      f"{other['content'][:40]}... ({', '.join(shared[:4])}; score {score:g})")
+        
+    def merge_duplicate(self, msg_id, ref=None, repeats=None, trace=None):
+        """Count a repeat of a stored message instead of storing it again
+        
+        A sender repeating a message that was already acked or resolved
+        still needs attention, so it goes back on the triage queue. repeats
+        is the router's count so far, which makes up for lost notices. A
+        copy with the stored message's trace id was re-dispatched by the
+        portal through another router, not sent again by the user, so it
+        only takes the newer ref.
+        """
+        msg = self.store.get(msg_id)
+        if not msg:
+            return
+        if trace and trace == msg['trace']:
+            if ref and ref != msg['ref']:
+                self.store.update(msg_id, ref=ref)
+            print(f"\n↻ #{msg_id} arrived again through another router, merged")
             print("> ", end="", flush=True)
+            return
+        fields = {"repeats": max(msg['repeats'] + 1, repeats or 0)}
+        if ref and ref != msg['ref']:
+            fields['ref'] = ref  # Later corrections may name the newer route
+        previous = msg['state']
+        if previous != "open":
+            fields['state'] = "open"
+        self.store.update(msg_id, **fields)
+        if previous != "open":
+            self.triage.push(msg)
             
+        note = f", reopened (was {previous})" if previous != "open" else ""
+        print(f"\n↻ #{msg_id} repeated by {msg['sender']} (x{fields['repeats'] + 1}){note}")
+        print("> ", end="", flush=True)
+        
+    def apply_repeat(self, message, router_id, trace=None):
+        """Parse a text-format REPEAT|ref|repeats|sender"""
+        parts = message.split("|")
+        if len(parts) < 4:
+            return
+        self.repeat_route(self.route_key(router_id, parts[1]), int(parts[2]) if parts[2].isdigit() else None,
+                          parts[3], trace)
+        
+    def repeat_route(self, ref, repeats, sender, trace=None):
+        """The router saw the sender of a routed message send it again: count it and reopen the message"""
+        msg = self.store.by_ref(ref)
+        if not msg:
+            print(f"\n[Repeat of unknown route #{ref}]")
+            print("> ", end="", flush=True)
+            return
+        if trace:
+            self.dedup.remember(sender, msg['type'], msg['content'], msg['id'], trace)
+        self.merge_duplicate(msg['id'], repeats=repeats)
+        
+    def apply_correction(self, message, router_id):
+        """Parse a text-format CORRECTION|ref|type|category|summary"""
+        parts = message.split("|")
+        if len(parts) < 4:
+            return
+        self.correct_route(self.route_key(router_id, parts[1]), parts[2], parts[3], parts[4] if len(parts) >= 5 else None)
+        
+    def correct_route(self, ref, msg_type, category, summary=None, text=None, members=()):
+        """Update a provisionally routed message once the router's LLM has refined it
+        
+        text is a follow-up from the sender ("still trapped"), added to the
+        message, which goes back on the triage queue if it was acked or
+        resolved. members are the (sender, trace id) of the messages it
+        folds in, so a copy of one re-dispatched elsewhere merges here.
+        """
+        msg = self.store.by_ref(ref)
+        if not msg:
+            print(f"\n[Correction for unknown route #{ref}]")
+            print("> ", end="", flush=True)
+            return
+            
+        old = f"{msg['type']} [{msg['category']}]"
+        fields = {"type": msg_type, "category": category, "summary": summary or msg['summary']}
+        if text:
+            fields['content'] = f"{msg['content']} / {text}"
+            if msg['state'] != "open":
+                fields['state'] = "open"
+        self.store.update(msg['id'], **fields)
+        for sender, trace in members:
+            self.dedup.remember(sender, msg['type'], text or msg['content'], msg['id'], trace)
+        msg = self.store.get(msg['id'])
+        if msg['id'] in self.triage or fields.get('state'):
+            self.triage.push(msg)  # Re-key under the corrected priority, or back on the queue
+        self.matcher.update(msg)
+            
+        icon = "🚨" if self.is_urgent(msg) else "🔁"
+        print(f"\n{icon} UPDATED #{msg['id']}: {old} → {msg['type']} [{msg['category']}] {msg['summary']}")
+        print("> ", end="", flush=True)
+        
+    def apply_incident(self, message, router_id):
+        """Parse a text-format INCIDENT|ref|reporters|type|category|node:trace,node"""
+        parts = message.split("|")
+        if len(parts) < 5:
+            return
+        members = [tuple(member.split(":", 1)) if ":" in member else (member, None)
+                   for member in (parts[5].split(",") if len(parts) >= 6 and parts[5] else [])]
+        self.update_incident(self.route_key(router_id, parts[1]), int(parts[2]) if parts[2].isdigit() else None,
+                             parts[3], None, members)
+        
+    def update_incident(self, ref, count, msg_type, urgency, members):
+        """More people reported the event routed under ref: add them, and raise its priority if needed
+        
+        Like a repeat, new reporters of an acked or resolved incident put it
+        back on the triage queue.
+        """
+        msg = self.store.by_ref(ref)
+        if not msg:
+            # A lost route frame can be retried after this update was sent, so keep it for a while
+            if ref and (ref in self.early_incidents or len(self.early_incidents) < 200):
+                self.early_incidents.setdefault(ref, []).append((count, msg_type, urgency, members))
+            print(f"\n[Incident update for unknown route #{ref}, held until it arrives]")
+            print("> ", end="", flush=True)
+            return
+            
+        added = self.add_reporters(msg, members)
+        fields = {}
+        if count and count > (msg['reporters'] or 1):
+            fields['reporters'] = count
+        priority = type_priority(msg_type)
+        raised = priority is not None and (msg['priority'] is None or priority < msg['priority'])
+        if raised:
+            fields.update(type=msg_type, urgency=urgency or msg['urgency'])
+        previous = msg['state']
+        if added and previous != "open":
+            fields['state'] = "open"
+        if fields:
+            self.store.update(msg['id'], **fields)
+        msg = self.store.get(msg['id'])
+        if msg['state'] == "open":
+            self.triage.push(msg)
+            
+        note = f", raised to {msg['type']}" if raised else ""
+        note += f", reopened (was {previous})" if previous != msg['state'] else ""
+        icon = "🚨" if self.is_urgent(msg) else "👥"
+        print(f"\n{icon} #{msg['id']} [{msg['category']}] now {msg['reporters']} reporter(s), "
+              f"+{len(added)} new{note}: {msg['content'][:40]}...")
+        print("> ", end="", flush=True)
+        
+    def add_reporters(self, msg, members):
+        """Record new reporters of an incident, returns the (sender, trace id) pairs added"""
+        added = self.store.add_members(msg['id'], [(sender, trace) for sender, trace in members if sender != msg['sender']])
+        for sender, trace in added:
+            # Catches the same report re-dispatched through another router
+            self.dedup.remember(sender, msg['type'], msg['content'], msg['id'], trace)
+        return added
+        
+    def is_urgent(self, msg):
+        return msg['priority'] is not None and msg['priority'] <= 2
+        
+    def format_line(self, msg):
+        """One-line listing entry"""
+        icon = "🚨" if self.is_urgent(msg) else "📨"
+        state = "" if msg['state'] == "open" else f" ({msg['state']})"
+        if msg['repeats']:
+            state += f" x{msg['repeats'] + 1}"
+        if (msg.get('reporters') or 1) > 1:
+            state += f" 👥{msg['reporters']}"
+        return f"{icon} #{msg['id']} [{msg['time']}] {msg['type']} [{msg['category']}] {msg['sender']}: {msg['content'][:50]}...{state}"
+        
+    def show_next(self, count=1):
+        """Most urgent unanswered messages"""
+        ids = [self.triage.peek()] if count == 1 else self.triage.top(count)
+        ids = [msg_id for msg_id in ids if msg_id is not None]
+        if not ids:
+            print("No open messages")
+            return
+        print(f"\n=== Next {len(ids)} of {len(self.triage)} open ===")
+        for msg_id in ids:
+            print(self.format_line(self.store.get(msg_id)))
+            
+    def query_messages(self, args):
+        """Filtered, paginated listing: any of CATEGORY, !sender, open|acked|resolved, page number"""
+        filters = {"category": None, "sender": None, "state": None, "page": 1}
+        for arg in args:
+            if arg.upper() in CATEGORIES:
+                filters['category'] = arg.upper()
+            elif arg.lower() in STATES:
+                filters['state'] = arg.lower()
+            elif arg.isdigit():
+                filters['page'] = int(arg)
+            else:
+                filters['sender'] = arg
+                
+        msgs, total = self.store.query(**filters)
+        pages = max((total + 9) // 10, 1)
+        label = " ".join(str(v) for k, v in filters.items() if v and k != "page") or "all"
+        print(f"\n=== {label}: {total} message(s), page {filters['page']}/{pages} ===")
+        for msg in msgs:
+            print(self.format_line(msg))
+            
+    def set_state(self, msg_id, state):
+        """Move a message to acked or resolved, taking it out of triage"""
+        msg = self.store.get(msg_id)
+        if not msg:
+            print(f"Message #{msg_id} not found")
+            return None
+        self.store.update(msg_id, state=state)
+        if state == "open":
+            self.triage.push(msg)
+        else:
+            self.triage.discard(msg_id)
+        # Resolved offers are used up and resolved needs are met, neither should be suggested again
+        if state == "resolved":
+            self.matcher.remove(msg_id)
+        elif msg_id not in self.matcher.entries:
+            self.matcher.add(msg)
+        return msg
+        
     def list_messages(self, sender=None):
         """List all messages or from specific sender"""
+        msgs = self.store.recent(10, sender=sender)  # Show last 10
         if sender:
-            msgs = self.conversations.get(sender, [])
             print(f"\n=== Messages from {sender} ===")
         else:
-            msgs = self.messages
             print("\n=== All Messages ===")
             
         if not msgs:
             print("No messages")
             return
             
-        for msg in msgs[-10:]:  # Show last 10
-            icon = "🚨" if msg['type'] == "EMERGENCY" else "📨"
-            print(f"{icon} #{msg['id']} [{msg['time']}] {msg['sender']}: {msg['content'][:50]}...")
+        for msg in msgs:
+            print(self.format_line(msg))
             
     def list_senders(self):
         """List all unique senders"""
         print("\n=== Active Conversations ===")
-        for sender, msgs in self.conversations.items():
-            last_msg = msgs[-1]
-            print(f"{sender}: {len(msgs)} messages, last: {last_msg['content'][:30]}...")
+        for sender, count, last_content in self.store.senders():
+            print(f"{sender}: {count} messages, last: {last_content[:30]}...")
             
     def respond(self, msg_id, response):
-        """Respond to specific message"""
-        # Find message
-        msg = None
-        for m in self.messages:
-            if m['id'] == msg_id:
-                msg = m
-                break
-                
+        """Respond to specific message, and to every other reporter if it is an incident"""
+        msg = self.store.get(msg_id)
         if not msg:
             print(f"Message #{msg_id} not found")
             return
             
-        # Send response
-        response_text = f"RESPONSE|{response}"
-        self.interface.sendText(response_text, destinationId=msg['sender'])
-        print(f"✓ Sent to {msg['sender']}: {response}")
+        # Queue response, replies to urgent messages go out first
+        priority = URGENT if self.is_urgent(msg) else NORMAL
+        report = self.on_loop(lambda item, delivered: self.report_delivery(msg_id, item, delivered))
+        recipients = [(msg['sender'], msg.get('trace'))] + self.store.members(msg_id)
+        for sender, trace in recipients:
+            # Reply carries the request's trace id so the user portal can time the round trip
+            if self.wire_format == "binary":
+                reply = {"kind": "RESPONSE", "text": response}
+                if trace:
+                    reply.update(trace=trace, sent=time.time())
+                send_message(self.outbox, self.encoder, reply, sender, priority=priority, on_result=report)
+            else:
+                text = f"RESPONSE|{response}"
+                if trace:
+                    text = add_trace(text, trace, time.time())
+                self.outbox.sendText(text, destinationId=sender, priority=priority, on_result=report)
+        self.metrics.inc("responses_total", urgent=self.is_urgent(msg))
+        if msg['state'] == "open":
+            self.set_state(msg_id, "acked")
+        others = f" and {len(recipients) - 1} other reporter(s)" if len(recipients) > 1 else ""
+        print(f"✓ Queued for {msg['sender']}{others}: {response}")
+        
+    def report_delivery(self, msg_id, item, delivered):
+        """Outbox callback once a response is ACKed or has used up its retries"""
+        if delivered:
+            print(f"\n✓ Response to #{msg_id} delivered to {item['dest']} in {time.time() - item['created']:.0f}s")
+        else:
+            print(f"\n✗ Response to #{msg_id} NOT delivered to {item['dest']} after {item['attempts']} attempts")
+        print("> ", end="", flush=True)
         
     def broadcast(self, message):
         """Broadcast to all nodes"""
-        self.interface.sendText(f"BROADCAST|{message}")
+        # Repeating a broadcast that has not gone out yet is coalesced into the queued one
+        if self.wire_format == "binary":
+            send_message(self.outbox, self.encoder, {"kind": "BROADCAST", "text": message},
+                         coalesce_key=f"BROADCAST|{message}")
+        else:
+            self.outbox.sendText(f"BROADCAST|{message}")
         print(f"✓ Broadcast: {message}")
         
     def run(self):
-        """Main interaction loop"""
-        self.connect()
+        """Main interaction loop, on an asyncio event loop so incoming messages never wait on the console"""
+        runtime = NodeRuntime("aid")
+        runtime.run(self.main(runtime))
+        
+    async def main(self, runtime):
+        self.connect(runtime)
         
         print("=== Aid Provider Terminal ===")
         print("Commands:")
+        print("  n [count]  - Next most urgent unanswered message(s)")
         print("  l          - List all messages")
+        print("  q [CATEGORY] [!sender] [open|acked|resolved] [page] - Query messages")
         print("  ls         - List senders")
         print("  v <id>     - View message details")
-        print("  r <id> <response> - Respond to message")
+        print("  r <id> <response> - Respond to message and everyone who reported it (marks it acked)")
+        print("  a <id>     - Acknowledge without replying")
+        print("  x <id>     - Mark resolved")
+        print("  o <id>     - Reopen")
+        print("  m <id>     - Offers matching a need, or needs matching an offer")
         print("  b <message> - Broadcast to all")
         print("  d <node> <msg> - Direct message")
+        print("  stats      - Send queue, delivery and duplicate stats")
         print("  quit       - Exit\n")
         
-        while True:
-            try:
-                user_input = input("> ").strip()
+        try:
+            while True:
+                user_input = await runtime.console()
+                if user_input is None or self.handle_command(user_input.strip()) is False:
+                    break
+        finally:
+            print("\nShutting down...")
+            self.metrics.close(self.metrics_snapshot)
+            self.store.close()
+            self.outbox.close()
+            self.interface.close()
+            
+    def handle_command(self, user_input):
+        """Run one console command, False for quit"""
+        try:
+            if not user_input:
+                return
                 
-                if not user_input:
-                    continue
-                    
-                parts = user_input.split(maxsplit=2)
-                cmd = parts[0].lower()
+            parts = user_input.split(maxsplit=2)
+            cmd = parts[0].lower()
+            
+            if cmd == "quit":
+                return False
                 
-                if cmd == "quit":
-                    break
-                    
-                elif cmd == "l":
-                    self.list_messages()
-                    
-                elif cmd == "ls":
-                    self.list_senders()
-                    
-                elif cmd == "v":
-                    if len(parts) < 2:
-                        print("Usage: v <message_id>")
-                        continue
-                    msg_id = int(parts[1])
-                    for msg in self.messages:
-                        if msg['id'] == msg_id:
-                            print(f"\n=== Message #{msg_id} ===")
-                            print(f"From: {msg['sender']}")
-                            print(f"Type: {msg['type']}")
-                            print(f"Time: {msg['time']}")
-                            print(f"Content: {msg['content']}")
-                            break
-                    else:
-                        print(f"Message #{msg_id} not found")
-                        
-                elif cmd == "r":
-                    if len(parts) < 3:
-                        print("Usage: r <message_id> <response>")
-                        continue
-                    msg_id = int(parts[1])
-                    response = parts[2]
-                    self.respond(msg_id, response)
-                    
-                elif cmd == "b":
-                    if len(parts) < 2:
-                        print("Usage: b <message>")
-                        continue
-                    self.broadcast(parts[1])
-                    
-                elif cmd == "d":
-                    if len(parts) < 3:
-                        print("Usage: d <node_id> <message>")
-                        continue
-                    self.interface.sendText(parts[2], destinationId=parts[1])
-                    print(f"✓ Sent to {parts[1]}")
-                    
+            elif cmd == "n":
+                self.show_next(int(parts[1]) if len(parts) > 1 else 1)
+                
+            elif cmd == "stats":
+                self.outbox.print_stats()
+                dedup = self.dedup.stats()
+                print(f"[DEDUP] retransmissions={dedup['packet_duplicates']} repeats={dedup['content_duplicates']}")
+                matching = self.matcher.stats()
+                print(f"[MATCH] offers={matching['offers']} needs={matching['needs']} matched={matching['matched']} "
+                      f"suggestions={matching['suggestions']} avg_scanned={matching['avg_scanned']:.1f}")
+                
+            elif cmd == "l":
+                self.list_messages()
+                
+            elif cmd == "q":
+                self.query_messages(user_input.split()[1:])
+                
+            elif cmd in ("a", "x", "o"):
+                if len(parts) < 2:
+                    print(f"Usage: {cmd} <message_id>")
+                    return
+                state = {"a": "acked", "x": "resolved", "o": "open"}[cmd]
+                if self.set_state(int(parts[1]), state):
+                    print(f"✓ #{parts[1]} {state} ({len(self.triage)} open)")
+                
+            elif cmd == "m":
+                if len(parts) < 2:
+                    print("Usage: m <message_id>")
+                    return
+                msg_id = int(parts[1])
+                if msg_id not in self.matcher.entries:
+                    print(f"#{msg_id} is not an open offer, request or emergency")
+                    return
+                matches = self.matcher.matches(msg_id, limit=10)
+                if matches:
+                    self.show_matches(msg_id, matches)
                 else:
-                    print("Unknown command")
+                    print(f"No matches for #{msg_id} yet")
+                
+            elif cmd == "ls":
+                self.list_senders()
+                
+            elif cmd == "v":
+                if len(parts) < 2:
+                    print("Usage: v <message_id>")
+                    return
+                msg_id = int(parts[1])
+                msg = self.store.get(msg_id)
+                if msg:
+                    print(f"\n=== Message #{msg_id} ===")
+                    print(f"From: {msg['sender']}")
+                    print(f"Type: {msg['type']} [{msg['category']}] {msg['urgency'] or ''}")
+                    print(f"State: {msg['state']}" + (f", sent {msg['repeats'] + 1} times" if msg['repeats'] else ""))
+                    members = self.store.members(msg_id)
+                    if members:
+                        print(f"Also reported by: {', '.join(sender for sender, _ in members)}")
+                    print(f"Time: {msg['time']}")
+                    print(f"Content: {msg['content']}")
+                else:
+                    print(f"Message #{msg_id} not found")
                     
-            except KeyboardInterrupt:
-                break
-            except ValueError as e:
-                print(f"Invalid number: {e}")
-            except Exception as e:
-                print(f"Error: {e}")
-                
-        print("\nShutting down...")
-        self.interface.close()
+            elif cmd == "r":
+                if len(parts) < 3:
+                    print("Usage: r <message_id> <response>")
+                    return
+                msg_id = int(parts[1])
+                response = parts[2]
+                self.respond(msg_id, response)
+                
+            elif cmd == "b":
+                if len(parts) < 2:
+                    print("Usage: b <message>")
+                    return
+                self.broadcast(parts[1])
+                
+            elif cmd == "d":
+                if len(parts) < 3:
+                    print("Usage: d <node_id> <message>")
+                    return
+                self.outbox.sendText(parts[2], destinationId=parts[1])
+                print(f"✓ Queued for {parts[1]}")
+                
+            else:
+                print("Unknown command")
+                
+        except ValueError as e:
+            print(f"Invalid number: {e}")
+        except Exception as e:
+            print(f"Error: {e}")
 
 if __name__ == "__main__":
     provider = AidProviderInterface(port="/dev/ttyUSB0")  # Adjust port
@@ -0,0 +1,66 @@
+# bench_batching.py - Single vs batched router classification against the stub Ollama server
+import argparse
+import contextlib
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from gemnet_core_router import RouterNode
+from stub_ollama import StubOllama
+
+MESSAGES = [
+    ("EMERGENCY", "Building collapsed on 5th street, 3 people trapped"),
+    ("REQUEST", "Need drinking water at shelter 3, 40 people"),
+    ("OFFER", "I can offer rides in my truck to the hospital"),
+    ("EMERGENCY", "My father is having a heart attack, not breathing"),
+    ("REQUEST", "Baby formula and diapers needed"),
+    ("EMERGENCY", "House on fire near the school, smoke everywhere"),
+    ("OFFER", "Extra blankets and tents available at the church"),
+    ("REQUEST", "Road to the clinic is blocked, need transport for elderly"),
+]
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+def run(router, items, batch_size):
+    """Classify a burst of items arriving at t=0, returns per-message latencies and total time"""
+    latencies = []
+    start = time.time()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for i in range(0, len(items), batch_size):
+            chunk = items[i:i + batch_size]
+            if batch_size == 1:
+                router.analyze_with_ollama(chunk[0][0], chunk[0][1])
+            else:
+                router.analyze_batch_with_ollama(chunk)
+            latencies.extend([time.time() - start] * len(chunk))
+    return latencies, time.time() - start
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare single and batched router classification")
+    parser.add_argument("--messages", type=int, default=16)
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--prefill-rate", type=float, default=400.0, help="stub prompt tokens/s")
+    parser.add_argument("--token-rate", type=float, default=40.0, help="stub generated tokens/s")
+    args = parser.parse_args()
+
+    stub = StubOllama(prefill_rate=args.prefill_rate, token_rate=args.token_rate).start()
+    router = RouterNode(cache_path=None, outbox_path=None, log_path=None, metrics_port=None, metrics_snapshot=None)
+    router.ollama.url = stub.url
+    items = [(text, msg_type) for msg_type, text in (MESSAGES * (args.messages // len(MESSAGES) + 1))[:args.messages]]
+
+    print(f"{args.messages} messages, stub at {args.prefill_rate:.0f} prefill tok/s, {args.token_rate:.0f} gen tok/s\n")
+    print(f"{'mode':<12}{'calls':>6}{'total s':>10}{'msg/s':>8}{'mean s':>9}{'p50 s':>8}{'p95 s':>8}")
+    for label, size in (("single", 1), (f"batch x{args.batch_size}", args.batch_size)):
+        calls_before = stub.requests
+        latencies, total = run(router, items, size)
+        print(f"{label:<12}{stub.requests - calls_before:>6}{total:>10.2f}{len(items) / total:>8.2f}"
+              f"{sum(latencies) / len(latencies):>9.2f}{percentile(latencies, 50):>8.2f}{percentile(latencies, 95):>8.2f}")
+
+    stub.stop()
+
+if __name__ == "__main__":
+    main()
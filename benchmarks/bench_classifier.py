@@ -0,0 +1,248 @@
+# bench_classifier.py - Accuracy and latency of the router classification prompt on a labelled corpus or a router log
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from gemnet_classifier import (CATEGORIES, build_batch_prompt, build_prompt, classify_rules, extract_json_objects,
+                               parse_analysis, parse_batch)
+from gemnet_log import RouterReplay, read_log
+from gemnet_ollama import JsonWatcher, OllamaClient
+from stub_ollama import StubOllama
+
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "classify_corpus.jsonl")
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+def load_corpus(path):
+    """Labelled messages: one JSON object per line with msg_type, message, category and optionally priority"""
+    items = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                items.append({"message": record["message"], "msg_type": record.get("msg_type", "GENERAL"),
+                              "category": record["category"].upper(), "priority": record.get("priority")})
+    return items
+
+def load_log(path):
+    """Final LLM analyses from a router log (JSONL, binary or legacy router_log.txt) as silver labels"""
+    replay = RouterReplay().replay(read_log(path))
+    items = []
+    for record in replay.routes.values():
+        analysis = record.get("analysis") or {}
+        if record.get("source") == "llm" and not analysis.get("fallback") and record.get("message"):
+            items.append({"message": record["message"], "msg_type": record.get("msg_type") or "GENERAL",
+                          "category": analysis.get("category"), "priority": analysis.get("priority")})
+    return items
+
+class ResponseCache:
+    """Raw model output keyed by model, temperature and the exact prompt
+
+    A changed prompt misses and is generated again; a changed parser or
+    scoring re-reads the stored text without touching the model.
+    """
+    def __init__(self, path):
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, model TEXT, response TEXT, "
+                        "elapsed REAL, ttft REAL, created REAL)")
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _key(model, prompt, temperature):
+        return hashlib.sha256(f"{model}\n{temperature}\n{prompt}".encode()).hexdigest()
+
+    def get(self, model, prompt, temperature):
+        with self.lock:
+            row = self.db.execute("SELECT response, elapsed, ttft FROM responses WHERE key = ?",
+                                  (self._key(model, prompt, temperature),)).fetchone()
+        return row and {"response": row[0], "elapsed": row[1], "ttft": row[2]}
+
+    def put(self, model, prompt, temperature, reply):
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                            (self._key(model, prompt, temperature), model, reply["response"], reply["elapsed"],
+                             reply["ttft"], time.time()))
+            self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+def run_chunk(client, cache, chunk, args):
+    """Classify a chunk of corpus items in one call as the router would, returns one result per item"""
+    pairs = [(item["message"], item["msg_type"]) for item in chunk]
+    batched = len(chunk) > 1
+    prompt = build_batch_prompt(pairs, compact=args.compact) if batched else build_prompt(*pairs[0], compact=args.compact)
+
+    reply = cache.get(args.model, prompt, args.temperature) if cache else None
+    cached = reply is not None
+    if reply is None and not args.offline:
+        try:
+            reply = client.generate(args.model, prompt, temperature=args.temperature, timeout=args.timeout,
+                                    stop_when=JsonWatcher("[" if batched else "{"),
+                                    prompt_type="classify_batch" if batched else "classify")
+            if cache:
+                cache.put(args.model, prompt, args.temperature, reply)
+        except Exception as e:
+            reply = {"error": f"{type(e).__name__}: {e}"}
+    if reply is None:
+        return [{"outcome": "uncached"} for _ in chunk]
+    if "error" in reply:
+        return [{"outcome": "error", "analysis": classify_rules(*pair), "error": reply["error"]} for pair in pairs]
+
+    results = []
+    if batched:
+        for analysis, ok in parse_batch(reply["response"], pairs):
+            results.append({"outcome": "ok" if ok else "parse_failure", "analysis": analysis})
+    else:
+        try:
+            analysis = parse_analysis(reply["response"], *pairs[0])
+            objects = extract_json_objects(reply["response"])
+            valid = objects and str(objects[0].get("category", "")).strip().upper() in CATEGORIES
+            results.append({"outcome": "ok" if valid else "invalid_category", "analysis": analysis})
+        except ValueError:
+            results.append({"outcome": "parse_failure", "analysis": classify_rules(*pairs[0])})
+    for result in results:
+        result.update(elapsed=reply["elapsed"], ttft=reply["ttft"], cached=cached, response=reply["response"])
+    return results
+
+def score(items, analyses):
+    """Category accuracy overall and per label, priority exact and within one, and the commonest confusions"""
+    per_label = {name: Counter() for name in sorted({item["category"] for item in items})}
+    confusions = Counter()
+    priority = Counter()
+    for item, analysis in zip(items, analyses):
+        if analysis is None:
+            continue
+        label, predicted = item["category"], analysis["category"]
+        per_label[label]["support"] += 1
+        per_label.setdefault(predicted, Counter())["predicted"] += 1
+        if predicted == label:
+            per_label[label]["correct"] += 1
+        else:
+            confusions[(label, predicted)] += 1
+        if item.get("priority") is not None:
+            priority["labelled"] += 1
+            priority["exact"] += analysis["priority"] == item["priority"]
+            priority["within_one"] += abs(analysis["priority"] - item["priority"]) <= 1
+    scored = sum(counts["support"] for counts in per_label.values())
+    correct = sum(counts["correct"] for counts in per_label.values())
+    return {"scored": scored, "accuracy": correct / scored if scored else 0.0, "per_label": per_label,
+            "priority": priority, "confusions": confusions}
+
+def main():
+    parser = argparse.ArgumentParser(description="Score the router classification prompt and parser on labelled messages")
+    parser.add_argument("--corpus", default=CORPUS, help="labelled JSONL corpus (default: the bundled sample)")
+    parser.add_argument("--log", help="replay the final LLM analyses of a router log as labels instead")
+    parser.add_argument("--limit", type=int, help="only the first N messages")
+    parser.add_argument("--url", help="Ollama generate URL; without it a stub model answering with the rules is used")
+    parser.add_argument("--model", default="gemma:2b")
+    parser.add_argument("--temperature", type=float, default=0.1)
+    parser.add_argument("--compact", action="store_true", help="score the compact prompt used near a deadline")
+    parser.add_argument("--batch-size", type=int, default=1, help="messages per call, >1 scores the batch prompt")
+    parser.add_argument("--workers", type=int, default=4, help="calls in flight at once")
+    parser.add_argument("--timeout", type=float, default=180)
+    parser.add_argument("--responses", default="classifier_responses.db",
+                        help="SQLite cache of raw responses, reused when the prompt is unchanged ('' to disable)")
+    parser.add_argument("--offline", action="store_true", help="only re-score cached responses, never call the model")
+    parser.add_argument("--show", type=int, default=5, help="misclassified examples to print")
+    parser.add_argument("--prefill-rate", type=float, default=400.0, help="stub prompt tokens/s")
+    parser.add_argument("--token-rate", type=float, default=40.0, help="stub generated tokens/s")
+    args = parser.parse_args()
+
+    items = load_log(args.log) if args.log else load_corpus(args.corpus)
+    items = items[:args.limit] if args.limit else items
+    if not items:
+        print("Nothing to score")
+        return
+
+    stub = None
+    url = args.url
+    if not url:
+        stub = StubOllama(prefill_rate=args.prefill_rate, token_rate=args.token_rate).start()
+        url = stub.url
+    client = OllamaClient(url, concurrency={args.model: args.workers}, pool_size=args.workers)
+    cache = ResponseCache(args.responses) if args.responses else None
+
+    chunks = [items[i:i + args.batch_size] for i in range(0, len(items), args.batch_size)]
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        per_call = list(pool.map(lambda chunk: run_chunk(client, cache, chunk, args), chunks))
+    results = [result for call in per_call for result in call]
+    wall = time.time() - start
+    client.close()
+    if cache:
+        cache.close()
+    if stub:
+        stub.stop()
+
+    source = args.log or args.corpus
+    prompt = ("compact " if args.compact else "") + (f"batch x{args.batch_size}" if args.batch_size > 1 else "single")
+    print(f"{len(items)} messages from {source}, {args.model} at {url if args.url else 'stub'}, {prompt} prompt, "
+          f"{args.workers} worker(s), {wall:.1f}s\n")
+
+    outcomes = Counter(result["outcome"] for result in results)
+    answered = [r for r in results if r["outcome"] != "uncached"]
+    if not answered:
+        print("No cached responses for this prompt and model, run once without --offline first")
+        return
+    llm = score(items, [r.get("analysis") for r in results])
+    rules = score(items, [classify_rules(item["message"], item["msg_type"]) if r["outcome"] != "uncached" else None
+                          for item, r in zip(items, results)])
+
+    print(f"{'category':<12}{'support':>8}{'predicted':>10}{'precision':>10}{'recall':>8}{'rules':>8}")
+    for label, counts in llm["per_label"].items():
+        support = counts["support"]
+        rules_correct = rules["per_label"].get(label, Counter())["correct"]
+        print(f"{label:<12}{support:>8}{counts['predicted']:>10}"
+              f"{counts['correct'] / counts['predicted'] if counts['predicted'] else 0:>10.0%}"
+              f"{counts['correct'] / support if support else 0:>8.0%}{rules_correct / support if support else 0:>8.0%}")
+    print(f"{'all':<12}{llm['scored']:>8}{'':>10}{'':>10}{llm['accuracy']:>8.1%}{rules['accuracy']:>8.1%}")
+    if llm["priority"]["labelled"]:
+        labelled = llm["priority"]["labelled"]
+        print(f"priority: {llm['priority']['exact'] / labelled:.1%} exact, {llm['priority']['within_one'] / labelled:.1%} "
+              f"within one (rules {rules['priority']['exact'] / labelled:.1%} exact)")
+
+    total = max(len(answered), 1)
+    fallbacks = outcomes["parse_failure"] + outcomes["error"]
+    print(f"\nparse failures: {outcomes['parse_failure']} ({outcomes['parse_failure'] / total:.1%}), "
+          f"invalid category: {outcomes['invalid_category']} ({outcomes['invalid_category'] / total:.1%}), "
+          f"call errors: {outcomes['error']}, fallback rate: {fallbacks / total:.1%}")
+    if outcomes["uncached"]:
+        print(f"not scored: {outcomes['uncached']} message(s) have no cached response (--offline)")
+
+    # One latency per call, the items of a batch share theirs
+    calls = [call[0] for call in per_call if "elapsed" in call[0]]
+    if calls:
+        elapsed = [r["elapsed"] for r in calls]
+        ttft = [r["ttft"] for r in calls]
+        cached = sum(1 for r in calls if r["cached"])
+        print(f"\n{'latency s':<12}{'calls':>7}{'mean':>8}{'p50':>8}{'p95':>8}{'p99':>8}{'max':>8}")
+        for label, values in (("total", elapsed), ("first token", ttft)):
+            print(f"{label:<12}{len(values):>7}{sum(values) / len(values):>8.2f}{percentile(values, 50):>8.2f}"
+                  f"{percentile(values, 95):>8.2f}{percentile(values, 99):>8.2f}{max(values):>8.2f}")
+        print(f"{cached} of {len(calls)} call(s) re-scored from the response cache, latencies as first generated")
+
+    if llm["confusions"]:
+        print("\nconfusions: " + ", ".join(f"{label}->{predicted} {count}"
+                                           for (label, predicted), count in llm["confusions"].most_common(5)))
+    shown = 0
+    for item, result in zip(items, results):
+        if shown >= args.show or result["outcome"] == "uncached":
+            continue
+        if result["analysis"]["category"] != item["category"] or result["outcome"] != "ok":
+            print(f"  [{result['outcome']}] {item['category']} -> {result['analysis']['category']}: "
+                  f"{item['message'][:70]!r}")
+            shown += 1
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+# bench_matching.py - Offer/need matching cost as open messages grow, inverted index vs rescanning every message
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from gemnet_matching import ResourceMatcher, extract_terms
+
+NEEDS = [
+    ("REQUEST-P3", "SUPPLIES", "Need drinking water at shelter {n}, {k} people"),
+    ("REQUEST-P3", "SUPPLIES", "Baby formula and diapers needed at {n} {street} street"),
+    ("🚨URGENT-P2", "MEDICAL", "Elderly man needs insulin at shelter {n}, urgent"),
+    ("REQUEST-P3", "SHELTER", "Family of {k} lost our house, need a tent near block {n}"),
+    ("🚨URGENT-P1", "TRANSPORT", "Need a ride to the hospital from {n} {street} street right now"),
+    ("REQUEST-P3", "SUPPLIES", "Out of food at the school {n}, children hungry"),
+    ("REQUEST-P4", "SUPPLIES", "Generator fuel needed for the clinic on {street} road"),
+]
+OFFERS = [
+    ("OFFER-P4", "SUPPLIES", "I can offer {k} litres of water at church {n}"),
+    ("OFFER-P4", "TRANSPORT", "Truck available for rides from {street} street, block {n}"),
+    ("OFFER-P4", "SHELTER", "We have spare tents and blankets at school {n}"),
+    ("OFFER-P4", "SUPPLIES", "Extra rice and bread to share at the market on {street} road"),
+    ("OFFER-P4", "MEDICAL", "Nurse available at shelter {n}, have first aid supplies and some insulin"),
+    ("OFFER-P4", "SUPPLIES", "Can provide a generator and batteries, {n} {street} avenue"),
+]
+STREETS = ("main", "oak", "river", "market", "church", "hill", "station", "lake")
+
+def make_message(rng, msg_id, templates):
+    msg_type, category, text = rng.choice(templates)
+    return {"id": msg_id, "type": msg_type, "category": category, "priority": int(msg_type[-1]),
+            "sender": f"!{rng.randrange(16 ** 8):08x}", "created": time.time(),
+            "content": text.format(n=rng.randrange(1, 200), k=rng.randrange(2, 80), street=rng.choice(STREETS))}
+
+class Rescan:
+    """Plain term-overlap scoring without an index: every open message of the other side is compared"""
+    def __init__(self, matcher):
+        self.matcher = matcher
+        self.terms = {}
+
+    def add(self, msg, role):
+        self.terms[msg["id"]] = (role, msg["category"], extract_terms(msg["content"]))
+        mine = self.terms[msg["id"]][2]
+        scores = []
+        for other_id, (other_role, category, terms) in self.terms.items():
+            if other_role != role:
+                score = len(mine & terms) + (1 if category == msg["category"] else 0)
+                if score >= 2:
+                    scores.append((score, other_id))
+        return sorted(scores, reverse=True)[:self.matcher.top_k]
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-message matching time against the number of open offers and needs")
+    parser.add_argument("--sizes", default="1000,5000,20000", help="open messages before timing")
+    parser.add_argument("--probes", type=int, default=500, help="messages timed at each size")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    print(f"{'open':>7}{'index ms':>10}{'p95 ms':>9}{'scanned':>9}{'rescan ms':>11}{'matched':>9}")
+    for size in (int(s) for s in args.sizes.split(",")):
+        rng = random.Random(args.seed)
+        matcher = ResourceMatcher()
+        rescan = Rescan(matcher)
+        for msg_id in range(size):
+            role = "offer" if msg_id % 2 else "need"
+            msg = make_message(rng, msg_id, OFFERS if role == "offer" else NEEDS)
+            matcher.add(msg, role)
+            rescan.terms[msg_id] = (role, msg["category"], extract_terms(msg["content"]))
+
+        timings, matched = [], 0
+        lookups, scanned = matcher.lookups, matcher.scanned
+        for i in range(args.probes):
+            role = "offer" if i % 2 else "need"
+            msg = make_message(rng, size + i, OFFERS if role == "offer" else NEEDS)
+            start = time.perf_counter()
+            matched += bool(matcher.add(msg, role))
+            timings.append(time.perf_counter() - start)
+        timings.sort()
+        avg_scanned = (matcher.scanned - scanned) / max(matcher.lookups - lookups, 1)
+
+        start = time.perf_counter()
+        probes = min(args.probes, 50)
+        for i in range(probes):
+            role = "offer" if i % 2 else "need"
+            rescan.add(make_message(rng, size + args.probes + i, OFFERS if role == "offer" else NEEDS), role)
+        rescan_ms = (time.perf_counter() - start) / probes * 1000
+
+        print(f"{size:>7}{sum(timings) / len(timings) * 1000:>10.2f}{timings[int(len(timings) * 0.95)] * 1000:>9.2f}"
+              f"{avg_scanned:>9.0f}{rescan_ms:>11.2f}{matched / args.probes:>9.0%}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,324 @@
+# bench_mesh.py - End-to-end load test of portal, router and aid provider on a simulated mesh
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from aid_provider_portal import AidProviderInterface
+from gemnet_core_router import RouterNode
+from gemnet_outbox import AirtimeBudget
+from gemnet_runtime import NodeRuntime
+from gemnet_transport import SimMesh
+from gemnet_user_portal import UserInterface
+from stub_ollama import StubOllama
+
+# (type, language, text as typed, English translation); {n} keeps every message distinct
+MESSAGES = [
+    ("EMERGENCY", "English", "Building collapsed on {n} Main street, 3 people trapped", None),
+    ("EMERGENCY", "Spanish", "Hay un incendio en la casa {n} de la calle Mayor, la gente esta atrapada",
+     "There is a fire in house {n} on Main street, people are trapped"),
+    ("EMERGENCY", "French", "Mon pere ne respire plus, nous sommes au {n} rue de l'ecole, envoyez une ambulance",
+     "My father is not breathing, we are at {n} school street, send an ambulance"),
+    ("REQUEST", "English", "Need drinking water at shelter {n}, 40 people", None),
+    ("REQUEST", "Haitian Creole", "Nou bezwen dlo ak manje pou timoun yo nan abri {n} la",
+     "We need water and food for the children at shelter {n}"),
+    ("REQUEST", "Portuguese", "Precisamos de remedios e cobertores no abrigo {n}, ha idosos doentes",
+     "We need medicine and blankets at shelter {n}, there are sick elderly people"),
+    ("OFFER", "English", "I can offer rides in my truck to the hospital from block {n}", None),
+    ("OFFER", "German", "Wir haben Decken und Zelte in der Kirche {n}, bitte abholen",
+     "We have blankets and tents at church {n}, please collect"),
+]
+
+ROUTER_ID = "!a0cc6e10"  # The portals start out knowing only this router, the rest announce themselves
+AID_ID = "!db29d0f4"
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+def tune_outbox(outbox, args):
+    """Pace and retry at the simulated preset's speed instead of LongFast defaults"""
+    outbox.budget = AirtimeBudget(args.duty_cycle, burst=10.0, bitrate=args.bitrate, overhead=args.overhead)
+    outbox.ack_timeout = args.ack_timeout
+    outbox.backoff = args.ack_timeout / 2
+    outbox.max_backoff = args.ack_timeout * 4
+
+def on_node(node, fn, *args):
+    """Call a node method from a benchmark thread, on the node's event loop if it has one"""
+    return node.runtime.submit(fn, *args) if node.runtime else fn(*args)
+
+def kill(router):
+    """Stop a router as a crash or power loss would: no more classification, sends or heartbeats"""
+    on_node(router, router.stop_workers)
+    router.outbox.close()
+    router.interface.close()
+    if router.runtime:
+        router.runtime.stop()
+
+REPEATS = ("Please help! {}", "{} Hurry", "Again: {}", "{} Still waiting")  # Re-reports by other people
+
+def build_workload(count, seed, repeat=0.0, users=1):
+    """count (type, text) messages, one distinct house/shelter number each, message n sent by user n % users
+
+    With probability repeat a message instead re-reports one of the last 20
+    emergencies or requests of other users, slightly reworded, as other
+    people near the same event would.
+    """
+    rng = random.Random(seed)
+    workload = []
+    canned = {}
+    reportable = []
+    for n in range(count):
+        others = [(msg_type, text) for sender, msg_type, text in reportable[-20:] if sender != n % users]
+        if others and rng.random() < repeat:
+            msg_type, text = rng.choice(others)
+            reworded = rng.choice(REPEATS).format(text)
+            if text in canned:
+                canned[reworded] = canned[text]
+            workload.append((msg_type, reworded))
+            continue
+        msg_type, language, text, english = rng.choice(MESSAGES)
+        text = text.format(n=n + 1)
+        if english:
+            canned[text] = f"LANGUAGE: {language}\nTRANSLATION: {english.format(n=n + 1)}"
+        workload.append((msg_type, text))
+        if msg_type != "OFFER":
+            reportable.append((n % users, msg_type, text))
+    return workload, canned
+
+def main():
+    parser = argparse.ArgumentParser(description="Drive synthetic multi-language traffic through all three nodes")
+    parser.add_argument("--messages", type=int, default=1000)
+    parser.add_argument("--rate", type=float, default=5.0, help="offered messages/s across all users")
+    parser.add_argument("--users", type=int, default=10, help="user portals on the mesh")
+    parser.add_argument("--routers", type=int, default=1, help="router nodes, each with its own stub Ollama")
+    parser.add_argument("--heartbeat", type=float, default=5.0, help="router heartbeat interval in seconds")
+    parser.add_argument("--kill-router", type=float, metavar="SECONDS",
+                        help="stop the first router this long into the run to exercise failover")
+    parser.add_argument("--wire-format", choices=("binary", "text"), default="binary")
+    parser.add_argument("--repeat", type=float, default=0.0,
+                        help="share of messages re-reporting a recent emergency or request, to exercise incidents")
+    parser.add_argument("--preclassify", choices=("rules", "llm"), help="portals send their own analysis along")
+    parser.add_argument("--runtime", choices=("threads", "async"), default="threads",
+                        help="run each node on threads, or on its own gemnet_runtime event loop as run() does")
+    parser.add_argument("--models", default="gemma:2b", help="router models, largest first, comma-separated")
+    parser.add_argument("--portal-models", default="gemma:2b", help="portal models, largest first, e.g. gemma:7b,gemma:2b")
+    parser.add_argument("--large-speed", type=float, default=0.25, help="stub speed of gemma:7b relative to gemma:2b")
+    parser.add_argument("--classify-deadline", type=float, default=300, help="router ceiling on classification seconds")
+    parser.add_argument("--sender-rate", type=float, default=0.0,
+                        help="router messages/s allowed per sender before bursts are folded (0: no limit)")
+    parser.add_argument("--sender-burst", type=int, default=4)
+    parser.add_argument("--latency", type=float, default=0.3, help="mesh latency per hop in seconds")
+    parser.add_argument("--jitter", type=float, default=0.2)
+    parser.add_argument("--loss", type=float, default=0.02, help="frame loss probability")
+    parser.add_argument("--frame-size", type=int, default=233)
+    parser.add_argument("--bitrate", type=float, default=21875, help="channel bit/s (ShortTurbo ~21.9k, LongFast ~1k)")
+    parser.add_argument("--overhead", type=float, default=0.02, help="preamble seconds per frame")
+    parser.add_argument("--duty-cycle", type=float, default=1.0, help="per-node airtime share, e.g. 0.1 for EU868")
+    parser.add_argument("--ack-timeout", type=float, default=5.0)
+    parser.add_argument("--token-rate", type=float, default=200.0, help="stub generated tokens/s")
+    parser.add_argument("--prefill-rate", type=float, default=2000.0, help="stub prompt tokens/s")
+    parser.add_argument("--drain", type=float, default=60.0, help="max seconds to wait for stragglers")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    workload, canned = build_workload(args.messages, args.seed, args.repeat, args.users)
+    model_speed = {"gemma:7b": args.large_speed}
+    router_llms = [StubOllama(prefill_rate=args.prefill_rate, token_rate=args.token_rate, overhead=0.05,
+                              model_speed=model_speed).start()
+                   for _ in range(args.routers)]
+    portal_llm = StubOllama(prefill_rate=args.prefill_rate, token_rate=args.token_rate, overhead=0.05,
+                            canned=canned, model_speed=model_speed).start()
+    mesh = SimMesh(latency=args.latency, jitter=args.jitter, loss=args.loss, frame_size=args.frame_size,
+                   bitrate=args.bitrate, duty_cycle=args.duty_cycle, overhead=args.overhead, seed=args.seed)
+
+    routers = []
+    for i, llm in enumerate(router_llms):
+        router = RouterNode(transport=mesh.transport(f"!a0cc{0x6e10 + i:04x}"), wire_format=args.wire_format,
+                            stats_interval=0, heartbeat_interval=args.heartbeat, cache_path=None, outbox_path=None,
+                            log_path=None, metrics_port=None, metrics_snapshot=None, models=args.models.split(","),
+                            classify_deadline=args.classify_deadline, sender_rate=args.sender_rate,
+                            sender_burst=args.sender_burst)
+        router.aid_provider_id = AID_ID
+        router.ollama.url = llm.url
+        routers.append(router)
+    aid = AidProviderInterface(transport=mesh.transport(AID_ID), wire_format=args.wire_format, store_path=":memory:",
+                               outbox_path=None, metrics_port=None, metrics_snapshot=None)
+    users = []
+    for i in range(args.users):
+        user = UserInterface(transport=mesh.transport(f"!b0{i:06x}"), wire_format=args.wire_format, outbox_path=None,
+                             translation_cache_path=None, metrics_port=None, metrics_snapshot=None,
+                             routers=[ROUTER_ID], heartbeat_interval=args.heartbeat, preclassify=args.preclassify,
+                             models=args.portal_models.split(","))
+        user.ollama.url = portal_llm.url
+        users.append(user)
+
+    # First arrival of each trace id at the aid provider
+    arrivals = {}
+    store_message = aid.store_message
+
+    def record_arrival(*fields, trace=None, **kwargs):
+        if trace:
+            arrivals.setdefault(trace, time.time())
+        return store_message(*fields, trace=trace, **kwargs)
+    aid.store_message = record_arrival
+    add_reporters = aid.add_reporters
+
+    def record_reporters(msg, members):
+        for _, trace in members:
+            if trace:
+                arrivals.setdefault(trace, time.time())
+        return add_reporters(msg, members)
+    aid.add_reporters = record_reporters
+    handle_wire_message = aid.handle_wire_message
+
+    def record_update(msg, sender_id):
+        if msg['kind'] == "CORRECTION":  # A follow-up or folded burst updating a route
+            for trace in [msg.get('trace')] + [trace for _, trace in msg.get('members', [])]:
+                if trace:
+                    arrivals.setdefault(trace, time.time())
+        return handle_wire_message(msg, sender_id)
+    aid.handle_wire_message = record_update
+
+    sent = {}  # trace id -> send time
+    sent_types = {}
+    for user in users:
+        def record_send(msg_type, text, analysis=None, user=user, send_to_router=user.send_to_router):
+            send_to_router(msg_type, text, analysis)
+            trace = next(reversed(user.traces))
+            sent[trace] = user.traces[trace]
+            sent_types[trace] = msg_type
+        user.send_to_router = record_send
+    print(f"{args.messages} messages at {args.rate:g}/s from {args.users} users to {args.routers} router(s), "
+          f"{args.wire_format} wire format, {args.preclassify or 'no'} pre-classification, {args.runtime} runtime")
+    print(f"mesh: {args.latency}s +- {args.jitter}s per hop, {args.loss:.0%} loss, {args.bitrate:g} bit/s, "
+          f"duty cycle {args.duty_cycle:g}\n")
+
+    devnull = open(os.devnull, "w")
+    sys.stdout = devnull  # The nodes narrate every message
+    try:
+        # Routers last, so their first heartbeat at connect reaches portals already listening
+        for node in [aid] + users + routers:
+            if args.runtime == "async":
+                runtime = NodeRuntime(node.__class__.__name__)
+                runtime.start()
+                runtime.submit(node.connect, runtime)
+            else:
+                node.connect()
+            tune_outbox(node.outbox, args)
+        time.sleep(args.latency + args.jitter + 1)  # Let the first heartbeats reach the portals
+
+        def drive(user, items):
+            send = {"EMERGENCY": user.send_emergency, "REQUEST": user.send_request, "OFFER": user.send_offer}
+            for due, msg_type, text in items:
+                time.sleep(max(due - time.time(), 0))
+                if user.runtime:
+                    user.runtime.call_soon(send[msg_type], text)  # Translation runs as a task on the portal's loop
+                else:
+                    send[msg_type](text)
+
+        start = time.time()
+        if args.kill_router is not None:
+            threading.Timer(args.kill_router, kill, [routers[0]]).start()
+        plans = defaultdict(list)
+        for n, (msg_type, text) in enumerate(workload):
+            plans[n % args.users].append((start + n / args.rate, msg_type, text))
+        drivers = [threading.Thread(target=drive, args=(users[i], items), daemon=True) for i, items in plans.items()]
+        for driver in drivers:
+            driver.start()
+        for driver in drivers:
+            driver.join()
+        offered = time.time() - start
+
+        # Wait for in-flight routes and retries, stop once nothing has arrived for a while
+        deadline = time.time() + args.drain
+        last_count, last_change = -1, time.time()
+        # On the async runtime sends still translating are not in sent yet, so wait for the whole workload
+        while time.time() < deadline and len(arrivals) < len(workload):
+            if len(arrivals) != last_count:
+                last_count, last_change = len(arrivals), time.time()
+            elif time.time() - last_change > max(args.ack_timeout * 4, 10):
+                break
+            time.sleep(0.5)
+    finally:
+        sys.stdout = sys.__stdout__
+
+    latencies = defaultdict(list)
+    for trace, sent_at in sent.items():
+        if trace in arrivals:
+            latency = arrivals[trace] - sent_at
+            latencies["all"].append(latency)
+            latencies[sent_types[trace]].append(latency)
+    delivered = len(latencies["all"])
+    span = (max(arrivals.values()) - start) if arrivals else 0.0
+
+    print(f"offered: {args.messages} in {offered:.1f}s ({args.messages / offered:.2f} msg/s)")
+    print(f"delivered: {delivered}/{len(workload)}, lost {len(workload) - delivered} "
+          f"({(len(workload) - delivered) / max(len(workload), 1):.1%}), "
+          f"throughput {delivered / span if span else 0:.2f} msg/s\n")
+    print(f"{'latency s':<12}{'count':>7}{'p50':>8}{'p95':>8}{'p99':>8}{'max':>8}")
+    for label in ["all"] + sorted(k for k in latencies if k != "all"):
+        values = latencies[label]
+        print(f"{label:<12}{len(values):>7}{percentile(values, 50):>8.2f}{percentile(values, 95):>8.2f}"
+              f"{percentile(values, 99):>8.2f}{max(values):>8.2f}")
+
+    mesh_stats = mesh.stats()
+    print(f"\nmesh: {mesh_stats['frames']} frames, {mesh_stats['lost']} lost, {mesh_stats['duty_dropped']} over duty cycle, "
+          f"{mesh_stats['acks']} ACKs, channel {mesh_stats['utilisation']:.0%} busy")
+    for router, llm in zip(routers, router_llms):
+        queue_stats = router.ingest.stats()
+        incidents = router.incidents.stats()
+        print(f"router {router.interface.node_id}: {router.route_counter} routes, {queue_stats['processed']} classified "
+              f"by the LLM, {queue_stats['dropped']} LLM refinements dropped by backpressure, {llm.requests} Ollama calls, "
+              f"{incidents['joined']} reports folded into incidents")
+        senders = router.senders.stats()
+        print(f"  senders: {senders['senders']} tracked, {senders['followups']} follow-ups folded into their route, "
+              f"{senders['limited']} rate-limited messages held and released in {senders['folded']} burst(s)")
+    for label, nodes in (("router", routers), ("portal", users)):
+        plans, misses = defaultdict(int), defaultdict(int)
+        for node in nodes:
+            for key, entry in node.models.stats().items():
+                plans[key] += entry['planned']
+                misses[key] += entry['missed']
+        print(f"{label} models: " + ", ".join(f"{key} {plans[key]} ({misses[key]} late)" for key in sorted(plans)))
+    outcomes = defaultdict(int)
+    for router in routers:
+        for (name, labels), count in router.metrics.counters.items():
+            if name == "classify_deadline_total":
+                outcomes[dict(labels)['outcome']] += count
+    print(f"router classification deadlines: {outcomes['met']} met, {outcomes['missed']} missed "
+          f"({outcomes['missed'] / max(outcomes['met'] + outcomes['missed'], 1):.1%})")
+    redispatched = sum(user.metrics.counters.get(("redispatches_total", ()), 0) for user in users)
+    print(f"failover: {redispatched} re-dispatched, {aid.dedup.stats()['content_duplicates']} duplicates merged "
+          f"by the aid provider")
+    for name, node in [(f"router{i}", r) for i, r in enumerate(routers)] + [("aid", aid)] + \
+            [(f"user{i}", u) for i, u in enumerate(users[:3])]:
+        stats = node.outbox.stats()
+        print(f"outbox {name:<7} sent={stats['sent']} delivered={stats['delivered']} retries={stats['retries']} "
+              f"failed={stats['failed']} pending={stats['pending']}")
+
+    sys.stdout = devnull
+    try:
+        for router in routers:
+            if router.running:
+                on_node(router, router.stop_workers)
+        for node in routers + users:
+            if not node.runtime or node.runtime.thread.is_alive():
+                on_node(node, node.ollama.close)
+        for node in routers + [aid] + users:
+            node.outbox.close()
+            if node.runtime:
+                node.runtime.stop()
+        aid.store.close()
+        mesh.close()
+    finally:
+        sys.stdout = sys.__stdout__
+    for llm in router_llms + [portal_llm]:
+        llm.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+# bench_wire.py - Legacy pipe-delimited text vs binary frames for routed messages
+import argparse
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from gemnet_classifier import classify_rules
+from gemnet_core_router import RouterNode
+from gemnet_wire import Reassembler, WireEncoder
+
+MESSAGES = [
+    ("EMERGENCY", "Building collapsed on 5th street, 3 people trapped"),
+    ("REQUEST", "Need drinking water at shelter 3, 40 people"),
+    ("OFFER", "I can offer rides in my truck to the hospital"),
+    ("EMERGENCY", "My father is having a heart attack, not breathing, we are at 14 Oak Avenue behind the pharmacy, "
+                  "please send an ambulance, the road from the north is flooded so come from the highway side"),
+    ("REQUEST", "Baby formula and diapers needed for 6 infants at the community center on Pine road, also "
+                "clean water, blankets, a generator if anyone has one, and insulin for an elderly diabetic resident"),
+    ("EMERGENCY", "Flood water rising fast at 12 Elm street, family of five on the roof including a grandmother "
+                  "who cannot swim and a toddler, water is at the gutters now and still coming up, we have a "
+                  "flashlight and can signal, neighbours at 10 and 16 Elm are also stuck on their roofs, "
+                  "please send a boat, the current is too strong to wade and the power lines are down across the road"),
+]
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare legacy text and binary wire formats")
+    parser.add_argument("--rounds", type=int, default=200, help="shuffled/duplicated reassembly rounds")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    router = RouterNode(cache_path=None, outbox_path=None, log_path=None, metrics_port=None, metrics_snapshot=None)
+    encoder = WireEncoder()
+    rng = random.Random(args.seed)
+    origin = "!a0cc8628"
+
+    print(f"{'type':<10}{'chars':>6}{'text B':>8}{'lost':>6}{'bin B':>7}{'frames':>7}")
+    totals = {"text": 0, "binary": 0, "lost": 0}
+    messages = []
+    for i, (msg_type, content) in enumerate(MESSAGES):
+        analysis = classify_rules(content, msg_type)
+        ref = format(i + 1, "x")
+        routed = router.format_routed(msg_type, origin, content, analysis, ref)
+        text = routed.encode()
+        sent = routed.split("|")[3]
+        lost = len(content) - len(sent) + 3 if sent != content else 0  # Characters cut for the "..."
+        msg = {"kind": "ROUTED", "msg_type": msg_type, "category": analysis["category"],
+               "priority": analysis["priority"], "urgency": analysis["urgency"], "origin": origin,
+               "ref": ref, "text": content, "summary": analysis["summary"]}
+        frames = encoder.encode(msg)
+        size = sum(len(f) for f in frames)
+        messages.append((msg, frames))
+        totals["text"] += len(text)
+        totals["binary"] += size
+        totals["lost"] += lost
+        print(f"{msg_type:<10}{len(content):>6}{len(text):>8}{lost:>6}{size:>7}{len(frames):>7}")
+    print(f"{'total':<10}{'':>6}{totals['text']:>8}{totals['lost']:>6}{totals['binary']:>7}")
+
+    # Deliver every message's frames shuffled, with random duplicates, and check exact round trips
+    reassembler = Reassembler()
+    delivered = intact = 0
+    for _ in range(args.rounds):
+        msg, _ = rng.choice(messages)
+        frames = encoder.encode(msg)
+        frames += [rng.choice(frames) for _ in range(rng.randint(0, 2))]
+        rng.shuffle(frames)
+        for frame in frames:
+            result = reassembler.add("!a0cc6e10", frame)
+            if result:
+                delivered += 1
+                intact += all(result.get(k) == v for k, v in msg.items())
+    stats = reassembler.stats()
+    print(f"\nreassembly: {args.rounds} sent, {delivered} delivered, {intact} intact, "
+          f"{stats['duplicates']} duplicates dropped, {stats['errors']} errors")
+
+if __name__ == "__main__":
+    main()
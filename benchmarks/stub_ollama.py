@@ -0,0 +1,163 @@
+# stub_ollama.py - Local stand-in for the Ollama /api/generate endpoint
+import json
+import os
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from gemnet_classifier import classify_rules
+
+BATCH_LINE = re.compile(r'^(\d+)\. \[(\w+)\] "(.*)"$', re.MULTILINE)
+SINGLE_TYPE = re.compile(r'^Message Type: (\w+)$', re.MULTILINE)
+SINGLE_MESSAGE = re.compile(r'^Message: "(.*)"$', re.MULTILINE)
+TRANSLATE_TEXT = re.compile(r'^Text: "(.*)"$', re.MULTILINE)
+
+def estimate_tokens(text):
+    """Rough token count, ~4 characters per token"""
+    return max(1, len(text) // 4)
+
+class StubOllama:
+    """Threaded HTTP server answering classification prompts with rule-based JSON
+
+    Latency follows a simple model of a single-GPU Ollama instance: requests
+    are served one at a time, each costing overhead + prompt tokens at
+    prefill_rate + generated tokens at token_rate. Like a small model, the
+    output keeps going with trailer text after the answer; streaming clients
+    that disconnect early cut generation short.
+
+    canned maps the text of a portal translation prompt to the exact model
+    output to return for it; other translation prompts echo the text back
+    as English. model_speed maps a model name to its speed relative to the
+    rates given (0.25 for a model four times slower), 1 for unlisted models.
+    """
+    TRAILER = ("\n\nExplanation: The message was classified based on its content, "
+               "the resources mentioned and how urgent the situation appears to be.")
+
+    def __init__(self, host="127.0.0.1", port=0, prefill_rate=400.0, token_rate=40.0, overhead=0.2, trailer=TRAILER,
+                 canned=None, model_speed=None):
+        self.canned = canned or {}
+        self.model_speed = model_speed or {}
+        self.prefill_rate = prefill_rate
+        self.token_rate = token_rate
+        self.overhead = overhead
+        self.trailer = trailer
+        self.model_lock = threading.Lock()
+        self.requests = 0
+        self.cancelled = 0
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/api/generate"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def generate(self, prompt):
+        """Canned model output for a prompt"""
+        batch = BATCH_LINE.findall(prompt)
+        if batch:
+            analyses = []
+            for index, msg_type, message in batch:
+                analysis = classify_rules(message, msg_type)
+                analysis.pop("confidence")
+                analyses.append(dict(index=int(index), **analysis))
+            return json.dumps(analyses, indent=1) + self.trailer
+
+        message = SINGLE_MESSAGE.search(prompt)
+        if message:
+            msg_type = SINGLE_TYPE.search(prompt)
+            analysis = classify_rules(message.group(1), msg_type.group(1) if msg_type else "GENERAL")
+            analysis.pop("confidence")
+            return json.dumps(analysis, indent=2) + self.trailer
+
+        text = TRANSLATE_TEXT.search(prompt)
+        if text:
+            if text.group(1) in self.canned:
+                return self.canned[text.group(1)] + self.trailer
+            if re.search(r'^TRANSLATION: ', prompt, re.MULTILINE):
+                return f"LANGUAGE: English\nTRANSLATION: {text.group(1)}" + self.trailer
+            return text.group(1) + self.trailer
+
+        return "OK" + self.trailer
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                prompt = body.get("prompt", "")
+                output = stub.generate(prompt)
+                prompt_tokens = estimate_tokens(prompt)
+                output_tokens = estimate_tokens(output)
+                speed = stub.model_speed.get(body.get("model"), 1.0)
+
+                with stub.model_lock:
+                    stub.requests += 1
+                    time.sleep((stub.overhead + prompt_tokens / stub.prefill_rate) / speed)
+                    if body.get("stream", True):
+                        self.stream(body, output, prompt_tokens, speed)
+                    else:
+                        time.sleep(output_tokens / stub.token_rate / speed)
+                        self.reply(json.dumps({
+                            "model": body.get("model"),
+                            "response": output,
+                            "done": True,
+                            "prompt_eval_count": prompt_tokens,
+                            "eval_count": output_tokens
+                        }).encode() + b"\n")
+
+            def reply(self, payload):
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def stream(self, body, output, prompt_tokens, speed=1.0):
+                """Newline-delimited JSON chunks, ~4 characters per token"""
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                pieces = [output[i:i + 4] for i in range(0, len(output), 4)]
+                try:
+                    for piece in pieces:
+                        time.sleep(1 / stub.token_rate / speed)
+                        self.chunk({"model": body.get("model"), "response": piece, "done": False})
+                    self.chunk({"model": body.get("model"), "response": "", "done": True,
+                                "prompt_eval_count": prompt_tokens, "eval_count": len(pieces)})
+                    self.wfile.write(b"0\r\n\r\n")
+                except (BrokenPipeError, ConnectionResetError):
+                    stub.cancelled += 1
+
+            def chunk(self, obj):
+                data = json.dumps(obj).encode() + b"\n"
+                self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+                self.wfile.flush()
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+if __name__ == "__main__":
+    stub = StubOllama(port=11434).start()
+    print(f"Stub Ollama listening on {stub.url}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        stub.stop()
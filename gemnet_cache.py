@@ -0,0 +1,298 @@
+# gemnet_cache.py - Persistent caches for LLM classifications and translations
+import json
+import random
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from gemnet_classifier import DEFAULT_RESOURCES, normalize_analysis
+
+MERSENNE_PRIME = (1 << 61) - 1
+
+def normalize_text(text):
+    """Lowercase, drop punctuation and collapse whitespace"""
+    return " ".join(re.sub(r"[^\w\s]", " ", text.lower()).split())
+
+def shingles(text, n=3):
+    """Character n-grams of normalised text, padded so short messages still shingle"""
+    padded = f" {text} "
+    if len(padded) <= n:
+        return {padded}
+    return {padded[i:i + n] for i in range(len(padded) - n + 1)}
+
+class MinHasher:
+    """MinHash signatures over character shingles, stable across restarts"""
+    def __init__(self, num_perm=64, ngram=3, seed=1):
+        rng = random.Random(seed)
+        self.ngram = ngram
+        self.perms = [(rng.randrange(1, MERSENNE_PRIME), rng.randrange(0, MERSENNE_PRIME)) for _ in range(num_perm)]
+
+    def signature(self, text):
+        hashes = [zlib.crc32(s.encode()) for s in shingles(text, self.ngram)]
+        return tuple(min((a * h + b) % MERSENNE_PRIME for h in hashes) for a, b in self.perms)
+
+    @staticmethod
+    def similarity(sig_a, sig_b):
+        """Estimated Jaccard similarity of two signatures"""
+        return sum(1 for a, b in zip(sig_a, sig_b) if a == b) / len(sig_a)
+
+class ClassificationCache:
+    """Analysis cache keyed on normalised text, with MinHash LSH for near-duplicates
+
+    Exact hits need the same message type and normalised text. Near hits need
+    the same message type and an estimated Jaccard similarity of at least
+    threshold; they reuse only the category, priority and urgency of the
+    cached analysis, while the summary comes from the new text and the
+    resources from the category, since "12 people at 9th street" is not
+    "3 people at 5th street". Entries are evicted least-recently-used
+    beyond max_entries and after ttl seconds. With a path, entries are
+    written through to SQLite and reloaded on start; a hit's last use is
+    written with the next put() or close(), not on the lookup.
+    """
+    def __init__(self, path=None, threshold=0.7, max_entries=5000, ttl=6 * 3600, num_perm=64, bands=16):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.hasher = MinHasher(num_perm=num_perm)
+        self.entries = OrderedDict()  # key -> entry dict, oldest use first
+        self.buckets = {}  # (msg_type, band, band hash) -> set of keys
+        self.touched = {}  # key -> last use not yet written to SQLite, saved with the next put() or close()
+        self.lock = threading.Lock()
+
+        self.lookups = 0
+        self.exact_hits = 0
+        self.near_hits = 0
+        self.saved_seconds = 0.0
+
+        self.db = None
+        if path:
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute("""CREATE TABLE IF NOT EXISTS classification_cache (
+                key TEXT PRIMARY KEY, msg_type TEXT, analysis TEXT, signature TEXT,
+                cost REAL, created REAL, last_used REAL)""")
+            self.db.commit()
+            self.load()
+
+    def _key(self, text, msg_type):
+        return f"{msg_type}|{normalize_text(text)}"
+
+    def _band_keys(self, msg_type, signature):
+        return [(msg_type, band, hash(signature[band * self.rows:(band + 1) * self.rows])) for band in range(self.bands)]
+
+    def _index(self, key, entry):
+        self.entries[key] = entry
+        for band_key in self._band_keys(entry["msg_type"], entry["signature"]):
+            self.buckets.setdefault(band_key, set()).add(key)
+
+    def _remove(self, key):
+        entry = self.entries.pop(key)
+        self.touched.pop(key, None)
+        for band_key in self._band_keys(entry["msg_type"], entry["signature"]):
+            bucket = self.buckets.get(band_key)
+            if bucket:
+                bucket.discard(key)
+                if not bucket:
+                    del self.buckets[band_key]
+        if self.db:
+            self.db.execute("DELETE FROM classification_cache WHERE key = ?", (key,))
+
+    def _expired(self, entry, now):
+        return self.ttl and now - entry["created"] > self.ttl
+
+    def load(self):
+        """Reload unexpired entries from SQLite, most recently used last"""
+        now = time.time()
+        rows = self.db.execute("""SELECT key, msg_type, analysis, signature, cost, created FROM classification_cache
+            WHERE created > ? ORDER BY last_used DESC LIMIT ?""", (now - self.ttl if self.ttl else 0, self.max_entries)).fetchall()
+        for key, msg_type, analysis, signature, cost, created in reversed(rows):
+            self._index(key, {
+                "msg_type": msg_type,
+                "analysis": json.loads(analysis),
+                "signature": tuple(json.loads(signature)),
+                "cost": cost,
+                "created": created
+            })
+        self.db.execute("DELETE FROM classification_cache WHERE created <= ?", (now - self.ttl if self.ttl else 0,))
+        self.db.commit()
+        print(f"[CACHE] Loaded {len(rows)} cached classification(s)")
+
+    def get(self, text, msg_type):
+        """Cached analysis for text, returns (analysis, "exact"|"near") or (None, None)"""
+        key = self._key(text, msg_type)
+        now = time.time()
+        with self.lock:
+            self.lookups += 1
+            entry = self.entries.get(key)
+            if entry and self._expired(entry, now):
+                self._remove(key)
+                entry = None
+            if entry:
+                self.entries.move_to_end(key)
+                self.exact_hits += 1
+                self.saved_seconds += entry["cost"]
+                self._touch(key, now)
+                return dict(entry["analysis"]), "exact"
+
+            # Near-duplicate: candidates share at least one LSH band
+            signature = self.hasher.signature(key.split("|", 1)[1])
+            candidates = set()
+            for band_key in self._band_keys(msg_type, signature):
+                candidates |= self.buckets.get(band_key, set())
+
+            best_key, best_sim = None, self.threshold
+            for candidate in candidates:
+                sim = MinHasher.similarity(signature, self.entries[candidate]["signature"])
+                if sim >= best_sim:
+                    best_key, best_sim = candidate, sim
+            if best_key is None:
+                return None, None
+            entry = self.entries[best_key]
+            if self._expired(entry, now):
+                self._remove(best_key)
+                return None, None
+            self.entries.move_to_end(best_key)
+            self.near_hits += 1
+            self.saved_seconds += entry["cost"]
+            self._touch(best_key, now)
+            cached = {field: entry["analysis"][field] for field in ("category", "priority", "urgency")
+                      if field in entry["analysis"]}
+        cached.update(summary=" ".join(text.split())[:60],
+                      resources_needed=DEFAULT_RESOURCES.get(cached.get("category")))
+        return normalize_analysis(cached, text, msg_type), "near"
+
+    def _touch(self, key, now):
+        if self.db:
+            self.touched[key] = now
+
+    def _save_touched(self):
+        self.db.executemany("UPDATE classification_cache SET last_used = ? WHERE key = ?",
+                            [(used, key) for key, used in self.touched.items()])
+        self.touched.clear()
+
+    def put(self, text, msg_type, analysis, cost=0.0):
+        """Store an LLM analysis along with the seconds it took to produce"""
+        key = self._key(text, msg_type)
+        now = time.time()
+        entry = {
+            "msg_type": msg_type,
+            "analysis": dict(analysis),
+            "signature": self.hasher.signature(key.split("|", 1)[1]),
+            "cost": cost,
+            "created": now
+        }
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self._index(key, entry)
+            while len(self.entries) > self.max_entries:
+                self._remove(next(iter(self.entries)))
+            if self.db:
+                self.db.execute("INSERT OR REPLACE INTO classification_cache VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                (key, msg_type, json.dumps(entry["analysis"]), json.dumps(entry["signature"]),
+                                 cost, now, now))
+                self._save_touched()
+                self.db.commit()
+
+    def stats(self):
+        """Hit rate and LLM seconds saved"""
+        with self.lock:
+            hits = self.exact_hits + self.near_hits
+            return {
+                "entries": len(self.entries),
+                "lookups": self.lookups,
+                "exact_hits": self.exact_hits,
+                "near_hits": self.near_hits,
+                "hit_rate": hits / self.lookups if self.lookups else 0.0,
+                "saved_seconds": self.saved_seconds
+            }
+
+    def close(self):
+        with self.lock:
+            if self.db:
+                self._save_touched()
+                self.db.commit()
+                self.db.close()
+                self.db = None
+
+class TranslationCache:
+    """Bounded LRU of translations keyed on (text, source, target), written through to SQLite
+
+    Hits only reorder the LRU in memory; their last use reaches SQLite with
+    the next put() or close().
+    """
+    def __init__(self, path=None, max_entries=2000):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.touched = {}  # key -> last use not yet written to SQLite
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        self.db = None
+        if path:
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute("""CREATE TABLE IF NOT EXISTS translation_cache (
+                text TEXT, source TEXT, target TEXT, translation TEXT, last_used REAL,
+                PRIMARY KEY (text, source, target))""")
+            rows = self.db.execute("""SELECT text, source, target, translation FROM translation_cache
+                ORDER BY last_used DESC LIMIT ?""", (max_entries,)).fetchall()
+            for text, source, target, translation in reversed(rows):
+                self.entries[(text, source, target)] = translation
+            self.db.commit()
+
+    def get(self, text, source, target):
+        key = (text.strip(), source, target)
+        with self.lock:
+            translation = self.entries.get(key)
+            if translation is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(key)
+            if self.db:
+                self.touched[key] = time.time()
+            return translation
+
+    def _save_touched(self):
+        self.db.executemany("UPDATE translation_cache SET last_used = ? WHERE text = ? AND source = ? AND target = ?",
+                            [(used,) + key for key, used in self.touched.items()])
+        self.touched.clear()
+
+    def put(self, text, source, target, translation):
+        key = (text.strip(), source, target)
+        with self.lock:
+            self.entries[key] = translation
+            self.entries.move_to_end(key)
+            evicted = []
+            while len(self.entries) > self.max_entries:
+                evicted.append(self.entries.popitem(last=False)[0])
+                self.touched.pop(evicted[-1], None)
+            if self.db:
+                self.touched.pop(key, None)
+                self.db.execute("INSERT OR REPLACE INTO translation_cache VALUES (?, ?, ?, ?, ?)",
+                                key + (translation, time.time()))
+                self.db.executemany("DELETE FROM translation_cache WHERE text = ? AND source = ? AND target = ?", evicted)
+                self._save_touched()
+                self.db.commit()
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0
+            }
+
+    def close(self):
+        with self.lock:
+            if self.db:
+                self._save_touched()
+                self.db.commit()
+                self.db.close()
+                self.db = None
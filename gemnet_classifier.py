@@ -0,0 +1,283 @@
+# gemnet_classifier.py - Message classification shared by the GemNet nodes
+import json
+import re
+
+CATEGORIES = ("MEDICAL", "FIRE", "RESCUE", "SUPPLIES", "SHELTER", "TRANSPORT", "OTHER")
+URGENCIES = ("IMMEDIATE", "HIGH", "MEDIUM", "LOW")
+
+# Per category: (strong phrase patterns, keyword stems). Phrases count double.
+# Order matters, earlier categories win ties.
+CATEGORY_RULES = {
+    "MEDICAL": (
+        (r"heart attack", r"not breathing", r"can'?t breathe", r"\bcpr\b", r"\bemt\b", r"broken (?:leg|arm|bone)",
+         r"(?:leg|arm|bone)s? (?:is |are )?broken",
+         r"allergic reaction", r"\bstroke\b", r"\boverdose\b"),
+        ("injur", "bleed", "hurt", "wound", "sick", "medic", "doctor", "nurse", "ambulance", "unconscious",
+         "pain", "fever", "pregnan", "insulin", "diabet", "seizure", "burn", "fracture", "pill")
+    ),
+    "FIRE": (
+        (r"on fire", r"fire (?:spreading|is spreading)", r"wild ?fire", r"gas leak", r"\bexplosion\b"),
+        ("fire", "smoke", "flame", "burning", "blaze", "ember")
+    ),
+    "RESCUE": (
+        (r"trapped (?:in|under|inside)", r"can'?t get out", r"stuck (?:in|on|under)", r"under (?:the )?rubble",
+         r"\bcollapsed\b", r"water (?:is )?rising"),
+        ("trapped", "stuck", "rubble", "missing", "drown", "flood", "stranded", "roof", "rescue", "buried", "lost")
+    ),
+    "SUPPLIES": (
+        (r"need(?:s)? (?:food|water)", r"drinking water", r"baby formula", r"out of (?:food|water)"),
+        ("food", "water", "hungry", "thirst", "supplies", "diaper", "formula", "blanket", "battery",
+         "batteries", "generator", "fuel", "medicine", "hygiene", "clothes")
+    ),
+    "SHELTER": (
+        (r"place to (?:stay|sleep)", r"lost (?:my|our) (?:home|house)", r"house (?:destroyed|gone)"),
+        ("shelter", "homeless", "tent", "housing", "sleep", "evacuat", "roof")
+    ),
+    "TRANSPORT": (
+        (r"need(?:s)? (?:a )?ride", r"road (?:is )?(?:blocked|closed)", r"need(?:s)? transport"),
+        ("ride", "transport", "vehicle", "truck", "car", "bus", "boat", "driver", "pickup", "road", "bridge")
+    )
+}
+
+# Urgency cues, checked from most to least urgent
+URGENCY_RULES = {
+    "IMMEDIATE": (r"not breathing", r"\bunconscious\b", r"\bdying\b", r"\btrapped\b", r"heavy bleeding",
+                  r"bleeding (?:a lot|heavily|badly)", r"heart attack", r"spreading", r"right now",
+                  r"\bimmediately\b", r"\bsos\b", r"water (?:is )?rising"),
+    "HIGH": (r"\burgent", r"\basap\b", r"\bemergency\b", r"\binjur", r"\bchild", r"\bkids?\b", r"\bbab(?:y|ies)\b",
+             r"\belderly\b", r"\bpregnan", r"\bhurry\b", r"\bquickly\b"),
+    "LOW": (r"\bcan (?:offer|provide|give|help)\b", r"\bavailable\b", r"\bif anyone\b", r"\bwhen possible\b",
+            r"\bno rush\b", r"\bextra\b")
+}
+
+# Default priority per message type when no urgency cue matches
+TYPE_BASE_PRIORITY = {"EMERGENCY": 2, "REQUEST": 3, "OFFER": 4, "GENERAL": 3}
+
+DEFAULT_RESOURCES = {
+    "MEDICAL": "medical assistance",
+    "FIRE": "fire response",
+    "RESCUE": "search and rescue",
+    "SUPPLIES": "supply delivery",
+    "SHELTER": "shelter placement",
+    "TRANSPORT": "transport",
+    "OTHER": "Assessment needed"
+}
+
+PRIORITY_URGENCY = {1: "IMMEDIATE", 2: "HIGH", 3: "MEDIUM", 4: "LOW", 5: "LOW"}
+
+def _compile_category(phrases, stems):
+    strong = re.compile("|".join(phrases), re.IGNORECASE)
+    weak = re.compile(r"\b(?:" + "|".join(re.escape(s) for s in stems) + r")", re.IGNORECASE)
+    return strong, weak
+
+_CATEGORY_PATTERNS = [(name, _compile_category(*rules)) for name, rules in CATEGORY_RULES.items()]
+_URGENCY_PATTERNS = [(name, re.compile("|".join(cues), re.IGNORECASE)) for name, cues in URGENCY_RULES.items()]
+
+def classify_rules(message, msg_type="GENERAL"):
+    """Deterministic keyword/regex classification, same shape as the Ollama analysis
+
+    Runs in microseconds so the router can route before the LLM has answered.
+    The extra "confidence" field (0-1) reflects how many rules matched.
+    """
+    best = "OTHER"
+    best_score = 0
+    best_hits = []
+    for name, (strong, weak) in _CATEGORY_PATTERNS:
+        strong_hits = strong.findall(message)
+        weak_hits = weak.findall(message)
+        score = 2 * len(strong_hits) + len(weak_hits)
+        if score > best_score:
+            best, best_score = name, score
+            best_hits = [h.lower() for h in strong_hits + weak_hits]
+
+    priority = TYPE_BASE_PRIORITY.get(msg_type, 3)
+    for urgency, pattern in _URGENCY_PATTERNS:
+        if pattern.search(message):
+            if urgency == "IMMEDIATE":
+                priority = 1
+            elif urgency == "HIGH":
+                priority = min(priority, 2)
+            else:
+                priority = max(priority, 4)
+            break
+
+    if best_hits:
+        summary = f"{best.lower()}: {', '.join(dict.fromkeys(best_hits))}"[:50]
+        confidence = min(1.0, 0.3 + 0.15 * best_score)
+    else:
+        summary = message[:50]
+        confidence = 0.1
+
+    return {
+        "category": best,
+        "priority": priority,
+        "urgency": PRIORITY_URGENCY[priority],
+        "resources_needed": DEFAULT_RESOURCES[best],
+        "summary": summary,
+        "confidence": round(confidence, 2)
+    }
+
+def normalize_analysis(parsed, message, msg_type="GENERAL"):
+    """Coerce an LLM analysis into the expected shape, filling gaps from the rules"""
+    rules = classify_rules(message, msg_type)
+    analysis = dict(rules)
+    analysis.pop("confidence")
+
+    category = str(parsed.get("category", "")).strip().upper()
+    if category in CATEGORIES:
+        analysis["category"] = category
+    try:
+        analysis["priority"] = min(5, max(1, int(parsed.get("priority"))))
+    except (TypeError, ValueError):
+        pass
+    urgency = str(parsed.get("urgency", "")).strip().upper()
+    analysis["urgency"] = urgency if urgency in URGENCIES else PRIORITY_URGENCY[analysis["priority"]]
+    for key in ("resources_needed", "summary"):
+        if parsed.get(key):
+            analysis[key] = str(parsed[key])
+    return analysis
+
+def verify_analysis(claim, message, msg_type="GENERAL", agree_floor=0.6):
+    """Check an analysis made elsewhere (a user portal) against the rules, returns (analysis, confidence)
+
+    The claim is normalised like an LLM answer. Its confidence drops to 0
+    when it contradicts a confident rule match on category, or puts the
+    message more than one priority level below what the rules see, so an
+    edge node can never quietly bury an emergency. Agreement with the rules
+    raises it to at least the rules' own confidence.
+    """
+    rules = classify_rules(message, msg_type)
+    analysis = normalize_analysis(claim, message, msg_type)
+    if not claim.get("resources_needed"):
+        analysis["resources_needed"] = DEFAULT_RESOURCES[analysis["category"]]
+    try:
+        confidence = min(1.0, max(0.0, float(claim.get("confidence", 0))))
+    except (TypeError, ValueError):
+        confidence = 0.0
+
+    if analysis["category"] != rules["category"] and rules["confidence"] >= agree_floor:
+        return analysis, 0.0
+    if analysis["priority"] > rules["priority"] + 1:
+        return analysis, 0.0
+    if analysis["category"] == rules["category"]:
+        confidence = max(confidence, rules["confidence"])
+    return analysis, round(confidence, 2)
+
+ANALYSIS_FIELDS = ("category", "priority", "urgency", "resources_needed", "summary")
+
+COMPACT_CHARS = 160  # Message text kept in a compact prompt
+
+def build_prompt(message, msg_type, compact=False):
+    """Single-message classification prompt for the router model
+
+    The compact form, used when the deadline is close, trims the message
+    and asks only for the fields routing needs; the rest come from the rules.
+    """
+    if compact:
+        return f"""Classify this message as JSON.
+Message Type: {msg_type}
+Message: "{message[:COMPACT_CHARS]}"
+category: MEDICAL, FIRE, RESCUE, SUPPLIES, SHELTER, TRANSPORT or OTHER; priority: 1 (critical) to 5 (low); urgency: IMMEDIATE, HIGH, MEDIUM or LOW
+{{"category": "SUPPLIES", "priority": 3, "urgency": "MEDIUM"}}"""
+    return f"""Analyze this emergency message and return JSON.
+
+Message Type: {msg_type}
+Message: "{message}"
+
+Choose ONE category: MEDICAL, FIRE, RESCUE, SUPPLIES, SHELTER, TRANSPORT, or OTHER
+Set priority: 1 (critical) to 5 (low)
+Set urgency: IMMEDIATE, HIGH, MEDIUM, or LOW
+
+Return exactly this format:
+{{
+  "category": "SUPPLIES",
+  "priority": 3,
+  "urgency": "MEDIUM",
+  "resources_needed": "food delivery",
+  "summary": "person needs food"
+}}"""
+
+def build_batch_prompt(items, compact=False):
+    """One prompt classifying several (message, msg_type) pairs, answered as a JSON array"""
+    if compact:
+        lines = "\n".join(f'{i}. [{msg_type}] "{message[:COMPACT_CHARS]}"' for i, (message, msg_type) in enumerate(items))
+        return f"""Classify each numbered message, answer with a JSON array.
+
+Messages:
+{lines}
+
+category: MEDICAL, FIRE, RESCUE, SUPPLIES, SHELTER, TRANSPORT or OTHER; priority: 1 (critical) to 5 (low); urgency: IMMEDIATE, HIGH, MEDIUM or LOW
+[
+  {{"index": 0, "category": "SUPPLIES", "priority": 3, "urgency": "MEDIUM"}}
+]"""
+    lines = "\n".join(f'{i}. [{msg_type}] "{message}"' for i, (message, msg_type) in enumerate(items))
+    return f"""Analyze each numbered emergency message and return a JSON array.
+
+Messages:
+{lines}
+
+For each message choose ONE category: MEDICAL, FIRE, RESCUE, SUPPLIES, SHELTER, TRANSPORT, or OTHER
+Set priority: 1 (critical) to 5 (low)
+Set urgency: IMMEDIATE, HIGH, MEDIUM, or LOW
+
+Return one object per message, in order, with its index, exactly this format:
+[
+  {{"index": 0, "category": "SUPPLIES", "priority": 3, "urgency": "MEDIUM", "resources_needed": "food delivery", "summary": "person needs food"}}
+]"""
+
+def parse_analysis(result, message, msg_type):
+    """Extract the single-message JSON analysis, raises ValueError if there is none"""
+    # Extract JSON from response (Ollama might add text)
+    start = result.find('{')
+    end = result.rfind('}') + 1
+    if start >= 0 and end > start:
+        return normalize_analysis(json.loads(result[start:end]), message, msg_type)
+    raise ValueError("No JSON found in response")
+
+def extract_json_objects(text):
+    """Every top-level JSON object in text, skipping anything that does not decode"""
+    decoder = json.JSONDecoder()
+    objects = []
+    pos = text.find('{')
+    while pos >= 0:
+        try:
+            obj, end = decoder.raw_decode(text, pos)
+        except ValueError:
+            pos = text.find('{', pos + 1)
+            continue
+        if isinstance(obj, dict):
+            objects.append(obj)
+        pos = text.find('{', end)
+    return objects
+
+def parse_batch(result, items):
+    """Map a batch response onto items, returns [(analysis, parsed_ok)] in item order
+
+    Objects are matched by their "index" field, falling back to position for
+    objects without a usable index. Items left without a well-formed object
+    get the rule-based classification.
+    """
+    slots = [None] * len(items)
+    unindexed = []
+    for obj in extract_json_objects(result):
+        index = obj.get("index")
+        if isinstance(index, str) and index.strip().isdigit():
+            index = int(index)
+        if isinstance(index, int) and 0 <= index < len(items) and slots[index] is None:
+            slots[index] = obj
+        else:
+            unindexed.append(obj)
+
+    for obj in unindexed:
+        free = next((i for i, slot in enumerate(slots) if slot is None), None)
+        if free is None:
+            break
+        slots[free] = obj
+
+    results = []
+    for (message, msg_type), obj in zip(items, slots):
+        if obj and str(obj.get("category", "")).strip().upper() in CATEGORIES:
+            results.append((normalize_analysis(obj, message, msg_type), True))
+        else:
+            results.append((classify_rules(message, msg_type), False))
+    return results
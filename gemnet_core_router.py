@@ -1,117 +1,776 @@
 # router_jetson.py - Run on router Jetson (!a0cc6e10)
-import meshtastic.serial_interface
-from pubsub import pub
+import asyncio
+import math
 import requests
-import json
+import queue
+import threading
 import time
+from collections import defaultdict, deque
 from datetime import datetime
+from gemnet_cache import ClassificationCache
+from gemnet_classifier import build_batch_prompt, build_prompt, classify_rules, parse_analysis, parse_batch, verify_analysis
+from gemnet_dedup import DedupIndex
+from gemnet_dispatch import HEARTBEAT_INTERVAL
+from gemnet_incidents import IncidentTracker
+from gemnet_log import LogWriter
+from gemnet_metrics import MESH_BUCKETS, Metrics
+from gemnet_models import PRIORITY_DEADLINES, ModelSelector
+from gemnet_ollama import JsonWatcher, OllamaClient
+from gemnet_outbox import BROADCAST, NORMAL, URGENT, Outbox
+from gemnet_runtime import NodeRuntime
+from gemnet_senders import SenderTable
+from gemnet_transport import SerialTransport
+from gemnet_wire import (Reassembler, WireEncoder, WireError, add_trace, frame_from_packet, new_trace, send_message,
+                        split_analysis, split_trace)
+
+# Scheduling level per message type prefix (lower runs first)
+TYPE_PRIORITY = {
+    "EMERGENCY": 0,
+    "REQUEST": 1,
+    "GENERAL": 2,
+    "OFFER": 3
+}
+
+# Cheap pre-score: any of these bumps a message up one level before Ollama sees it
+URGENT_KEYWORDS = (
+    "trapped", "bleeding", "unconscious", "not breathing", "heart attack",
+    "dying", "fire", "collapsed", "drowning", "injured", "help now", "urgent"
+)
+
+class PriorityScheduler:
+    """Bounded priority queue between the radio callback and the classification workers
+    
+    Items are ordered by message type level plus keyword pre-score. Waiting items
+    age: every aging_interval seconds in the queue promotes them one level, so
+    OFFERs still drain under a steady stream of EMERGENCYs.
+    """
+    def __init__(self, maxsize=100, aging_interval=30):
+        self.maxsize = maxsize
+        self.aging_interval = aging_interval
+        self.levels = [deque() for _ in range(max(TYPE_PRIORITY.values()) + 1)]
+        self.size = 0
+        self.cond = threading.Condition()
+        self.enqueued = 0
+        self.dropped = 0
+        self.processed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.class_stats = defaultdict(lambda: {"processed": 0, "dropped": 0, "total_wait": 0.0, "max_wait": 0.0})
+        
+    def pre_score(self, msg_type, content):
+        """Scheduling level from the type prefix and urgent keywords"""
+        level = TYPE_PRIORITY.get(msg_type, TYPE_PRIORITY["GENERAL"])
+        text = content.lower()
+        if level > 0 and any(word in text for word in URGENT_KEYWORDS):
+            level -= 1
+        return level
+        
+    def put(self, item, msg_type="GENERAL", content=""):
+        """Enqueue without blocking, returns False if the item was dropped
+        
+        When full, a new item evicts the newest item of a strictly worse level;
+        otherwise the new item itself is dropped.
+        """
+        level = self.pre_score(msg_type, content)
+        with self.cond:
+            if self.size >= self.maxsize:
+                worst = max((i for i, q in enumerate(self.levels) if q), default=None)
+                if worst is None or worst <= level:
+                    self.dropped += 1
+                    self.class_stats[msg_type]["dropped"] += 1
+                    return False
+                evicted = self.levels[worst].pop()
+                self.size -= 1
+                self.dropped += 1
+                self.class_stats[evicted[1]]["dropped"] += 1
+                print(f"[QUEUE] FULL - evicted queued {evicted[1]} from {evicted[2][1]}")
+                
+            self.levels[level].append((time.time(), msg_type, item))
+            self.size += 1
+            self.enqueued += 1
+            self.cond.notify()
+        return True
+        
+    def _pick_level(self, now):
+        """Level whose oldest item has the best aged priority"""
+        best = None
+        best_score = None
+        for level, q in enumerate(self.levels):
+            if not q:
+                continue
+            score = level - (now - q[0][0]) / self.aging_interval
+            if best_score is None or score < best_score:
+                best, best_score = level, score
+        return best
+        
+    def get(self, timeout=None):
+        """Dequeue the next item, returns (item, seconds spent waiting)
+        
+        Raises queue.Empty if nothing arrives within timeout.
+        """
+        with self.cond:
+            if not self.cond.wait_for(lambda: self.size > 0, timeout=timeout):
+                raise queue.Empty
+            now = time.time()
+            enqueued_at, msg_type, item = self.levels[self._pick_level(now)].popleft()
+            self.size -= 1
+            
+            wait = now - enqueued_at
+            self.processed += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+            cls = self.class_stats[msg_type]
+            cls["processed"] += 1
+            cls["total_wait"] += wait
+            cls["max_wait"] = max(cls["max_wait"], wait)
+        return item, wait
+        
+    def get_batch(self, max_items, max_wait, timeout=None):
+        """Dequeue up to max_items, waiting at most max_wait after the first for more
+        
+        Returns a list of (item, seconds spent waiting). Raises queue.Empty if
+        nothing arrives within timeout.
+        """
+        batch = [self.get(timeout=timeout)]
+        deadline = time.time() + max_wait
+        while len(batch) < max_items:
+            try:
+                batch.append(self.get(timeout=max(deadline - time.time(), 0)))
+            except queue.Empty:
+                break
+        return batch
+        
+    def qsize(self):
+        with self.cond:
+            return self.size
+            
+    def stats(self):
+        """Backpressure snapshot: depth, drops and wait times, overall and per message type"""
+        with self.cond:
+            return {
+                "depth": self.size,
+                "capacity": self.maxsize,
+                "depth_by_level": [len(q) for q in self.levels],
+                "enqueued": self.enqueued,
+                "dropped": self.dropped,
+                "processed": self.processed,
+                "avg_wait": self.total_wait / self.processed if self.processed else 0.0,
+                "max_wait": self.max_wait,
+                "classes": {
+                    name: {
+                        "processed": cls["processed"],
+                        "dropped": cls["dropped"],
+                        "avg_wait": cls["total_wait"] / cls["processed"] if cls["processed"] else 0.0,
+                        "max_wait": cls["max_wait"]
+                    }
+                    for name, cls in self.class_stats.items()
+                }
+            }
 
 class RouterNode:
-    def __init__(self, port="/dev/ttyUSB0"):
+    def __init__(self, port="/dev/ttyUSB0", num_workers=1, max_queue=100, aging_interval=30,
+                 batch_size=4, batch_wait=0.5, cache_path="router_cache.db", cache_threshold=0.7,
+                 cache_ttl=6 * 3600, classify_deadline=300, wire_format="binary", stats_interval=60,
+                 outbox_path="router_outbox.db", log_path="router_log.jsonl", log_format="jsonl",
+                 metrics_port=9101, metrics_snapshot="router_metrics.json", transport=None,
+                 heartbeat_interval=HEARTBEAT_INTERVAL, edge_threshold=0.6, incident_window=1800,
+                 incident_threshold=0.4, incident_flush=10, models=("gemma:2b",), sender_rate=1 / 20, sender_burst=4,
+                 max_senders=500):
         self.port = port
+        self.transport = transport or SerialTransport(port)  # Or a gemnet_transport.SimMesh node
         self.interface = None
         self.aid_provider_id = "!db29d0f4"  # Aid provider's node
+        
+        # "binary" sends compact fragmented frames, "text" the legacy pipe-delimited strings
+        self.wire_format = wire_format
+        self.encoder = WireEncoder()
+        self.reassembler = Reassembler()
+        # Sends go through a persistent queue: ACKs, retries, urgent first, paced to the duty cycle
+        self.outbox = Outbox(path=outbox_path)
         self.ollama_url = "http://localhost:11434/api/generate"
+        # Keep the models resident and never run two generations of one at once on 4GB
+        self.ollama = OllamaClient(self.ollama_url, keep_alive="30m", concurrency={model: 1 for model in models})
+        # Largest first: each call gets the biggest model, or a compact prompt, that fits its deadline and the queue
+        self.models = ModelSelector(models, workers=num_workers, related={"classify_batch": "classify"})
+        self.classify_deadline = classify_deadline  # Longest a classification may take, tighter for urgent priorities
+        self.edge_threshold = edge_threshold  # Portal analyses this confident (after checking) skip the LLM
+        
+        # Radio callback only enqueues, workers drain into Ollama by priority
+        self.num_workers = num_workers
+        self.ingest = PriorityScheduler(maxsize=max_queue, aging_interval=aging_interval)
+        self.workers = []
+        self.running = False
+        self.runtime = None  # gemnet_runtime loop when started by run(), threads otherwise
+        self.ingest_ready = None  # Wakes the event-loop workers when something is queued
+        
+        # Up to batch_size queued messages share one Ollama call
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.stats_interval = stats_interval
+        self.heartbeat_interval = heartbeat_interval  # Broadcast queue depth for multi-router dispatch
         
-    def connect(self):
+        # Repeated and near-duplicate messages reuse an earlier LLM analysis
+        self.cache = ClassificationCache(path=cache_path, threshold=cache_threshold, ttl=cache_ttl)
+        
+        # Structured routing log, written off the critical path ("binary" for SD cards)
+        self.log = LogWriter(log_path, mode=log_format) if log_path else None
+        
+        # Retransmitted packets and resent messages are dropped before any classification
+        self.dedup = DedupIndex(ring_size=512, ttl=600)
+        
+        # More reports of an event already routed are folded into one incident update every incident_flush s
+        self.incidents = IncidentTracker(window=incident_window, threshold=incident_threshold) if incident_window else None
+        self.incident_flush = incident_flush
+        
+        # Short follow-ups update the sender's last route; a sender over sender_rate msg/s is folded into one update
+        self.senders = SenderTable(max_senders=max_senders, rate=sender_rate or 0, burst=sender_burst)
+        self.rate_limited = bool(sender_rate)
+        
+        # Provisional routes are referenced by a short id so corrections can follow
+        self.route_counter = 0
+        self.route_lock = threading.Lock()
+        
+        # Counters and stage latencies, scraped from metrics_port and snapshotted to a file
+        self.metrics = Metrics("router")
+        self.metrics.set_buckets("mesh_latency_seconds", MESH_BUCKETS)
+        self.metrics.collector(self.metric_samples)
+        self.metrics.collector(self.ollama.metric_samples)
+        self.metrics.collector(self.models.metric_samples)
+        self.metrics.collector(self.senders.metric_samples)
+        self.metrics.collector(self.outbox.metric_samples)
+        self.metrics_port = metrics_port
+        self.metrics_snapshot = metrics_snapshot
+        
+    def connect(self, runtime=None):
+        """Open the radio and start the workers, on runtime's event loop if given (call from the loop)"""
         print(f"Router Node starting on {self.port}...")
-        self.interface = meshtastic.serial_interface.SerialInterface(self.port)
-        pub.subscribe(self.on_receive, "meshtastic.receive")
+        self.runtime = runtime
+        self.interface = self.transport.open()
+        self.outbox.start(self.interface)
+        if self.metrics_port:
+            self.metrics.serve(self.metrics_port)
+        if self.metrics_snapshot:
+            self.metrics.start_snapshots(self.metrics_snapshot, interval=self.stats_interval or 60)
+        self.start_workers()
+        if runtime:
+            runtime.spawn(self.ollama.awarm_up([self.models.smallest]), name="ollama-warmup")
+            if self.heartbeat_interval:
+                runtime.every(self.heartbeat_interval, self.send_heartbeat, delay=0)
+            if self.incidents:
+                runtime.every(self.incident_flush, self.flush_incidents)
+            if self.rate_limited:
+                runtime.every(self.incident_flush, self.flush_senders)
+            self.transport.subscribe(runtime.bridge(self.on_receive))
+        else:
+            self.ollama.warm_up_async([self.models.smallest])
+            if self.heartbeat_interval:
+                threading.Thread(target=self.heartbeat_loop, name="heartbeat", daemon=True).start()
+            if self.incidents:
+                threading.Thread(target=self.incident_loop, name="incidents", daemon=True).start()
+            if self.rate_limited:
+                threading.Thread(target=self.sender_loop, name="senders", daemon=True).start()
+            self.transport.subscribe(self.on_receive)
         print("Router active and listening...\n")
         
+    def start_workers(self):
+        """Start the classification worker pool, as loop tasks when there is a runtime"""
+        self.running = True
+        if self.runtime:
+            self.ingest_ready = asyncio.Event()
+            for i in range(self.num_workers):
+                self.workers.append(self.runtime.spawn(self.classify_loop(), name=f"classify-{i}"))
+        else:
+            for i in range(self.num_workers):
+                worker = threading.Thread(target=self.worker_loop, name=f"classify-{i}", daemon=True)
+                worker.start()
+                self.workers.append(worker)
+        print(f"Started {self.num_workers} classification worker(s), queue capacity {self.ingest.maxsize}")
+        
+    def stop_workers(self):
+        """Signal workers to exit and wait briefly for the current item"""
+        self.running = False
+        for worker in self.workers:
+            if isinstance(worker, threading.Thread):
+                worker.join(timeout=2)
+            else:
+                worker.cancel()
+        self.workers = []
+        
+    def worker_loop(self):
+        """Drain the ingest queue through Ollama classification"""
+        while self.running:
+            try:
+                batch = self.ingest.get_batch(self.batch_size, self.batch_wait, timeout=1)
+            except queue.Empty:
+                continue
+            self.ollama.run_steps(self.batch_steps(batch))
+            
+    async def classify_loop(self):
+        """worker_loop on the event loop: waiting for messages holds no thread, nor does Ollama block the loop"""
+        while self.running:
+            batch = await self.next_batch()
+            await self.ollama.arun_steps(self.batch_steps(batch))
+            
+    async def next_batch(self):
+        """get_batch for the event loop: the first queued item, then up to batch_wait for more"""
+        batch = []
+        deadline = None
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.ingest.get(timeout=0))
+                deadline = deadline or time.time() + self.batch_wait
+                continue
+            except queue.Empty:
+                pass
+            self.ingest_ready.clear()
+            if deadline is None:
+                await self.ingest_ready.wait()
+                continue
+            try:
+                await asyncio.wait_for(self.ingest_ready.wait(), max(deadline - time.time(), 0))
+            except asyncio.TimeoutError:
+                break
+        return batch
+        
+    def batch_steps(self, batch):
+        """Classify and route one dequeued batch of (item, wait), yielding its Ollama call"""
+        waits = ", ".join(f"{wait:.1f}s" for _, wait in batch)
+        print(f"[QUEUE] Dequeued {len(batch)} message(s) after {waits} wait")
+        
+        # The most pressing message in the batch sets how long Ollama may take
+        now = time.time()
+        deadline = min(now - wait + self.deadline_for(item[3]) for item, wait in batch)
+        backlog = math.ceil(self.ingest.qsize() / self.batch_size)  # Calls still to make after this one
+        try:
+            if len(batch) == 1:
+                yield from self.process_steps(*batch[0][0], deadline=deadline, backlog=backlog)
+            else:
+                yield from self.process_batch_steps([item for item, _ in batch], deadline=deadline, backlog=backlog)
+        except Exception as e:
+            print(f"[QUEUE] ERROR processing batch of {len(batch)}: {type(e).__name__}: {e}")
+            
+    def deadline_for(self, provisional):
+        """Seconds from receipt allowed for classifying a message, by its provisional priority"""
+        priority = provisional['priority'] if provisional else 3
+        return min(self.classify_deadline, PRIORITY_DEADLINES.get(priority, self.classify_deadline))
+            
+    def heartbeat_loop(self):
+        """Advertise this router and its queue depth so portals can spread load across routers"""
+        while self.running:
+            self.send_heartbeat()
+            time.sleep(self.heartbeat_interval)
+            
+    def send_heartbeat(self):
+        stats = self.ingest.stats()
+        if self.wire_format == "text":
+            self.outbox.sendText(f"HEARTBEAT|{stats['depth']}|{stats['capacity']}")
+            return
+        send_message(self.outbox, self.encoder, {"kind": "HEARTBEAT", "depth": stats['depth'],
+                                                 "capacity": stats['capacity'], "sent": time.time()},
+                     BROADCAST, coalesce_key="HEARTBEAT")
+        
+    def incident_loop(self):
+        """Send the reporters gathered by each incident since the last round"""
+        while self.running:
+            time.sleep(self.incident_flush)
+            self.flush_incidents()
+            
+    def flush_incidents(self):
+        for incident in self.incidents.due():
+            self.send_incident(incident)
+            
+    def sender_loop(self):
+        """Fold the messages held from rate-limited senders once their buckets refill"""
+        while self.running:
+            time.sleep(self.incident_flush)
+            self.flush_senders()
+            
+    def flush_senders(self, force=()):
+        for sender_id, held, route in self.senders.due(force):
+            self.send_held(sender_id, held, route)
+            
+    def send_held(self, sender_id, held, route):
+        """Route a burst held from a sender: news about their last route as one update of it, the rest on its own
+        
+        Each held message is checked with the rules: those about the last
+        route (see SenderTable.related) are folded into one correction
+        carrying their text and every trace id, a repeat of a message
+        already routed gets a repeat notice, and any other is classified and
+        routed like a message that was never held (see classify_and_route).
+        """
+        folded = []
+        for msg_type, content, trace, claim in held:
+            if route and self.senders.related(route, msg_type, content, classify_rules(content, route['msg_type'])):
+                folded.append((content, trace))
+                self.dedup.remember(sender_id, msg_type, content, route['ref'])
+                continue
+            duplicate = self.dedup.duplicate_of(sender_id, msg_type, content)
+            if duplicate:  # Held twice, or already routed from earlier in the burst
+                self.send_repeat(sender_id, duplicate, trace)
+            else:
+                self.classify_and_route(f"{msg_type}|{content}", msg_type, content, sender_id, trace, claim)
+        print(f"[SENDERS] {len(held)} held message(s) from {sender_id}: {len(folded)} folded into one update, "
+              f"{len(held) - len(folded)} routed")
+        if folded:
+            contents = list(dict.fromkeys(content for content, _ in folded))
+            analysis = self.senders.fold(sender_id, route, contents)
+            self.update_route(route, sender_id, " / ".join(contents), analysis, [trace for _, trace in folded],
+                              event="folded")
+        
+    def update_route(self, route, sender_id, content, analysis, traces=(), event="followup"):
+        """Fold news from the same sender into their last route: a correction with the merged summary and text"""
+        ref = route['ref']
+        what = "Follow-up" if event == "followup" else "Held messages"
+        print(f"[SENDERS] {what} from {sender_id} folded into route #{ref}: {analysis['category']} "
+              f"P{route['analysis']['priority']} -> P{analysis['priority']}, {analysis['summary']!r}")
+        traces = [trace for trace in traces if trace]
+        self.send_correction(route['msg_type'], analysis, ref, traces[-1] if traces else None, text=content,
+                             members=[(sender_id, trace['trace']) for trace in traces])
+        self.senders.remember(sender_id, ref, route['msg_type'], content, analysis)
+        self.metrics.inc("routes_total", event=event, category=analysis['category'])
+        self.log_event(event, msg_type=route['msg_type'], sender=sender_id, message=content, analysis=analysis,
+                       ref=ref, provisional=route['analysis'], source="context",
+                       trace=traces[-1]['trace'] if traces else None, traces=[trace['trace'] for trace in traces])
+        
+    def join_incident(self, msg_type, content, sender_id, analysis, trace=None):
+        """Count a report into the open incident it describes, True if it joined one"""
+        incident, similarity = self.incidents.match(content, msg_type, analysis['category'])
+        if incident is None:
+            return False
+        escalated = self.incidents.join(incident, sender_id, trace and trace['trace'], analysis)
+        self.dedup.remember(sender_id, msg_type, content, incident['ref'])
+        self.metrics.inc("incident_reports_total", escalated=escalated)
+        print(f"[INCIDENT] Report {incident['reports']} of incident #{incident['ref']} ({similarity:.0%} similar)"
+              + (f", raised to P{incident['priority']}" if escalated else ""))
+        self.log_event("incident", msg_type=msg_type, sender=sender_id, message=content, analysis=analysis,
+                       ref=incident['ref'], similarity=round(similarity, 2), trace=trace and trace['trace'])
+        if escalated and incident['priority'] <= 2:
+            self.flush_incidents()  # Do not sit on a more urgent report
+        return True
+        
+    def send_incident(self, incident, batch=20):
+        """Tell the aid provider about new reporters of an incident, batch of them per message"""
+        members = incident['pending'] or [None]
+        batch = batch if self.wire_format == "binary" else 8  # A text update has to fit one frame
+        for start in range(0, len(members), batch):
+            chunk = [member for member in members[start:start + batch] if member]
+            if self.wire_format == "text":
+                listed = ",".join(f"{node}:{trace}" if trace else node for node, trace in chunk)
+                self.send_to_aid_provider(text=f"INCIDENT|{incident['ref']}|{len(incident['reporters'])}|"
+                                               f"{self.route_prefix(incident['msg_type'], incident)}|"
+                                               f"{incident['category']}|{listed}",
+                                          urgent=incident['priority'] <= 2)
+            else:
+                self.send_to_aid_provider(msg={
+                    "kind": "INCIDENT",
+                    "msg_type": incident['msg_type'],
+                    "category": incident['category'],
+                    "priority": incident['priority'],
+                    "urgency": incident['urgency'],
+                    "ref": incident['ref'],
+                    "count": len(incident['reporters']),
+                    "members": chunk
+                }, urgent=incident['priority'] <= 2)
+        self.metrics.inc("incident_updates_total")
+        print(f"[INCIDENT] #{incident['ref']}: {len(incident['reporters'])} reporter(s), "
+              f"{incident['reports']} report(s), P{incident['priority']} sent to aid provider")
+        
+    def metric_samples(self):
+        """Queue, cache and dedup figures owned by other components, for the metrics endpoint"""
+        queue_stats = self.ingest.stats()
+        cache = self.cache.stats()
+        dedup = self.dedup.stats()
+        samples = [
+            ("gauge", "queue_depth", {}, queue_stats['depth']),
+            ("gauge", "queue_capacity", {}, queue_stats['capacity']),
+            ("gauge", "cache_entries", {}, cache['entries']),
+            ("counter", "cache_saved_seconds_total", {}, cache['saved_seconds']),
+            ("counter", "duplicates_total", {"kind": "packet"}, dedup['packet_duplicates']),
+            ("counter", "duplicates_total", {"kind": "content"}, dedup['content_duplicates'])
+        ]
+        if self.incidents:
+            samples.append(("gauge", "incidents_open", {}, self.incidents.stats()['open']))
+        for name, cls in queue_stats['classes'].items():
+            samples.append(("counter", "queue_processed_total", {"class": name}, cls['processed']))
+            samples.append(("counter", "queue_dropped_total", {"class": name}, cls['dropped']))
+        return samples
+        
+    def print_stats(self):
+        """Print ingest backpressure stats"""
+        stats = self.ingest.stats()
+        print(f"[QUEUE] depth={stats['depth']}/{stats['capacity']} "
+              f"enqueued={stats['enqueued']} processed={stats['processed']} dropped={stats['dropped']} "
+              f"avg_wait={stats['avg_wait']:.1f}s max_wait={stats['max_wait']:.1f}s")
+        for name, cls in stats['classes'].items():
+            print(f"[QUEUE]   {name}: processed={cls['processed']} dropped={cls['dropped']} "
+                  f"avg_wait={cls['avg_wait']:.1f}s max_wait={cls['max_wait']:.1f}s")
+        self.ollama.print_stats()
+        self.models.print_stats()
+        self.outbox.print_stats()
+        wire = self.reassembler.stats()
+        print(f"[WIRE] frames={wire['frames']} messages={wire['messages']} pending={wire['pending']} "
+              f"duplicates={wire['duplicates']} expired={wire['expired']} errors={wire['errors']}")
+        if self.log:
+            log = self.log.stats()
+            print(f"[LOG] written={log['written']} pending={log['pending']} dropped={log['dropped']} "
+                  f"batches={log['batches']} rotations={log['rotations']}")
+        dedup = self.dedup.stats()
+        print(f"[DEDUP] packets={dedup['packets']} retransmissions={dedup['packet_duplicates']} "
+              f"repeats={dedup['content_duplicates']} tracked={dedup['entries']}")
+        cache = self.cache.stats()
+        print(f"[CACHE] entries={cache['entries']} hit_rate={cache['hit_rate']:.0%} "
+              f"(exact={cache['exact_hits']} near={cache['near_hits']}) saved={cache['saved_seconds']:.0f}s")
+        if self.incidents:
+            incidents = self.incidents.stats()
+            print(f"[INCIDENT] open={incidents['open']} opened={incidents['opened']} joined={incidents['joined']} "
+                  f"multi_reporter={incidents['multi_reporter']}")
+        self.senders.print_stats()
+        
     def on_receive(self, packet, interface):
         """Handle incoming messages"""
-        if 'decoded' not in packet or 'text' not in packet['decoded']:
+        frame = frame_from_packet(packet)
+        if frame is None and ('decoded' not in packet or 'text' not in packet['decoded']):
             return
             
-        message = packet['decoded']['text']
         sender_id = packet.get('fromId', 'Unknown')
         
         # Skip our own messages and responses from aid provider
         if sender_id == self.interface.myInfo.my_node_num or sender_id == self.aid_provider_id:
             return
             
+        if self.dedup.seen_packet(sender_id, packet.get('id')):
+            print(f"[DEDUP] Retransmitted packet {packet.get('id')} from {sender_id}, ignored")
+            return
+            
+        if frame is not None:
+            try:
+                msg = self.reassembler.add(sender_id, frame)
+            except WireError as e:
+                print(f"\n[WIRE] {e}")
+                return
+            if msg is None:  # More fragments to come, or a retransmission
+                return
+            if msg['kind'] not in ("EMERGENCY", "REQUEST", "OFFER", "GENERAL"):
+                return
+            message = f"{msg['kind']}|{msg['text']}"
+            trace_id, sent = msg.get('trace'), msg.get('sent')
+            claim = {k: msg[k] for k in ("category", "priority", "urgency", "summary", "confidence") if k in msg} \
+                if "category" in msg else None
+        else:
+            message, trace_id, sent = split_trace(packet['decoded']['text'])
+            if message.startswith("HEARTBEAT|"):
+                return  # Another router announcing itself
+            message, claim = split_analysis(message)
+            
+        # Trace id follows the message to the aid provider, new here if the sender had none
+        received = time.time()
+        trace = {"trace": trace_id or new_trace(), "sent": sent, "received": received}
+        if sent:
+            self.metrics.observe("mesh_latency_seconds", max(received - sent, 0), hop="user_to_router")
+            
         print(f"\n[RECEIVED] From {sender_id}: {message}")
         
         # Don't process responses (avoid loops)
         if message.startswith("RESPONSE|") or message.startswith("BROADCAST|"):
             return
             
-        # Process and route message
-        self.process_and_route(message, sender_id)
+        msg_type, content = self.parse_message(message)
+        self.metrics.inc("messages_received_total", type=msg_type, format="binary" if frame is not None else "text")
+        
+        # Same sender, same message within the window: merge into the first route, no LLM call, only a repeat notice
+        duplicate = self.dedup.duplicate_of(sender_id, msg_type, content)
+        if duplicate:
+            print(f"[DEDUP] Repeat #{duplicate['repeats']} of route #{duplicate['value']} from {sender_id}, not reprocessed")
+            self.log_event("duplicate", msg_type=msg_type, sender=sender_id, message=content,
+                           ref=duplicate['value'], repeats=duplicate['repeats'])
+            self.send_repeat(sender_id, duplicate, trace)
+            return
+            
+        # Over the sender's rate: held and folded into one update later, sooner if it is more urgent
+        if self.rate_limited and not self.senders.admit(sender_id, msg_type, content, trace, claim):
+            route = self.senders.last_route(sender_id)
+            rules = classify_rules(content, msg_type)
+            print(f"[SENDERS] {sender_id} over its rate limit, message held for the next update")
+            self.log_event("held", msg_type=msg_type, sender=sender_id, message=content,
+                           ref=route and route['ref'], trace=trace['trace'])
+            if rules['priority'] <= 2 and (route is None or rules['priority'] < route['analysis']['priority']):
+                self.flush_senders(force={sender_id})
+            return
+            
+        # A short follow-up to this sender's last route ("still trapped"): update that route, no LLM call
+        followup = self.senders.followup(sender_id, msg_type, content)
+        if followup:
+            route, analysis = followup
+            self.dedup.remember(sender_id, msg_type, content, route['ref'])
+            self.update_route(route, sender_id, content, analysis, [trace])
+            return
+            
+        self.classify_and_route(message, msg_type, content, sender_id, trace, claim)
+        
+    def classify_and_route(self, message, msg_type, content, sender_id, trace, claim=None):
+        """Route a new report: on a cached analysis, the portal's if trusted, or the rules while the LLM refines it"""
+        # Seen this (or nearly this) before: route on the cached analysis, no LLM call
+        cached, match = self.cache.get(content, msg_type)
+        self.metrics.inc("cache_lookups_total", result=match or "miss")
+        
+        # Analysed at the portal: checked against the rules, forwarded as is unless in doubt
+        edge, result = None, None
+        if claim and not cached:
+            edge, confidence = verify_analysis(claim, content, msg_type)
+            result = "trusted" if confidence >= self.edge_threshold else "low_confidence" if confidence else "rejected"
+            self.metrics.inc("edge_analyses_total", result=result)
+            print(f"[EDGE] Portal says {edge['category']} P{edge['priority']}, confidence {confidence}: {result}")
+            if result == "rejected":
+                edge = None
+                
+        # Another report of an incident already routed: counted into it, no route of its own and no LLM call
+        if self.incidents and self.join_incident(msg_type, content, sender_id,
+                                                 cached or edge or classify_rules(content, msg_type), trace):
+            return
+            
+        if cached:
+            print(f"[CACHE] {match} hit: {cached['category']} P{cached['priority']}")
+            ref = self.next_ref()
+            self.dedup.remember(sender_id, msg_type, content, ref)
+            self.deliver(msg_type, content, sender_id, cached, ref=ref, source="cache", trace=trace)
+            return
+            
+        if result == "trusted":
+            ref = self.next_ref()
+            self.dedup.remember(sender_id, msg_type, content, ref)
+            self.metrics.inc("classifications_total", source="edge")
+            self.deliver(msg_type, content, sender_id, edge, ref=ref, source="edge", trace=trace)
+            return
+            
+        self.route_and_queue(message, msg_type, content, sender_id, trace, edge)
+        
+    def route_and_queue(self, message, msg_type, content, sender_id, trace, edge=None):
+        """Route provisionally now and queue the message for the LLM to refine"""
+        # Fast path: route on the portal's or the rule classifier's analysis now, Ollama refines it later
+        ref, provisional = self.route_provisional(msg_type, content, sender_id, trace, analysis=edge)
+        self.dedup.remember(sender_id, msg_type, content, ref)
+        
+        # Hand off to the classification workers, never block the radio thread
+        if self.ingest.put((message, sender_id, ref, provisional, trace), msg_type, content):
+            print(f"[QUEUE] Queued {msg_type} (depth {self.ingest.qsize()})")
+            if self.ingest_ready:
+                self.ingest_ready.set()
+        else:
+            print(f"[QUEUE] FULL - dropped message from {sender_id}")
         
-    def analyze_with_ollama(self, message, msg_type):
+    def analyze_with_ollama(self, message, msg_type, deadline=None):
         """Get Ollama classification"""
-        prompt = f"""Analyze this emergency message and return JSON.
-
-Message Type: {msg_type}
-Message: "{message}"
-
-Choose ONE category: MEDICAL, FIRE, RESCUE, SUPPLIES, SHELTER, TRANSPORT, or OTHER
-Set priority: 1 (critical) to 5 (low)
-Set urgency: IMMEDIATE, HIGH, MEDIUM, or LOW
-
-Return exactly this format:
-{{
-  "category": "SUPPLIES",
-  "priority": 3,
-  "urgency": "MEDIUM",
-  "resources_needed": "food delivery",
-  "summary": "person needs food"
-}}"""
+        return self.ollama.run_steps(self.analyze_steps(message, msg_type, deadline))
+        
+    def analyze_steps(self, message, msg_type, deadline=None, backlog=0):
+        """analyze_with_ollama as a step generator (see OllamaClient.run_steps)
+        
+        backlog is how many more calls are queued behind this one, which
+        the model selector weighs against the deadline.
+        """
+        plan = self.models.plan("classify", deadline, backlog=backlog)
+        if plan['model'] is None:
+            print(f"[MODELS] No model fits the {deadline - time.time():.0f}s left at this load, skipping Ollama")
+            return dict(classify_rules(message, msg_type), fallback=True)
+        prompt = build_prompt(message, msg_type, compact=plan['compact'])
 
         try:
             print(f"[OLLAMA] Starting request at {datetime.now().strftime('%H:%M:%S')}")
-            print(f"[OLLAMA] Model: gemma:2b, Message length: {len(message)}")
-            
-            start_time = time.time()
-            response = requests.post(self.ollama_url, 
-                json={
-                    "model": "gemma:2b",
-                    "prompt": prompt,
-                    "stream": False,
-                    "temperature": 0.1  # Low for consistency
-                },
-                timeout=180  # 3 minute timeout
-            )
+            print(f"[OLLAMA] Model: {plan['model']}{' (compact prompt)' if plan['compact'] else ''}, "
+                  f"Message length: {len(message)}")
             
-            elapsed = time.time() - start_time
-            print(f"[OLLAMA] Response received in {elapsed:.1f} seconds")
+            # Stream and stop at the closing brace of the JSON object
+            reply = yield from self.models.call(plan, prompt,
+                temperature=0.1,  # Low for consistency
+                timeout=self.classify_deadline,
+                stop_when=JsonWatcher("{"),
+                prompt_type="classify_compact" if plan['compact'] else "classify"
+            )
+            self.print_timing(reply)
             
-            result = response.json()['response']
+            result = reply['response']
             print(f"[OLLAMA] Raw response: {result[:100]}...")
             
-            # Extract JSON from response (Ollama might add text)
-            start = result.find('{')
-            end = result.rfind('}') + 1
-            if start >= 0 and end > start:
-                parsed = json.loads(result[start:end])
-                print(f"[OLLAMA] Parsed successfully: {parsed}")
-                return parsed
-            else:
-                raise ValueError("No JSON found in response")
+            parsed = parse_analysis(result, message, msg_type)
+            parsed['model'] = plan['model']
+            print(f"[OLLAMA] Parsed successfully: {parsed}")
+            return parsed
                 
-        except requests.exceptions.Timeout:
-            print(f"[OLLAMA] ERROR: Request timed out after 120s")
+        except requests.exceptions.Timeout as e:
+            print(f"[OLLAMA] ERROR: Request timed out: {e}")
         except requests.exceptions.ConnectionError:
             print(f"[OLLAMA] ERROR: Cannot connect to Ollama. Is it running?")
         except Exception as e:
             print(f"[OLLAMA] ERROR: {type(e).__name__}: {e}")
             
         # Fallback classification
-        print("[OLLAMA] Using fallback classification")
-        return {
-            "category": "OTHER",
-            "priority": 2 if msg_type == "EMERGENCY" else 3,
-            "urgency": "HIGH" if msg_type == "EMERGENCY" else "MEDIUM",
-            "resources_needed": "Assessment needed",
-            "summary": message[:50]
-        }
-            
-    def process_and_route(self, message, sender_id):
-        """Process message and route to aid provider"""
+        print("[OLLAMA] Using rule-based fallback classification")
+        fallback = classify_rules(message, msg_type)
+        fallback["fallback"] = True
+        return fallback
+            
+    def print_timing(self, reply):
+        """Report streaming latency for one Ollama call"""
+        early = ", stopped early" if reply['stopped_early'] else ""
+        print(f"[OLLAMA] Response received in {reply['elapsed']:.1f} seconds "
+              f"(first token {reply['ttft']:.1f}s, {reply['tokens']} tokens{early})")
         
-        # Parse message type
+    def analyze_batch_with_ollama(self, items, deadline=None):
+        """Classify several (message, msg_type) pairs in one Ollama call
+        
+        Returns one analysis per item, in order. Items the model skipped or
+        answered with malformed JSON get the rule-based classification.
+        """
+        return self.ollama.run_steps(self.analyze_batch_steps(items, deadline))
+        
+    def analyze_batch_steps(self, items, deadline=None, backlog=0):
+        """analyze_batch_with_ollama as a step generator"""
+        plan = self.models.plan("classify_batch", deadline, size=len(items), backlog=backlog)
+        if plan['model'] is None:
+            print(f"[MODELS] No model fits the {deadline - time.time():.0f}s left for {len(items)} messages, skipping Ollama")
+            return [dict(classify_rules(message, msg_type), fallback=True) for message, msg_type in items]
+        prompt = build_batch_prompt(items, compact=plan['compact'])
+        
+        try:
+            print(f"[OLLAMA] Starting batch request at {datetime.now().strftime('%H:%M:%S')}")
+            print(f"[OLLAMA] Model: {plan['model']}{' (compact prompt)' if plan['compact'] else ''}, "
+                  f"Batch size: {len(items)}")
+            
+            # Stream and stop at the closing bracket of the JSON array
+            reply = yield from self.models.call(plan, prompt,
+                temperature=0.1,
+                timeout=self.classify_deadline,
+                stop_when=JsonWatcher("["),
+                prompt_type="classify_batch_compact" if plan['compact'] else "classify_batch"
+            )
+            self.print_timing(reply)
+            
+            result = reply['response']
+            print(f"[OLLAMA] Raw response: {result[:100]}...")
+            
+            results = parse_batch(result, items)
+            failed = sum(1 for _, ok in results if not ok)
+            if failed:
+                print(f"[OLLAMA] {failed}/{len(items)} batch item(s) malformed, using rule-based fallback")
+            for analysis, ok in results:
+                if ok:
+                    analysis["model"] = plan['model']
+                else:
+                    analysis["fallback"] = True
+            return [analysis for analysis, _ in results]
+            
+        except requests.exceptions.Timeout as e:
+            print(f"[OLLAMA] ERROR: Batch request timed out: {e}")
+        except requests.exceptions.ConnectionError:
+            print(f"[OLLAMA] ERROR: Cannot connect to Ollama. Is it running?")
+        except Exception as e:
+            print(f"[OLLAMA] ERROR: {type(e).__name__}: {e}")
+            
+        print("[OLLAMA] Using rule-based fallback classification for batch")
+        return [dict(classify_rules(message, msg_type), fallback=True) for message, msg_type in items]
+        
+    def parse_message(self, message):
+        """Split a TYPE|content packet into (msg_type, content)"""
         msg_type = "GENERAL"
         content = message
         
@@ -120,58 +779,269 @@ Return exactly this format:
             msg_type = parts[0]
             content = parts[1] if len(parts) > 1 else message
             
+        return msg_type, content
+        
+    def next_ref(self):
+        """Short id linking a provisional route to its later correction"""
+        with self.route_lock:
+            self.route_counter += 1
+            return format(self.route_counter, "x")
+            
+    def route_prefix(self, msg_type, analysis):
+        """Type/priority prefix shown on the aid provider console"""
+        if analysis['priority'] <= 2:  # High priority
+            return f"🚨URGENT-P{analysis['priority']}"
+        return f"{msg_type}-P{analysis['priority']}"
+        
+    def format_routed(self, msg_type, sender_id, content, analysis, ref, trace=None):
+        """Legacy pipe-delimited message for the aid provider, trimmed to fit one LoRa frame"""
+        head = f"{self.route_prefix(msg_type, analysis)}|{analysis['category']}|{sender_id}|"
+        tail = f"|{analysis['summary'][:60]}|{ref}"
+        if trace:
+            tail = add_trace(tail, trace['trace'], trace['sent'] or trace['received'])
+        
+        # Truncate the content rather than the trailing ref if too long for LoRa
+        room = 230 - len(head) - len(tail)
+        if len(content) > room:
+            content = content[:max(room - 3, 0)] + "..."
+        return head + content + tail
+        
+    def send_to_aid_provider(self, text=None, msg=None, urgent=False):
+        """Queue a text string or a wire message dict for the aid provider, urgent ones first"""
+        priority = URGENT if urgent else NORMAL
+        if msg is not None:
+            frames = send_message(self.outbox, self.encoder, msg, self.aid_provider_id, priority=priority)
+            if frames > 1:
+                print(f"[WIRE] Sent as {frames} fragments")
+        else:
+            self.outbox.sendText(text, destinationId=self.aid_provider_id, priority=priority)
+                
+    def send_routed(self, msg_type, sender_id, content, analysis, ref, trace=None):
+        """Send a routed message to the aid provider in the configured wire format, opening an incident for it"""
+        if self.incidents:
+            self.incidents.open(ref, content, msg_type, analysis, sender_id)
+        if self.wire_format == "text":
+            formatted = self.format_routed(msg_type, sender_id, content, analysis, ref, trace)
+            print(f"Routing to aid provider: {formatted[:100]}...")
+            self.send_to_aid_provider(text=formatted, urgent=analysis['priority'] <= 2)
+            return
+            
+        print(f"Routing to aid provider: #{ref} {msg_type} {analysis['category']} P{analysis['priority']}")
+        self.send_to_aid_provider(msg={
+            "kind": "ROUTED",
+            "msg_type": msg_type,
+            "category": analysis['category'],
+            "priority": analysis['priority'],
+            "urgency": analysis['urgency'],
+            "origin": sender_id,
+            "ref": ref,
+            "text": content,
+            "summary": analysis['summary'],
+            **self.trace_fields(trace)
+        }, urgent=analysis['priority'] <= 2)
+        
+    def trace_fields(self, trace):
+        """Wire fields carrying the trace id and origin send time (router receipt if the sender had none)"""
+        if not trace:
+            return {}
+        return {"trace": trace['trace'], "sent": trace['sent'] or trace['received']}
+        
+    def send_repeat(self, sender_id, duplicate, trace=None):
+        """Tell the aid provider a sender repeated a routed message, so an acked or resolved one is reopened
+        
+        The notice carries the route ref and the repeats so far, so one that
+        is skipped (the sender is over its rate) or lost is made up by the
+        next. It is urgent when the route was.
+        """
+        ref = duplicate['value']
+        if ref is None or (self.rate_limited and not self.senders.spend(sender_id)):
+            return
+        route = self.senders.route(sender_id, ref)
+        urgent = bool(route) and route['analysis']['priority'] <= 2
+        self.metrics.inc("repeat_notices_total")
+        if self.wire_format == "text":
+            notice = f"REPEAT|{ref}|{duplicate['repeats']}|{sender_id}"
+            if trace:
+                notice = add_trace(notice, trace['trace'], trace['sent'] or trace['received'])
+            self.send_to_aid_provider(text=notice, urgent=urgent)
+            return
+        self.send_to_aid_provider(msg={
+            "kind": "REPEAT",
+            "ref": ref,
+            "count": duplicate['repeats'],
+            "origin": sender_id,
+            **self.trace_fields(trace)
+        }, urgent=urgent)
+        
+    def send_correction(self, msg_type, analysis, ref, trace=None, text=None, members=None):
+        """Send a compact correction of a provisional route
+        
+        A follow-up from the sender also carries its text and, in members,
+        the (sender, trace id) of every message folded in. The legacy text
+        format has room for the summary only.
+        """
+        if self.incidents:
+            self.incidents.update(ref, analysis)
+        if self.wire_format == "text":
+            correction = f"CORRECTION|{ref}|{self.route_prefix(msg_type, analysis)}|{analysis['category']}|{analysis['summary'][:60]}"
+            if trace:
+                correction = add_trace(correction, trace['trace'], trace['sent'] or trace['received'])
+            self.send_to_aid_provider(text=correction,
+                                      urgent=analysis['priority'] <= 2)
+            return
+            
+        self.send_to_aid_provider(msg={
+            "kind": "CORRECTION",
+            "msg_type": msg_type,
+            "category": analysis['category'],
+            "priority": analysis['priority'],
+            "urgency": analysis['urgency'],
+            "ref": ref,
+            "summary": analysis['summary'][:60],
+            **({"text": text} if text else {}),
+            **({"members": members} if members else {}),
+            **self.trace_fields(trace)
+        }, urgent=analysis['priority'] <= 2)
+        
+    def route_provisional(self, msg_type, content, sender_id, trace=None, analysis=None):
+        """Route immediately on the rule classifier, or a portal's analysis, returns (ref, analysis)"""
+        source = "edge" if analysis else "rules"
+        analysis = analysis or classify_rules(content, msg_type)
+        ref = self.next_ref()
+        
+        print(f"[FAST] {analysis['category']} P{analysis['priority']} ({source}, confidence {analysis.get('confidence', '-')})")
+        self.send_routed(msg_type, sender_id, content, analysis, ref, trace)
+        print(f"✓ Provisional route #{ref} sent to aid provider")
+        self.senders.remember(sender_id, ref, msg_type, content, analysis)
+        if trace:
+            self.metrics.observe("stage_seconds", time.time() - trace['received'], stage="receive_to_provisional")
+        self.log_event("provisional", msg_type=msg_type, sender=sender_id, message=content, analysis=analysis,
+                       ref=ref, source=source, trace=trace and trace['trace'])
+        return ref, analysis
+        
+    def process_steps(self, message, sender_id, ref=None, provisional=None, trace=None, deadline=None, backlog=0):
+        """Process message and route to aid provider, a step generator
+        
+        With a provisional route already sent, only a compact correction is
+        transmitted, and only if the category or priority changed.
+        """
+        
+        # Parse message type
+        msg_type, content = self.parse_message(message)
+            
         print(f"Type: {msg_type}, Content: {content}")
         
         # Get Ollama analysis
         print("Analyzing with Ollama...")
-        analysis = self.analyze_with_ollama(content, msg_type)
-        print(f"Analysis: {analysis}")
+        start_time = time.time()
+        if trace:
+            self.metrics.observe("stage_seconds", start_time - trace['received'], stage="queue_wait")
+        analysis = yield from self.analyze_steps(content, msg_type, deadline=deadline, backlog=backlog)
+        cost = time.time() - start_time
+        self.record_classification(analysis, cost, deadline)
+        if not analysis.get("fallback"):
+            self.cache.put(content, msg_type, analysis, cost=cost)
+        self.deliver(msg_type, content, sender_id, analysis, ref, provisional,
+                     source="fallback" if analysis.get("fallback") else "llm", cost=cost, trace=trace, deadline=deadline)
         
-        # Build enriched message for aid provider
-        enriched_msg = {
-            "original_type": msg_type,
-            "sender": sender_id,
-            "time": datetime.now().strftime("%H:%M:%S"),
-            "message": content,
-            "analysis": analysis
-        }
+    def record_classification(self, analysis, cost, deadline=None):
+        """Classify time, LLM vs fallback count (fallback rate = fallback / all), model used and deadline kept or missed"""
+        source = "fallback" if analysis.get("fallback") else "llm"
+        model = analysis.get("model", "rules")
+        self.metrics.inc("classifications_total", source=source, model=model)
+        self.metrics.observe("stage_seconds", cost, stage="classify")
+        if deadline is not None:
+            self.metrics.inc("classify_deadline_total", outcome="missed" if time.time() > deadline else "met", model=model)
         
-        # Format for transmission (keep it readable)
-        if analysis['priority'] <= 2:  # High priority
-            prefix = f"🚨URGENT-P{analysis['priority']}"
-        else:
-            prefix = f"{msg_type}-P{analysis['priority']}"
+    def process_batch_steps(self, batch, deadline=None, backlog=0):
+        """Classify a batch of queued (message, sender_id, ref, provisional, trace) in one call and route each"""
+        parsed = [self.parse_message(item[0]) for item in batch]
+        print(f"Analyzing batch of {len(batch)} with Ollama...")
+        start_time = time.time()
+        for item in batch:
+            if item[4]:
+                self.metrics.observe("stage_seconds", start_time - item[4]['received'], stage="queue_wait")
+        analyses = yield from self.analyze_batch_steps([(content, msg_type) for msg_type, content in parsed],
+                                                       deadline=deadline, backlog=backlog)
+        cost = (time.time() - start_time) / len(batch)
+        
+        for (message, sender_id, ref, provisional, trace), (msg_type, content), analysis in zip(batch, parsed, analyses):
+            self.record_classification(analysis, cost, deadline)
+            if not analysis.get("fallback"):
+                self.cache.put(content, msg_type, analysis, cost=cost)
+            self.deliver(msg_type, content, sender_id, analysis, ref, provisional,
+                         source="fallback" if analysis.get("fallback") else "llm", cost=cost, trace=trace,
+                         deadline=deadline)
             
-        # Send structured message to aid provider
-        formatted = f"{prefix}|{analysis['category']}|{sender_id}|{content}|{analysis['summary']}"
+    def deliver(self, msg_type, content, sender_id, analysis, ref=None, provisional=None, source="llm", cost=None,
+                trace=None, deadline=None):
+        """Route an analysed message, or correct its provisional route"""
+        print(f"Analysis: {analysis}")
+        analysis = self.senders.refine(sender_id, ref, analysis)  # Keep what follow-ups added meanwhile
         
-        # Truncate if too long for LoRa
-        if len(formatted) > 230:
-            formatted = formatted[:230] + "..."
+        if provisional is None:
+            # Send structured message to aid provider
+            ref = ref or self.next_ref()
+            self.send_routed(msg_type, sender_id, content, analysis, ref, trace)
+            print("✓ Routed to aid provider\n")
+            event = "routed"
+        elif (analysis['category'], analysis['priority']) != (provisional['category'], provisional['priority']):
+            print(f"Correcting route #{ref}: {provisional['category']} P{provisional['priority']} -> "
+                  f"{analysis['category']} P{analysis['priority']}")
+            self.send_correction(msg_type, analysis, ref, trace)
+            print("✓ Correction sent to aid provider\n")
+            event = "corrected"
+        else:
+            print(f"✓ Ollama agrees with provisional route #{ref}, nothing to send\n")
+            event = "confirmed"
+            
+        self.senders.remember(sender_id, ref, msg_type, content, analysis)
+        self.metrics.inc("routes_total", event=event, category=analysis['category'])
+        if trace:
+            self.metrics.observe("stage_seconds", time.time() - trace['received'], stage="receive_to_final")
             
-        print(f"Routing to aid provider: {formatted[:100]}...")
-        self.interface.sendText(formatted, destinationId=self.aid_provider_id)
-        print("✓ Routed to aid provider\n")
+        # Enriched record for replay and analytics, queued for the background writer
+        self.log_event(event, msg_type=msg_type, sender=sender_id, message=content, analysis=analysis,
+                       ref=ref, provisional=provisional, source=source, cost=cost, trace=trace and trace['trace'],
+                       deadline_missed=deadline is not None and time.time() > deadline)
         
-        # Log for debugging
-        with open("router_log.txt", "a") as f:
-            f.write(f"{datetime.now()}: {json.dumps(enriched_msg)}\n")
+    def log_event(self, event, **fields):
+        """Queue a structured log record, never blocks on disk"""
+        if self.log:
+            fields['event'] = event
+            self.log.write(fields)
             
     def run(self):
-        """Main loop"""
-        self.connect()
+        """Main loop, on an asyncio event loop until Ctrl-C"""
+        runtime = NodeRuntime("router")
+        runtime.run(self.main(runtime))
+        
+    async def main(self, runtime):
+        self.connect(runtime)
         
         print("=== Router Node Active ===")
         print(f"Routing to aid provider: {self.aid_provider_id}")
         print("Waiting for messages...\n")
         
+        if self.stats_interval:
+            runtime.every(self.stats_interval, self.print_stats)
         try:
-            while True:
-                time.sleep(1)
-        except KeyboardInterrupt:
-            print("\nShutting down router...")
-            self.interface.close()
+            await runtime.wait()
+        finally:
+            self.shutdown()
+            
+    def shutdown(self):
+        print("\nShutting down router...")
+        self.print_stats()
+        self.stop_workers()
+        self.cache.close()
+        self.ollama.close()
+        self.outbox.close()
+        self.metrics.close(self.metrics_snapshot)
+        if self.log:
+            self.log.close()
+        self.interface.close()
 
 if __name__ == "__main__":
-    router = RouterNode(port="/dev/ttyUSB0")  # Adjust port
+    router = RouterNode(port="/dev/ttyUSB0", num_workers=1)  # Adjust port, 1 worker per Ollama slot
     router.run()
\ No newline at end of file
@@ -0,0 +1,98 @@
+# gemnet_dedup.py - Duplicate and retransmission suppression for receive paths
+import hashlib
+import threading
+import time
+from collections import OrderedDict, deque
+from gemnet_cache import normalize_text
+
+class DedupIndex:
+    """Bounded index of recently seen packets and message contents
+
+    Two layers:
+    - packet ring: the last ring_size (sender, packet id) pairs, which catches
+      mesh retransmissions and rebroadcasts of the very same packet
+    - content window: a hash of (sender, type, normalised text) kept for ttl
+      seconds, which catches a user resending the same message and outbox
+      retries that arrive as new packets
+
+    Each content entry carries the value it was remembered with (a route ref
+    or message id) and a repeat count, so callers can merge a duplicate into
+    the original instead of processing it again. Messages with a trace id are
+    also indexed by (sender, trace), which catches the same user message
+    re-dispatched through a second router even if it was classified, and so
+    labelled, differently there.
+    """
+    def __init__(self, ring_size=512, ttl=600, max_entries=2000):
+        self.ring = deque(maxlen=ring_size)
+        self.ring_set = set()
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # content hash -> {"value", "first_seen", "repeats"}, oldest first
+        self.lock = threading.Lock()
+
+        self.packets = 0
+        self.packet_duplicates = 0
+        self.content_duplicates = 0
+
+    def seen_packet(self, sender, packet_id):
+        """True if this mesh packet was already received, otherwise records it"""
+        if packet_id is None:
+            return False
+        key = (sender, packet_id)
+        with self.lock:
+            self.packets += 1
+            if key in self.ring_set:
+                self.packet_duplicates += 1
+                return True
+            if len(self.ring) == self.ring.maxlen:
+                self.ring_set.discard(self.ring[0])
+            self.ring.append(key)
+            self.ring_set.add(key)
+            return False
+
+    def _key(self, sender, msg_type, text):
+        return hashlib.sha1(f"{sender}|{msg_type}|{normalize_text(text)}".encode()).hexdigest()
+
+    def _expire(self, now):
+        while self.entries:
+            key, entry = next(iter(self.entries.items()))
+            if now - entry["first_seen"] <= self.ttl and len(self.entries) <= self.max_entries:
+                break
+            del self.entries[key]
+
+    def _trace_key(self, sender, trace):
+        return hashlib.sha1(f"{sender}|trace|{trace}".encode()).hexdigest()
+
+    def duplicate_of(self, sender, msg_type, text, trace=None):
+        """Entry of an earlier identical message (or trace) within ttl, with its repeat count bumped, else None"""
+        now = time.time()
+        keys = [self._key(sender, msg_type, text)]
+        if trace:
+            keys.insert(0, self._trace_key(sender, trace))
+        with self.lock:
+            self._expire(now)
+            entry = next((self.entries[key] for key in keys if key in self.entries), None)
+            if entry is None:
+                return None
+            entry["repeats"] += 1
+            self.content_duplicates += 1
+            return dict(entry)
+
+    def remember(self, sender, msg_type, text, value, trace=None):
+        """Record a processed message and what it became (ref, message id)"""
+        now = time.time()
+        entry = {"value": value, "first_seen": now, "repeats": 0}
+        with self.lock:
+            self.entries[self._key(sender, msg_type, text)] = entry
+            if trace:
+                self.entries[self._trace_key(sender, trace)] = entry  # Same entry, so repeats add up
+            self._expire(now)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "packets": self.packets,
+                "packet_duplicates": self.packet_duplicates,
+                "content_duplicates": self.content_duplicates,
+                "entries": len(self.entries)
+            }
@@ -0,0 +1,103 @@
+# gemnet_dispatch.py - Router discovery by heartbeat, load-aware router choice and failover
+import random
+import threading
+import time
+
+HEARTBEAT_INTERVAL = 60  # Seconds between router heartbeats
+MISSED_HEARTBEATS = 3  # A router silent for this many intervals is considered down
+
+class RouterDirectory:
+    """Routers a user portal can send to, with their advertised load and health
+
+    Routers broadcast a heartbeat with their classification queue depth and
+    capacity. pick() chooses the healthy router with the lowest load ratio,
+    counting messages sent to it since its last heartbeat so a burst is
+    spread out, and breaks ties by recent failures and then at random so
+    portals do not all favour one router. Routers given up front are usable
+    before their first heartbeat, so a single router without heartbeats
+    still works as before. A router is unhealthy once it misses
+    MISSED_HEARTBEATS heartbeats, or for down_for seconds after a send to it
+    failed outright.
+    """
+    def __init__(self, routers=(), interval=HEARTBEAT_INTERVAL, down_for=300):
+        self.timeout = interval * MISSED_HEARTBEATS
+        self.down_for = down_for
+        self.routers = {}  # router id -> {"depth", "capacity", "assigned", "last_seen", "down_until", "failures"}
+        self.lock = threading.Lock()
+        for router_id in routers:
+            self.add(router_id)
+
+    def add(self, router_id):
+        with self.lock:
+            return self.routers.setdefault(router_id, {"depth": 0, "capacity": 0, "assigned": 0, "last_seen": None,
+                                                       "down_until": 0.0, "failures": 0})
+
+    def heartbeat(self, router_id, depth, capacity):
+        """Record a heartbeat, returns True for a router not heard from before"""
+        new = router_id not in self.routers
+        router = self.add(router_id)
+        with self.lock:
+            router.update(depth=depth, capacity=capacity, assigned=0, last_seen=time.time(), down_until=0.0)
+        return new
+
+    def mark_down(self, router_id):
+        """A send to router_id failed, avoid it for down_for seconds"""
+        router = self.add(router_id)
+        with self.lock:
+            router["down_until"] = time.time() + self.down_for
+            router["failures"] += 1
+
+    def healthy(self, router_id, now=None):
+        now = now or time.time()
+        router = self.routers.get(router_id)
+        if router is None or router["down_until"] > now:
+            return False
+        return router["last_seen"] is None or now - router["last_seen"] <= self.timeout
+
+    def heard_from(self, router_id):
+        """True once router_id has sent a heartbeat"""
+        router = self.routers.get(router_id)
+        return bool(router and router["last_seen"])
+
+    def silent(self, router_id, now=None):
+        """True for a router that has sent heartbeats and then stopped"""
+        router = self.routers.get(router_id)
+        return bool(router and router["last_seen"]) and (now or time.time()) - router["last_seen"] > self.timeout
+
+    def load(self, router_id):
+        router = self.routers[router_id]
+        return (router["depth"] + router["assigned"]) / router["capacity"] if router["capacity"] else 0.0
+
+    def pick(self, exclude=()):
+        """Least-loaded healthy router not in exclude
+
+        If none is healthy, the router heard from most recently, so a
+        message is never left with nowhere to go. None only when every known
+        router is excluded.
+        """
+        now = time.time()
+        with self.lock:
+            candidates = [router_id for router_id in self.routers if router_id not in exclude]
+            healthy = [router_id for router_id in candidates if self.healthy(router_id, now)]
+            if healthy:
+                choice = min(healthy, key=lambda r: (self.load(r), self.routers[r]["failures"], random.random()))
+            elif candidates:
+                choice = max(candidates, key=lambda r: (self.routers[r]["last_seen"] or 0, -self.routers[r]["failures"]))
+            else:
+                return None
+            self.routers[choice]["assigned"] += 1
+            return choice
+
+    def stats(self):
+        now = time.time()
+        with self.lock:
+            return {
+                router_id: {
+                    "healthy": self.healthy(router_id, now),
+                    "load": self.load(router_id),
+                    "depth": router["depth"],
+                    "age": now - router["last_seen"] if router["last_seen"] else None,
+                    "failures": router["failures"]
+                }
+                for router_id, router in self.routers.items()
+            }
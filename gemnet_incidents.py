@@ -0,0 +1,173 @@
+# gemnet_incidents.py - Online clustering of reports of the same event into incidents
+import threading
+import time
+import zlib
+import numpy as np
+from gemnet_cache import normalize_text
+from gemnet_matching import extract_terms, locations
+
+PRIME = (1 << 31) - 1  # Hashes are kept to 31 bits so a * h + b fits in int64
+INCIDENT_TYPES = ("EMERGENCY", "REQUEST")  # Two similar offers are two resources, not one event
+
+def specific(places):
+    """Place hints with a number in them: a house or shelter, not just a street"""
+    return {place for place in places if any(c.isdigit() for c in place)}
+
+def same_place(places_a, places_b):
+    """False when two reports name clearly different places, True when they agree or either is vague"""
+    numbered_a, numbered_b = specific(places_a), specific(places_b)
+    if numbered_a and numbered_b:
+        return bool(numbered_a & numbered_b)
+    if places_a and places_b:
+        return bool(places_a & places_b)
+    return True
+
+class IncidentTracker:
+    """Groups reports of the same event into incidents, per category, within a time window
+
+    Each report is reduced to its index terms (words, resource concepts and
+    places, see gemnet_matching) and a MinHash signature of num_perm 31-bit
+    hashes. A new report is compared against every open incident of its
+    category in one NumPy operation, and joins the most similar one at or
+    above threshold unless the two name different places. An incident stays
+    open while reports keep arriving within window seconds of each other,
+    and is only evicted beyond max_open once due() has handed back its new
+    reporters.
+    Incidents are keyed by the route ref of their first report, which is
+    what the aid provider knows them by.
+    """
+    def __init__(self, window=1800, threshold=0.4, num_perm=64, max_open=500, seed=1):
+        self.window = window
+        self.threshold = threshold
+        self.max_open = max_open
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, PRIME, num_perm, dtype=np.int64)
+        self.b = rng.integers(0, PRIME, num_perm, dtype=np.int64)
+        self.incidents = {}  # ref -> incident dict, oldest activity first
+        self.matrices = {}  # category -> (refs, signature matrix), rebuilt after a change
+        self.lock = threading.Lock()
+        self.opened = 0
+        self.joined = 0
+
+    def signature(self, text):
+        """MinHash signature as an int64 array, or None for text without index terms"""
+        terms = extract_terms(text)
+        if not terms:
+            return None
+        hashes = np.array([zlib.crc32(term.encode()) & PRIME for term in terms], dtype=np.int64)
+        return ((np.outer(hashes, self.a) + self.b) % PRIME).min(axis=0)
+
+    def _expire(self, now):
+        for ref, incident in list(self.incidents.items()):
+            if now - incident['last_seen'] <= self.window and len(self.incidents) <= self.max_open:
+                break
+            if incident['pending'] or incident['escalated']:
+                continue  # Its new reporters have not been sent yet, due() will clear it
+            del self.incidents[ref]
+            self.matrices.pop(incident['category'], None)
+
+    def _matrix(self, category):
+        if category not in self.matrices:
+            refs = [ref for ref, incident in self.incidents.items() if incident['category'] == category]
+            matrix = np.stack([self.incidents[ref]['signature'] for ref in refs]) if refs else None
+            self.matrices[category] = (refs, matrix)
+        return self.matrices[category]
+
+    def match(self, text, msg_type, category, now=None):
+        """(incident, similarity) of the open incident this report belongs to, or (None, 0.0)"""
+        if msg_type not in INCIDENT_TYPES:
+            return None, 0.0
+        now = now or time.time()
+        signature = self.signature(text)
+        if signature is None:
+            return None, 0.0
+        places = locations(normalize_text(text))
+        with self.lock:
+            self._expire(now)
+            refs, matrix = self._matrix(category)
+            if matrix is None:
+                return None, 0.0
+            similarity = (matrix == signature).mean(axis=1)
+            for index in np.argsort(-similarity):
+                if similarity[index] < self.threshold:
+                    break
+                incident = self.incidents[refs[index]]
+                if same_place(incident['places'], places):
+                    return incident, float(similarity[index])
+        return None, 0.0
+
+    def open(self, ref, text, msg_type, analysis, sender):
+        """Start an incident from a newly routed report, None for offers and general messages"""
+        if msg_type not in INCIDENT_TYPES:
+            return None
+        signature = self.signature(text)
+        if signature is None:
+            return None
+        now = time.time()
+        incident = {
+            "ref": ref,
+            "msg_type": msg_type,
+            "category": analysis['category'],
+            "priority": analysis['priority'],
+            "urgency": analysis['urgency'],
+            "signature": signature,
+            "places": locations(normalize_text(text)),
+            "reporters": {sender},
+            "reports": 1,
+            "first_seen": now,
+            "last_seen": now,
+            "pending": [],  # (sender, trace id) not yet sent to the aid provider
+            "escalated": False
+        }
+        with self.lock:
+            self._expire(now)
+            self.incidents[ref] = incident
+            self.matrices.pop(incident['category'], None)
+            self.opened += 1
+        return incident
+
+    def join(self, incident, sender, trace=None, analysis=None):
+        """Count another report into an incident, returns True if it raised the priority"""
+        with self.lock:
+            incident['reports'] += 1
+            incident['last_seen'] = time.time()
+            self.incidents.pop(incident['ref'], None)
+            self.incidents[incident['ref']] = incident  # Most recently active last, for max_open
+            if sender not in incident['reporters']:
+                incident['reporters'].add(sender)
+                incident['pending'].append((sender, trace))
+            escalated = bool(analysis) and analysis['priority'] < incident['priority']
+            if escalated:
+                incident.update(priority=analysis['priority'], urgency=analysis['urgency'], escalated=True)
+            self.joined += 1
+            return escalated
+
+    def update(self, ref, analysis):
+        """Follow a route correction: the incident moves with the corrected category and priority"""
+        with self.lock:
+            incident = self.incidents.get(ref)
+            if incident is None:
+                return
+            self.matrices.pop(incident['category'], None)
+            self.matrices.pop(analysis['category'], None)
+            incident.update(category=analysis['category'], priority=analysis['priority'], urgency=analysis['urgency'])
+
+    def due(self):
+        """Incidents with new reporters or a raised priority since the last call, clearing them"""
+        with self.lock:
+            updates = []
+            for incident in self.incidents.values():
+                if incident['pending'] or incident['escalated']:
+                    updates.append(dict(incident, pending=list(incident['pending'])))
+                    incident['pending'] = []
+                    incident['escalated'] = False
+            return updates
+
+    def stats(self):
+        with self.lock:
+            return {
+                "open": len(self.incidents),
+                "opened": self.opened,
+                "joined": self.joined,
+                "multi_reporter": sum(1 for incident in self.incidents.values() if len(incident['reporters']) > 1)
+            }
@@ -0,0 +1,103 @@
+# gemnet_langid.py - Character-trigram language identification for the user portal
+import math
+import re
+from collections import Counter
+
+# Seed text per language: everyday and disaster vocabulary plus common function words.
+# Profiles are built once at import, no model files needed.
+SAMPLES = {
+    "English": """we need help please there is a fire near the school and the people are trapped in the house
+        my mother is sick and she needs medicine we have no water and no food for the children
+        the road is blocked by the flood where is the nearest shelter can someone send an ambulance
+        i am hurt and i cannot walk my leg is broken the building collapsed after the earthquake
+        we can offer blankets and rides with our truck to anyone who needs them this is urgent
+        how many people are at the shelter they have been waiting for hours is anyone coming
+        send rescue now my father had a heart attack he is not breathing we are on main street
+        thanks ok yes no hello hi help water food medical doctor hospital bleeding injured missing
+        our house was destroyed we lost everything need supplies fuel batteries diapers formula
+        i have a boat and can pick up people stranded by the water call me if you need anything""",
+    "Spanish": """necesitamos ayuda por favor hay un incendio cerca de la escuela y la gente esta atrapada en la casa
+        mi madre esta enferma y necesita medicina no tenemos agua ni comida para los niños
+        la carretera esta bloqueada por la inundacion donde esta el refugio mas cercano alguien puede enviar una ambulancia
+        estoy herido y no puedo caminar tengo la pierna rota el edificio se derrumbo despues del terremoto
+        podemos ofrecer mantas y transporte con nuestro camion a quien lo necesite es urgente
+        cuantas personas hay en el refugio llevan horas esperando viene alguien""",
+    "French": """nous avons besoin d'aide s'il vous plait il y a un incendie pres de l'ecole et les gens sont pieges dans la maison
+        ma mere est malade et elle a besoin de medicaments nous n'avons pas d'eau ni de nourriture pour les enfants
+        la route est bloquee par l'inondation ou est l'abri le plus proche quelqu'un peut envoyer une ambulance
+        je suis blesse et je ne peux pas marcher ma jambe est cassee le batiment s'est effondre apres le tremblement de terre
+        nous pouvons offrir des couvertures et du transport avec notre camion a ceux qui en ont besoin c'est urgent
+        combien de personnes sont au refuge ils attendent depuis des heures est ce que quelqu'un vient""",
+    "German": """wir brauchen hilfe bitte es gibt ein feuer in der nahe der schule und die leute sind im haus eingeschlossen
+        meine mutter ist krank und sie braucht medikamente wir haben kein wasser und kein essen fur die kinder
+        die strasse ist durch die uberschwemmung blockiert wo ist die nachste notunterkunft kann jemand einen krankenwagen schicken
+        ich bin verletzt und kann nicht laufen mein bein ist gebrochen das gebaude ist nach dem erdbeben eingesturzt
+        wir konnen decken und fahrten mit unserem lastwagen fur alle anbieten die sie brauchen es ist dringend
+        wie viele menschen sind in der unterkunft sie warten seit stunden kommt jemand""",
+    "Portuguese": """precisamos de ajuda por favor ha um incendio perto da escola e as pessoas estao presas na casa
+        minha mae esta doente e precisa de remedio nao temos agua nem comida para as criancas
+        a estrada esta bloqueada pela enchente onde fica o abrigo mais proximo alguem pode mandar uma ambulancia
+        estou ferido e nao consigo andar minha perna esta quebrada o predio desabou depois do terremoto
+        podemos oferecer cobertores e carona com o nosso caminhao para quem precisar e urgente
+        quantas pessoas estao no abrigo elas estao esperando ha horas alguem esta vindo""",
+    "Italian": """abbiamo bisogno di aiuto per favore c'e un incendio vicino alla scuola e le persone sono intrappolate in casa
+        mia madre e malata e ha bisogno di medicine non abbiamo acqua ne cibo per i bambini
+        la strada e bloccata dall'alluvione dov'e il rifugio piu vicino qualcuno puo mandare un'ambulanza
+        sono ferito e non riesco a camminare la mia gamba e rotta l'edificio e crollato dopo il terremoto
+        possiamo offrire coperte e passaggi con il nostro camion a chi ne ha bisogno e urgente
+        quante persone ci sono nel rifugio aspettano da ore arriva qualcuno""",
+    "Haitian Creole": """nou bezwen ed tanpri gen yon dife toupre lekol la e moun yo bloke anndan kay la
+        manman m malad e li bezwen medikaman nou pa gen dlo ni manje pou timoun yo
+        wout la bloke akoz inondasyon an ki kote abri ki pi pre a eske yon moun ka voye yon anbilans
+        mwen blese e mwen pa ka mache janm mwen kase batiman an tonbe apre tranblemanntè a
+        nou ka ofri lensey ak transpo nan kamyon nou an pou tout moun ki bezwen li ijan
+        konbyen moun ki nan abri a yo ap tann depi plizye edtan eske gen yon moun k ap vini""",
+}
+
+def _words(text):
+    return re.findall(r"[^\W\d_]+", text.lower())
+
+def _trigrams(text):
+    counts = Counter()
+    for word in _words(text):
+        padded = f" {word} "
+        for i in range(len(padded) - 2):
+            counts[padded[i:i + 3]] += 1
+    return counts
+
+def _normalize(counts):
+    norm = math.sqrt(sum(v * v for v in counts.values())) or 1.0
+    return {k: v / norm for k, v in counts.items()}
+
+PROFILES = {name: _normalize(_trigrams(text)) for name, text in SAMPLES.items()}
+VOCABULARY = {name: set(_words(text)) for name, text in SAMPLES.items()}
+
+# Weight of whole-word matches against the seed vocabulary, which short messages lean on
+WORD_WEIGHT = 0.5
+
+def identify(text):
+    """Rank languages by trigram cosine plus known-word share, returns [(language, score)] best first"""
+    counts = _trigrams(text)
+    if not counts:
+        return []
+    vector = _normalize(counts)
+    words = _words(text)
+    scores = []
+    for name, profile in PROFILES.items():
+        cosine = sum(w * profile.get(gram, 0.0) for gram, w in vector.items())
+        known = sum(1 for word in words if word in VOCABULARY[name]) / len(words)
+        scores.append((name, cosine + WORD_WEIGHT * known))
+    return sorted(scores, key=lambda item: item[1], reverse=True)
+
+def detect_language(text, min_score=0.3, min_margin=0.1):
+    """Confident language name for text, or None when the text is too short or ambiguous
+
+    Callers should fall back to the LLM when this returns None.
+    """
+    ranked = identify(text)
+    if len(ranked) < 2:
+        return None
+    (best, best_score), (_, second_score) = ranked[0], ranked[1]
+    if best_score < min_score or best_score - second_score < min_margin:
+        return None
+    return best
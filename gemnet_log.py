@@ -0,0 +1,262 @@
+# gemnet_log.py - Background structured log writer with rotation, and a replay reader
+import argparse
+import json
+import os
+import queue
+import struct
+import threading
+import time
+import zlib
+from collections import Counter
+from datetime import datetime
+
+BINARY_MAGIC = b"GNLOG1\n"  # Binary logs: magic, then blocks of 4-byte length + raw-deflated JSONL
+
+class LogWriter:
+    """Buffers records in memory and writes them from a background thread
+
+    write() never touches the disk, so it is safe on the radio and worker
+    threads. Records are flushed in batches of up to batch_size or every
+    flush_interval seconds. The file rotates to path.1 .. path.<backups>
+    when it passes max_bytes or is older than rotate_interval seconds.
+
+    mode="binary" writes each batch as one deflate-compressed block, which
+    cuts both file size and the number of writes on SD-card storage.
+    """
+    def __init__(self, path="router_log.jsonl", mode="jsonl", batch_size=100, flush_interval=2.0,
+                 max_bytes=10 * 1024 * 1024, rotate_interval=24 * 3600, backups=5, max_pending=10000):
+        if mode not in ("jsonl", "binary"):
+            raise ValueError(f"Unknown log mode {mode}")
+        self.path = path
+        self.mode = mode
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.rotate_interval = rotate_interval
+        self.backups = backups
+        self.pending = queue.Queue(maxsize=max_pending)
+
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+        self.rotations = 0
+
+        self.file = None
+        self.opened = None
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name="log-writer", daemon=True)
+        self.thread.start()
+
+    def write(self, record):
+        """Queue a record (dict), stamping it with ts if missing
+
+        The record is serialised here, so the caller may change it afterwards;
+        values JSON has no type for are written as their str().
+        """
+        record.setdefault("ts", time.time())
+        try:
+            line = json.dumps(record, ensure_ascii=False, separators=(",", ":"), default=str) + "\n"
+        except ValueError as e:  # A circular reference
+            self.dropped += 1
+            print(f"[LOG] Record not serialisable, dropped: {e}")
+            return
+        try:
+            self.pending.put_nowait(line)
+        except queue.Full:
+            self.dropped += 1  # Never block the caller on a slow disk
+
+    def run(self):
+        while self.running or not self.pending.empty():
+            batch = []
+            try:
+                batch.append(self.pending.get(timeout=self.flush_interval))
+                deadline = time.time() + self.flush_interval
+                while len(batch) < self.batch_size and time.time() < deadline:
+                    batch.append(self.pending.get(timeout=max(deadline - time.time(), 0.01)))
+            except queue.Empty:
+                pass
+            if batch:
+                try:
+                    self.flush(batch)
+                except Exception as e:  # Keep the writer alive whatever went wrong with one batch
+                    self.dropped += len(batch)
+                    print(f"[LOG] Write failed, {len(batch)} record(s) lost: {type(e).__name__}: {e}")
+
+    def flush(self, batch):
+        self._maybe_rotate()
+        if self.file is None:
+            self._open()
+        lines = "".join(batch).encode()
+        if self.mode == "binary":
+            compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+            block = compressor.compress(lines) + compressor.flush()
+            self.file.write(struct.pack(">I", len(block)) + block)
+        else:
+            self.file.write(lines)
+        self.file.flush()
+        self.written += len(batch)
+        self.batches += 1
+
+    def _open(self):
+        new = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+        self.file = open(self.path, "ab")
+        if new and self.mode == "binary":
+            self.file.write(BINARY_MAGIC)
+        self.opened = os.path.getmtime(self.path) if not new else time.time()
+
+    def _maybe_rotate(self):
+        if not os.path.exists(self.path):
+            return
+        if self.opened is None:
+            self.opened = os.path.getmtime(self.path)
+        too_big = os.path.getsize(self.path) >= self.max_bytes
+        too_old = self.rotate_interval and time.time() - self.opened >= self.rotate_interval
+        if not (too_big or too_old):
+            return
+        if self.file:
+            self.file.close()
+            self.file = None
+        for index in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{index}"):
+                os.replace(f"{self.path}.{index}", f"{self.path}.{index + 1}")
+        if self.backups:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self.opened = None
+        self.rotations += 1
+
+    def stats(self):
+        return {
+            "written": self.written,
+            "pending": self.pending.qsize(),
+            "dropped": self.dropped,
+            "batches": self.batches,
+            "rotations": self.rotations
+        }
+
+    def close(self):
+        """Flush everything queued and stop the writer thread"""
+        self.running = False
+        self.thread.join(timeout=10)
+        if self.file:
+            self.file.close()
+            self.file = None
+
+def log_files(path):
+    """Rotated files oldest first, then the live file"""
+    rotated = []
+    index = 1
+    while os.path.exists(f"{path}.{index}"):
+        rotated.append(f"{path}.{index}")
+        index += 1
+    return list(reversed(rotated)) + ([path] if os.path.exists(path) else [])
+
+def read_log(path, include_rotated=True):
+    """Yield records from a JSONL, binary or legacy router_log.txt file in write order"""
+    for name in (log_files(path) if include_rotated else [path]):
+        with open(name, "rb") as f:
+            data = f.read()
+        if data.startswith(BINARY_MAGIC):
+            pos = len(BINARY_MAGIC)
+            while pos + 4 <= len(data):
+                (length,) = struct.unpack(">I", data[pos:pos + 4])
+                block = data[pos + 4:pos + 4 + length]
+                pos += 4 + length
+                try:
+                    lines = zlib.decompress(block, -15).decode()
+                except zlib.error:
+                    break  # Torn final block after a power loss
+                yield from _parse_lines(lines)
+        else:
+            yield from _parse_lines(data.decode(errors="replace"))
+
+def _parse_lines(text):
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        stamp = None
+        if not line.startswith("{"):
+            # Legacy "2024-05-01 12:00:00.000000: {...}" lines from router_log.txt
+            stamp, _, line = line.partition(": ")
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue  # Partially written last line
+        if stamp is not None:
+            record.setdefault("event", "routed")
+            record.setdefault("ts", datetime.fromisoformat(stamp).timestamp())
+            record.setdefault("msg_type", record.get("original_type"))
+        yield record
+
+class RouterReplay:
+    """Rebuilds router state and analytics from logged records, without the LLM"""
+    def __init__(self):
+        self.routes = {}  # ref -> latest record for that route
+        self.events = Counter()
+        self.sources = Counter()
+        self.corrections = 0
+        self.llm_seconds = 0.0
+        self.first = None
+        self.last = None
+
+    def add(self, record):
+        self.events[record.get("event", "unknown")] += 1
+        ts = record.get("ts")
+        if ts:
+            self.first = ts if self.first is None else min(self.first, ts)
+            self.last = ts if self.last is None else max(self.last, ts)
+        if record.get("event") == "corrected":
+            self.corrections += 1
+        if record.get("source"):
+            self.sources[record["source"]] += 1
+        if record.get("cost") and record.get("source") == "llm":
+            self.llm_seconds += record["cost"]
+        # Later records for a ref (LLM result after the provisional route) replace earlier ones
+        if record.get("analysis") and record.get("ref") and record.get("event") in ("provisional", "routed", "corrected", "confirmed"):
+            self.routes[record["ref"]] = record
+
+    def replay(self, records):
+        for record in records:
+            self.add(record)
+        return self
+
+    def rebuild_cache(self, cache):
+        """Put every final LLM analysis back into a ClassificationCache, returns the count"""
+        count = 0
+        for record in self.routes.values():
+            analysis = record.get("analysis") or {}
+            if record.get("source") == "llm" and not analysis.get("fallback"):
+                cache.put(record["message"], record["msg_type"], analysis, cost=record.get("cost") or 0.0)
+                count += 1
+        return count
+
+    def last_ref(self):
+        refs = [int(ref, 16) for ref in self.routes if all(c in "0123456789abcdef" for c in ref)]
+        return max(refs) if refs else 0
+
+    def report(self):
+        span = (self.last - self.first) / 3600 if self.first is not None else 0.0
+        categories = Counter(record["analysis"].get("category") for record in self.routes.values())
+        priorities = Counter(record["analysis"].get("priority") for record in self.routes.values())
+        print(f"=== Router log replay: {sum(self.events.values())} records over {span:.1f}h ===")
+        print("Events:     " + ", ".join(f"{k}={v}" for k, v in self.events.most_common()))
+        print("Sources:    " + ", ".join(f"{k}={v}" for k, v in self.sources.most_common()))
+        print("Categories: " + ", ".join(f"{k}={v}" for k, v in categories.most_common()))
+        print("Priorities: " + ", ".join(f"P{k}={v}" for k, v in sorted(priorities.items(), key=lambda i: str(i[0]))))
+        print(f"Routes: {len(self.routes)}, corrections: {self.corrections}, LLM time: {self.llm_seconds:.0f}s")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay a router log for analytics or to rebuild the classification cache")
+    parser.add_argument("path", nargs="?", default="router_log.jsonl")
+    parser.add_argument("--rebuild-cache", metavar="DB", help="write LLM analyses into this classification cache")
+    args = parser.parse_args()
+
+    state = RouterReplay().replay(read_log(args.path))
+    state.report()
+    if args.rebuild_cache:
+        from gemnet_cache import ClassificationCache
+        cache = ClassificationCache(path=args.rebuild_cache)
+        print(f"Rebuilt {state.rebuild_cache(cache)} cache entries in {args.rebuild_cache}")
+        cache.close()
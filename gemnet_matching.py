@@ -0,0 +1,220 @@
+# gemnet_matching.py - Incremental matching of offers to requests and emergencies for the aid provider
+import heapq
+import math
+import re
+import threading
+import time
+from gemnet_cache import normalize_text
+
+# Resource concepts: words that name the same kind of help map to one term, so "rides" meets "truck"
+RESOURCES = {
+    "water": ("water", "drinking", "thirst", "thirsty", "dlo", "agua", "eau"),
+    "food": ("food", "hungry", "meal", "meals", "rice", "bread", "manje", "comida", "nourriture", "eat"),
+    "baby": ("baby", "babies", "formula", "diaper", "diapers", "infant"),
+    "medicine": ("medicine", "medicines", "medication", "pill", "pills", "insulin", "antibiotic", "antibiotics",
+                 "remedios", "first aid", "bandage", "bandages"),
+    "medical": ("doctor", "doctors", "nurse", "nurses", "medic", "medics", "paramedic", "emt", "ambulance", "clinic",
+                "hospital", "injured", "wound", "wounded", "sick"),
+    "shelter": ("shelter", "tent", "tents", "housing", "place to stay", "place to sleep", "room", "beds", "bed"),
+    "blankets": ("blanket", "blankets", "cobertores", "decken", "sleeping bag", "sleeping bags", "clothes", "clothing",
+                 "jacket", "jackets", "warm"),
+    "transport": ("ride", "rides", "transport", "vehicle", "truck", "car", "bus", "boat", "driver", "pickup", "evacuate",
+                  "evacuation", "lift"),
+    "power": ("generator", "generators", "fuel", "gas", "petrol", "diesel", "battery", "batteries", "power", "charger",
+              "charging", "electricity"),
+    "rescue": ("rescue", "dig", "digging", "rubble", "trapped", "chainsaw", "rope", "ladder", "search"),
+    "hygiene": ("hygiene", "soap", "toilet", "sanitary", "toothpaste", "clean")
+}
+PLACES = ("shelter", "block", "street", "st", "road", "rd", "avenue", "ave", "camp", "church", "school", "hospital",
+          "clinic", "house", "building", "bridge", "park", "market", "station", "abri", "casa", "rue", "calle")
+STREETS = r"(street|st|road|rd|avenue|ave)"
+LOCATION = re.compile(r"\b(" + "|".join(PLACES) + r") ?#?(\d+)\b|\b(\d+)(?:st|nd|rd|th)? (" + "|".join(PLACES) +
+                      r")\b|\b([a-z]+) " + STREETS + r"\b")
+ADDRESS = re.compile(r"\b(\d+)(?:st|nd|rd|th)? ([a-z]+) " + STREETS + r"\b")
+STOPWORDS = frozenset("""a an and are at be but by can for from get give have has he her here his i if in is it its
+    me my need needs needed no not of on or our out please provide offer offering offers some that the their them there
+    they this to us we with you your anyone help any available extra""".split())
+OFFER_CUES = re.compile(r"\b(?:can (?:offer|provide|give|help|bring|drive|take)|have (?:extra|spare|some)|offering|"
+                        r"available|to share|free to)\b", re.IGNORECASE)
+
+_CONCEPT_PHRASES = sorted(((phrase, concept) for concept, words in RESOURCES.items() for phrase in words),
+                          key=lambda item: -len(item[0]))
+_CONCEPT_PATTERN = re.compile(r"\b(?:" + "|".join(re.escape(p) for p, _ in _CONCEPT_PHRASES) + r")\b")
+_CONCEPT_OF = dict(_CONCEPT_PHRASES)
+
+# Term weights: a shared resource concept counts most, a shared place next, a shared plain word least
+WEIGHTS = {"r": 2.0, "@": 1.5, "w": 1.0}
+
+def role_of(msg_type, content=""):
+    """"offer", "need" or None for a stored message type label like OFFER-P4 or 🚨URGENT-P2
+
+    Urgent labels hide the original type, so an offer is recognised from
+    its wording there.
+    """
+    label = (msg_type or "").upper()
+    if "OFFER" in label:
+        return "offer"
+    if "REQUEST" in label or "EMERGENCY" in label:
+        return "need"
+    if "URGENT" in label:
+        return "offer" if OFFER_CUES.search(content or "") else "need"
+    return None
+
+def _stem(word):
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+def locations(text):
+    """Place hints in normalised text, like shelter 5, main street and 12 main street"""
+    found = set()
+    for m in LOCATION.finditer(text):
+        if m.group(1):
+            found.add(f"{m.group(1)} {m.group(2)}")
+        elif m.group(3):
+            found.add(f"{m.group(3)} {m.group(4)}")
+        elif m.group(5) not in STOPWORDS:
+            found.add(f"{m.group(5)} {m.group(6)}")
+    found.update(" ".join(m.groups()) for m in ADDRESS.finditer(text) if m.group(2) not in STOPWORDS)
+    return found
+
+def extract_terms(text):
+    """Index terms of a message: r:<resource concept>, @<place>, w:<word>"""
+    text = normalize_text(text)
+    terms = {f"r:{_CONCEPT_OF[m.group(0)]}" for m in _CONCEPT_PATTERN.finditer(text)}
+    terms.update(f"@{place}" for place in locations(text))
+    for word in text.split():
+        if len(word) >= 3 and word not in STOPWORDS and not word.isdigit():
+            terms.add(f"w:{_stem(word)}")
+    return terms
+
+class ResourceMatcher:
+    """Inverted index pairing open offers with open requests and emergencies
+
+    Offers and needs are indexed separately by term (resource concepts from
+    a small multilingual vocabulary, places like "shelter 3", and plain
+    words). A new message only looks at the opposite side's posting lists
+    for its own terms, newest first and at most scan_limit entries per
+    term, so matching cost depends on the message, not on how many offers
+    and needs are open. Candidates are scored by summed term weight times
+    inverse document frequency, with a bonus for the same category. A
+    message never matches its own sender's messages.
+    """
+    def __init__(self, top_k=3, min_score=2.0, scan_limit=200, category_bonus=1.0):
+        self.top_k = top_k
+        self.min_score = min_score
+        self.scan_limit = scan_limit
+        self.category_bonus = category_bonus
+        self.entries = {}  # message id -> {"role", "sender", "category", "priority", "created", "terms"}
+        self.postings = {"offer": {}, "need": {}}  # role -> term -> {message id: None}, oldest first
+        self.counts = {"offer": 0, "need": 0}
+        self.lock = threading.Lock()
+        self.matched = 0
+        self.suggestions = 0
+        self.lookups = 0
+        self.scanned = 0
+
+    def add(self, msg, role=None):
+        """Index a stored message, returns its ranked matches (see matches), [] if it is neither offer nor need"""
+        role = role or role_of(msg.get("type"), msg.get("content"))
+        if role is None:
+            return []
+        terms = extract_terms(f"{msg.get('content') or ''} {msg.get('summary') or ''}")
+        with self.lock:
+            self._remove(msg["id"])
+            self.entries[msg["id"]] = {"role": role, "sender": msg.get("sender"), "category": msg.get("category"),
+                                       "priority": msg.get("priority"), "created": msg.get("created") or time.time(),
+                                       "terms": terms}
+            self.counts[role] += 1
+            for term in terms:
+                self.postings[role].setdefault(term, {})[msg["id"]] = None
+            found = self._matches(msg["id"])
+            if found:
+                self.matched += 1
+                self.suggestions += len(found)
+            return found
+
+    def update(self, msg):
+        """Re-read category and priority after a route correction"""
+        with self.lock:
+            entry = self.entries.get(msg["id"])
+            if entry:
+                entry.update(category=msg.get("category"), priority=msg.get("priority"))
+
+    def remove(self, msg_id):
+        """Drop a resolved message from the index"""
+        with self.lock:
+            self._remove(msg_id)
+
+    def _remove(self, msg_id):
+        entry = self.entries.pop(msg_id, None)
+        if entry is None:
+            return
+        self.counts[entry["role"]] -= 1
+        postings = self.postings[entry["role"]]
+        for term in entry["terms"]:
+            ids = postings.get(term)
+            if ids is not None:
+                ids.pop(msg_id, None)
+                if not ids:
+                    del postings[term]
+
+    def matches(self, msg_id, limit=None):
+        """[(score, other id, shared terms)] best first, for an indexed message"""
+        with self.lock:
+            return self._matches(msg_id, limit)
+
+    def _matches(self, msg_id, limit=None):
+        entry = self.entries.get(msg_id)
+        if entry is None:
+            return []
+        other = "need" if entry["role"] == "offer" else "offer"
+        postings = self.postings[other]
+        size = max(self.counts[other], 1)
+        scores = {}
+        shared = {}
+        self.lookups += 1
+        for term in entry["terms"]:
+            ids = postings.get(term)
+            if not ids:
+                continue
+            weight = WEIGHTS[term[0]] * math.log(1 + size / len(ids))
+            for count, candidate in enumerate(reversed(ids)):
+                if count >= self.scan_limit:
+                    break
+                scores[candidate] = scores.get(candidate, 0.0) + weight
+                shared.setdefault(candidate, []).append(term)
+            self.scanned += min(len(ids), self.scan_limit)
+
+        ranked = []
+        for candidate, score in scores.items():
+            match = self.entries[candidate]
+            if match["sender"] == entry["sender"]:
+                continue
+            if match["category"] and match["category"] == entry["category"]:
+                score += self.category_bonus
+            if score >= self.min_score:
+                # Among equal scores, offers go to the most urgent and then oldest need
+                need = match if other == "need" else entry
+                urgency = -(need["priority"] if need["priority"] is not None else 9)
+                ranked.append((round(score, 2), urgency, -match["created"], candidate))
+        best = heapq.nlargest(limit or self.top_k, ranked)
+        return [(score, candidate, sorted({self._label(t) for t in shared[candidate]}))
+                for score, _, _, candidate in best]
+
+    @staticmethod
+    def _label(term):
+        return term[1:] if term[0] == "@" else term[2:]
+
+    def stats(self):
+        with self.lock:
+            return {
+                "offers": self.counts["offer"],
+                "needs": self.counts["need"],
+                "terms": len(self.postings["offer"]) + len(self.postings["need"]),
+                "matched": self.matched,
+                "suggestions": self.suggestions,
+                "avg_scanned": self.scanned / self.lookups if self.lookups else 0.0
+            }
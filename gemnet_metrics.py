@@ -0,0 +1,200 @@
+# gemnet_metrics.py - Counters, latency histograms, Prometheus endpoint and snapshot file
+import bisect
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Histogram bucket upper bounds in seconds, sized for Jetson-class latencies
+LATENCY_BUCKETS = (0.5, 1, 2, 5, 10, 20, 30, 60, 90, 120, 180, 300)
+
+# End-to-end mesh latencies, from a send on one node to handling on another
+MESH_BUCKETS = (1, 2, 5, 10, 20, 30, 60, 120, 300, 600, 1200)
+
+class LatencyHistogram:
+    """Fixed-bucket latency histogram with count, sum and max"""
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # Last slot is +Inf
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def percentile(self, pct):
+        """Upper bound of the bucket holding the pct-th percentile"""
+        if not self.count:
+            return 0.0
+        target = pct / 100 * self.count
+        seen = 0
+        for bound, count in zip(self.buckets + (self.max,), self.counts):
+            seen += count
+            if seen >= target:
+                return min(bound, self.max)
+        return self.max
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "avg": self.total / self.count if self.count else 0.0,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "max": self.max,
+            "buckets": dict(zip([str(b) for b in self.buckets] + ["+Inf"], self.counts))
+        }
+
+def _labels(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"' for k, v in pairs) + "}"
+
+class Metrics:
+    """Per-node metric registry
+
+    Counters and histograms are recorded directly with inc()/observe().
+    Gauges and values owned by other components (queue depth, Ollama
+    histograms, outbox counts) are pulled at export time from collector
+    functions returning (kind, name, labels, value) tuples, where kind is
+    "counter", "gauge" or "histogram" and value a number or LatencyHistogram.
+    Every metric gets a node label, and names are prefixed with gemnet_.
+    """
+    def __init__(self, node):
+        self.node = node
+        self.counters = {}  # (name, labels) -> value
+        self.histograms = {}  # (name, labels) -> LatencyHistogram
+        self.buckets = {}  # histogram name -> bucket bounds
+        self.collectors = []
+        self.lock = threading.Lock()
+        self.server = None
+        self.snapshot_thread = None
+        self.running = False
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, _labels(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        key = (name, _labels(labels))
+        with self.lock:
+            if key not in self.histograms:
+                self.histograms[key] = LatencyHistogram(self.buckets.get(name, LATENCY_BUCKETS))
+            self.histograms[key].observe(value)
+
+    def set_buckets(self, name, buckets):
+        """Use buckets for histogram name instead of LATENCY_BUCKETS"""
+        self.buckets[name] = tuple(buckets)
+
+    def collector(self, fn):
+        self.collectors.append(fn)
+
+    def samples(self):
+        """Every metric as (kind, name, labels tuple, value)"""
+        with self.lock:
+            out = [("counter", name, labels, value) for (name, labels), value in self.counters.items()]
+            out += [("histogram", name, labels, hist) for (name, labels), hist in self.histograms.items()]
+        for fn in self.collectors:
+            try:
+                out += [(kind, name, _labels(labels), value) for kind, name, labels, value in fn()]
+            except Exception as e:
+                print(f"[METRICS] Collector failed: {type(e).__name__}: {e}")
+        return out
+
+    def render(self):
+        """Prometheus text exposition format"""
+        node = (("node", self.node),)
+        lines = []
+        typed = set()
+        for kind, name, labels, value in sorted(self.samples(), key=lambda s: (s[1], s[2])):
+            name = f"gemnet_{name}"
+            if name not in typed:
+                lines.append(f"# TYPE {name} {kind}")
+                typed.add(name)
+            labels = node + labels
+            if kind != "histogram":
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+                continue
+            cumulative = 0
+            for bound, count in zip([str(b) for b in value.buckets] + ["+Inf"], value.counts):
+                cumulative += count
+                lines.append(f"{name}_bucket{_format_labels(labels, (('le', bound),))} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {value.total}")
+            lines.append(f"{name}_count{_format_labels(labels)} {value.count}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        """JSON-friendly dict of every metric, histograms summarised"""
+        out = {"node": self.node, "time": time.time(), "metrics": {}}
+        for kind, name, labels, value in self.samples():
+            key = name + _format_labels(labels)
+            out["metrics"][key] = value.snapshot() if kind == "histogram" else value
+        return out
+
+    def serve(self, port, host="127.0.0.1"):
+        """Expose /metrics over HTTP from a daemon thread"""
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/metrics", "/"):
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # Keep scrapes off the console
+
+        try:
+            self.server = ThreadingHTTPServer((host, port), Handler)
+        except OSError as e:
+            print(f"[METRICS] Could not listen on {host}:{port}: {e}")
+            return None
+        threading.Thread(target=self.server.serve_forever, name="metrics-http", daemon=True).start()
+        print(f"[METRICS] Prometheus endpoint at http://{host}:{port}/metrics")
+        return self.server
+
+    def start_snapshots(self, path, interval=60):
+        """Rewrite path with snapshot() every interval seconds"""
+        self.running = True
+
+        def loop():
+            while self.running:
+                time.sleep(interval)
+                self.write_snapshot(path)
+
+        self.snapshot_thread = threading.Thread(target=loop, name="metrics-snapshot", daemon=True)
+        self.snapshot_thread.start()
+
+    def write_snapshot(self, path):
+        try:
+            tmp = f"{path}.tmp"
+            with open(tmp, "w") as f:
+                json.dump(self.snapshot(), f, indent=1)
+            os.replace(tmp, path)  # Readers never see a half-written file
+        except OSError as e:
+            print(f"[METRICS] Snapshot failed: {e}")
+
+    def close(self, path=None):
+        """Stop exporting, writing a final snapshot to path if given"""
+        self.running = False
+        if path:
+            self.write_snapshot(path)
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
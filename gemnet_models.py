@@ -0,0 +1,191 @@
+# gemnet_models.py - Picks the Ollama model and prompt size each call can afford before its deadline
+import threading
+import time
+from collections import defaultdict
+from gemnet_ollama import ollama_call
+
+# Seconds from receipt until a classification is useless, by the priority the fast path gave the message
+PRIORITY_DEADLINES = {1: 60, 2: 90, 3: 180, 4: 300, 5: 300}
+
+# Seconds per call assumed before a model has answered anything (Jetson logs show 20-70s for gemma:2b)
+DEFAULT_PRIORS = {"gemma:2b": 30.0, "gemma:7b": 90.0}
+
+class ModelSelector:
+    """Chooses the largest model that can answer before a deadline, degrading as load grows
+
+    models is listed largest first. The ladder is each model with the full
+    prompt, then the smallest with a compact prompt; a call gets the first
+    rung whose estimated seconds fit its share of the time left before the
+    deadline, or the rule-based fallback when none does. Estimates are
+    learned from the calls made (see estimate and record).
+    """
+    def __init__(self, models=("gemma:2b",), priors=None, workers=1, margin=1.0, alpha=0.3,
+                 compact_ratio=0.6, forget=900, related=None):
+        self.models = tuple(models)
+        self.priors = dict(DEFAULT_PRIORS, **(priors or {}))
+        self.workers = workers
+        self.margin = margin
+        self.alpha = alpha
+        self.compact_ratio = compact_ratio  # Assumed cost of a compact prompt until one is observed
+        self.forget = forget
+        self.related = dict(related or {})  # prompt_type -> prompt_type to scale from until it is observed
+        self.estimates = {}  # (model, prompt_type, compact) -> [mean, deviation, last update]
+        self.inflight = 0
+        self.lock = threading.Lock()
+        self.planned = defaultdict(int)  # (model or "rules", prompt_type) -> plans
+        self.compact = defaultdict(int)
+        self.answered = defaultdict(int)
+        self.missed = defaultdict(int)
+
+    @property
+    def smallest(self):
+        return self.models[-1]
+
+    def estimate(self, model, prompt_type, compact=False, size=1):
+        """Expected seconds for a call of size units, padded by margin deviations
+
+        Per (model, prompt_type, compact) an exponentially weighted mean and
+        deviation of seconds per unit (a message, or one batch item) is
+        kept. A rung not observed within forget seconds is scaled from the
+        nearest one that was: the other prompt size, another model by the
+        ratio of their priors, or the prompt type related maps it to. With
+        nothing observed the prior is used.
+        """
+        with self.lock:
+            return self._estimate(model, prompt_type, compact, size, time.time())
+
+    def _prior(self, model, compact):
+        return self.priors.get(model, max(self.priors.values())) * (self.compact_ratio if compact else 1.0)
+
+    def _estimate(self, model, prompt_type, compact, size, now):
+        for kind in (prompt_type, self.related.get(prompt_type)):
+            for other in (model,) + self.models:
+                for other_compact in (compact, not compact):
+                    entry = self.estimates.get((other, kind, other_compact))
+                    if entry and now - entry[2] <= self.forget:
+                        scale = self._prior(model, compact) / self._prior(other, other_compact)
+                        return (entry[0] + self.margin * entry[1]) * scale * size
+        return self._prior(model, compact) * size
+
+    def _observed(self, prompt_type, now):
+        kinds = (prompt_type, self.related.get(prompt_type))
+        return any(kind in kinds and now - entry[2] <= self.forget for (_, kind, _), entry in self.estimates.items())
+
+    def plan(self, prompt_type, deadline=None, size=1, backlog=0, compact=True):
+        """{"model", "compact", ...} for a call of size units due by deadline, backlog more calls behind it
+
+        model is None when only the rule-based fallback fits. Without a
+        deadline the largest model is planned. Pass compact=False for
+        prompts that have no compact form.
+
+        The time left is shared with the backlog and the calls already in
+        flight, per worker, so a growing queue moves work to smaller models
+        and shorter prompts before giving up on the model. Until anything
+        has been observed for the prompt type the smallest model is tried
+        while the deadline has not passed, as the priors are only a guess.
+        """
+        with self.lock:
+            now = time.time()
+            ladder = [(model, False) for model in self.models] + ([(self.smallest, True)] if compact else [])
+            if deadline is None:
+                model, use_compact = ladder[0]
+            elif not self._observed(prompt_type, now):
+                model, use_compact = (self.smallest, False) if deadline > now else (None, False)
+            else:
+                budget = (deadline - now) / (1 + (backlog + self.inflight) / self.workers)
+                model, use_compact = next(((m, c) for m, c in ladder
+                                           if self._estimate(m, prompt_type, c, size, now) <= budget), (None, False))
+            self.planned[(model or "rules", prompt_type)] += 1
+            if use_compact:
+                self.compact[(model, prompt_type)] += 1
+            if model:
+                self.inflight += 1
+            return dict(model=model, compact=use_compact, prompt_type=prompt_type, deadline=deadline, size=size, planned=now)
+
+    def call(self, plan, prompt, **options):
+        """Step generator making the planned call (see OllamaClient.run_steps), returns the reply
+
+        The call is recorded whether it answers or raises; a failure counts
+        as having used all the time it had, so a missing or erroring model
+        is passed over too. A generator closed or cancelled before the reply
+        only gives its slot back. Plans, answers and deadline misses are
+        counted for stats() and the metrics endpoint.
+        """
+        try:
+            reply = yield ollama_call(plan['model'], prompt, deadline=plan['deadline'], **options)
+        except Exception:
+            self.record(plan)
+            raise
+        except BaseException:  # GeneratorExit, CancelledError: says nothing about the model
+            self.release(plan)
+            raise
+        self.record(plan, reply)
+        return reply
+
+    def release(self, plan):
+        """Give back the in-flight slot of a planned call abandoned before it answered"""
+        if plan['model'] is not None:
+            with self.lock:
+                self.inflight = max(self.inflight - 1, 0)
+
+    def record(self, plan, reply=None):
+        """Account for a planned call once it has answered (reply) or failed (None)"""
+        if plan['model'] is None:
+            return
+        now = time.time()
+        missed = plan['deadline'] is not None and now > plan['deadline']
+        with self.lock:
+            self.inflight = max(self.inflight - 1, 0)
+            key = (plan['model'], plan['prompt_type'])
+            if missed:
+                self.missed[key] += 1
+            if reply is None:
+                seconds = max(now, plan['deadline'] or 0) - plan['planned']
+            else:
+                self.answered[key] += 1
+                seconds = reply['elapsed']
+            self._observe((plan['model'], plan['prompt_type'], plan['compact']), seconds / plan['size'], now)
+
+    def _observe(self, key, seconds, now):
+        entry = self.estimates.get(key)
+        if entry is None or now - entry[2] > self.forget:
+            self.estimates[key] = [seconds, seconds / 2, now]
+            return
+        error = seconds - entry[0]
+        entry[0] += self.alpha * error
+        entry[1] += self.alpha * (abs(error) - entry[1])
+        entry[2] = now
+
+    def stats(self):
+        """Plans, compact prompts, answers, deadline misses and current estimate per model/prompt_type"""
+        with self.lock:
+            now = time.time()
+            return {
+                f"{model}/{prompt_type}": {
+                    "planned": planned,
+                    "compact": self.compact[(model, prompt_type)],
+                    "answered": self.answered[(model, prompt_type)],
+                    "missed": self.missed[(model, prompt_type)],
+                    "estimate": self._estimate(model, prompt_type, False, 1, now) if model != "rules" else 0.0
+                }
+                for (model, prompt_type), planned in sorted(self.planned.items())
+            }
+
+    def metric_samples(self):
+        """Collector for gemnet_metrics.Metrics"""
+        with self.lock:
+            now = time.time()
+            samples = [("counter", "model_plans_total", {"model": m, "prompt_type": p}, n)
+                       for (m, p), n in self.planned.items()]
+            samples += [("counter", "model_compact_total", {"model": m, "prompt_type": p}, n)
+                        for (m, p), n in self.compact.items()]
+            samples += [("counter", "model_deadline_misses_total", {"model": m, "prompt_type": p}, n)
+                        for (m, p), n in self.missed.items()]
+            samples += [("gauge", "model_estimate_seconds", {"model": m, "prompt_type": p, "compact": str(c).lower()},
+                         self._estimate(m, p, c, 1, now)) for m, p, c in self.estimates]
+        return samples
+
+    def print_stats(self, tag="[MODELS]"):
+        for key, entry in self.stats().items():
+            print(f"{tag} {key}: planned={entry['planned']} compact={entry['compact']} answered={entry['answered']} "
+                  f"missed={entry['missed']} estimate={entry['estimate']:.1f}s")
@@ -0,0 +1,291 @@
+# gemnet_ollama.py - Pooled, streaming Ollama client shared by the router and user portal
+import asyncio
+import json
+import threading
+import time
+from collections import defaultdict
+import requests
+from requests.adapters import HTTPAdapter
+from gemnet_metrics import LatencyHistogram
+
+class JsonWatcher:
+    """Incremental check for the end of the first complete JSON object or array
+
+    Tracks bracket depth outside string literals, so generation can be
+    cancelled at the closing brace instead of waiting for trailing chatter.
+    """
+    def __init__(self, opener="{"):
+        self.opener = opener
+        self.started = False
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+
+    def __call__(self, chunk):
+        for ch in chunk:
+            if not self.started:
+                if ch != self.opener:
+                    continue
+                self.started = True
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == "\\":
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+            elif ch == '"':
+                self.in_string = True
+            elif ch in "{[":
+                self.depth += 1
+            elif ch in "}]":
+                self.depth -= 1
+                if self.depth == 0:
+                    return True
+        return False
+
+class LineWatcher:
+    """Incremental check for a finished line, optionally one starting with prefix"""
+    def __init__(self, prefix=None):
+        self.prefix = prefix
+        self.buffer = ""
+
+    def __call__(self, chunk):
+        self.buffer += chunk
+        *lines, self.buffer = self.buffer.split("\n")
+        for line in lines:
+            line = line.strip()
+            if line and (self.prefix is None or line.startswith(self.prefix)):
+                return True
+        return False
+
+def ollama_call(model, prompt, **options):
+    """A generate() call for a step generator to yield, see OllamaClient.run_steps"""
+    return model, prompt, options
+
+class OllamaClient:
+    """Calls /api/generate over a pooled keep-alive session with streaming
+
+    keep_alive is passed to Ollama so models stay resident between calls.
+    concurrency maps model name to the number of calls allowed in flight at
+    once (default_concurrency for unlisted models), so gemma:7b and gemma:2b
+    do not compete for Jetson memory. Latency is recorded per (model,
+    prompt_type) in histograms available from stats().
+
+    Every call also has a coroutine form (agenerate, awarm_up) for nodes
+    running on a gemnet_runtime event loop. Code that needs the model
+    is written once as a step generator that yields ollama_call(...) and
+    gets the reply back; run_steps drives it on the calling thread and
+    arun_steps on the loop.
+    """
+    def __init__(self, url="http://localhost:11434/api/generate", keep_alive="30m", concurrency=None,
+                 default_concurrency=1, pool_size=4):
+        self.url = url
+        self.keep_alive = keep_alive
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self.concurrency = dict(concurrency or {})
+        self.default_concurrency = default_concurrency
+        self.slots = {}
+        self.slots_lock = threading.Lock()
+
+        self.stats_lock = threading.Lock()
+        self.latency = defaultdict(LatencyHistogram)  # (model, prompt_type) -> total seconds
+        self.first_token = defaultdict(LatencyHistogram)  # (model, prompt_type) -> ttft seconds
+        self.errors = defaultdict(int)
+
+    def _slot(self, model):
+        with self.slots_lock:
+            if model not in self.slots:
+                self.slots[model] = threading.BoundedSemaphore(self.concurrency.get(model, self.default_concurrency))
+            return self.slots[model]
+
+    def warm_up(self, models):
+        """Load models into memory ahead of the first real request"""
+        for model in models:
+            start_time = time.time()
+            try:
+                # A generate call without a prompt just loads the model
+                response = self.session.post(self.url, json={"model": model, "keep_alive": self.keep_alive}, timeout=300)
+                response.raise_for_status()
+                print(f"[OLLAMA] Warmed up {model} in {time.time() - start_time:.1f}s")
+            except requests.exceptions.RequestException as e:
+                print(f"[OLLAMA] Warm-up of {model} failed: {type(e).__name__}: {e}")
+
+    def warm_up_async(self, models):
+        """Warm up in a background thread so startup is not held up"""
+        thread = threading.Thread(target=self.warm_up, args=(list(models),), name="ollama-warmup", daemon=True)
+        thread.start()
+        return thread
+
+    def generate(self, model, prompt, temperature=0.1, timeout=180, stop_when=None, deadline=None, prompt_type="generate"):
+        """Stream a completion, closing the connection once stop_when(chunk) is true
+
+        Closing the stream makes Ollama abort the generation. deadline is an
+        absolute time.time() by which the answer is needed; the effective
+        timeout is whichever of timeout and deadline comes first, and it
+        includes time spent waiting for the model's concurrency slot.
+        Raises requests.exceptions.Timeout when it is exceeded.
+        """
+        start_time = time.time()
+        end = start_time + timeout
+        if deadline is not None:
+            end = min(end, deadline)
+
+        if end <= start_time:
+            self._record_error(model, prompt_type)
+            raise requests.exceptions.Timeout("Deadline already passed")
+
+        slot = self._slot(model)
+        if not slot.acquire(timeout=max(end - time.time(), 0)):
+            self._record_error(model, prompt_type)
+            raise requests.exceptions.Timeout(f"No {model} slot free within {end - start_time:.0f}s")
+        try:
+            reply = self._stream(model, prompt, temperature, start_time, end, stop_when)
+        except Exception:
+            self._record_error(model, prompt_type)
+            raise
+        finally:
+            slot.release()
+
+        with self.stats_lock:
+            self.latency[(model, prompt_type)].observe(reply["elapsed"])
+            self.first_token[(model, prompt_type)].observe(reply["ttft"])
+        return reply
+
+    def _record_error(self, model, prompt_type):
+        with self.stats_lock:
+            self.errors[(model, prompt_type)] += 1
+
+    def _stream(self, model, prompt, temperature, start_time, end, stop_when):
+        text = ""
+        ttft = None
+        tokens = 0
+        stopped_early = False
+        remaining = max(end - time.time(), 0.1)
+
+        response = self.session.post(self.url,
+            json={
+                "model": model,
+                "prompt": prompt,
+                "stream": True,
+                "keep_alive": self.keep_alive,
+                "temperature": temperature
+            },
+            stream=True,
+            timeout=remaining
+        )
+        try:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                chunk = json.loads(line)
+                if chunk.get("error"):
+                    raise RuntimeError(chunk["error"])
+
+                piece = chunk.get("response", "")
+                if piece:
+                    if ttft is None:
+                        ttft = time.time() - start_time
+                    tokens += 1
+                    text += piece
+
+                if chunk.get("done"):
+                    tokens = chunk.get("eval_count", tokens)
+                    break
+                if stop_when and piece and stop_when(piece):
+                    stopped_early = True
+                    break
+                if time.time() > end:
+                    raise requests.exceptions.Timeout(f"Generation exceeded {end - start_time:.0f}s")
+        finally:
+            response.close()
+
+        return {
+            "response": text,
+            "model": model,
+            "ttft": ttft if ttft is not None else time.time() - start_time,
+            "elapsed": time.time() - start_time,
+            "tokens": tokens,
+            "stopped_early": stopped_early
+        }
+
+    def run_steps(self, steps):
+        """Drive a step generator on this thread, returns its result
+
+        Each ollama_call the generator yields is made with generate() and
+        the reply sent back in; an exception from the call is raised inside
+        the generator, so its own try/except handles it as usual.
+        """
+        reply, error = None, None
+        while True:
+            try:
+                model, prompt, options = steps.throw(error) if error else steps.send(reply)
+            except StopIteration as done:
+                return done.value
+            try:
+                reply, error = self.generate(model, prompt, **options), None
+            except Exception as e:
+                reply, error = None, e
+
+    async def arun_steps(self, steps):
+        """run_steps for an event loop, the calls are awaited with agenerate()"""
+        reply, error = None, None
+        while True:
+            try:
+                model, prompt, options = steps.throw(error) if error else steps.send(reply)
+            except StopIteration as done:
+                return done.value
+            try:
+                reply, error = await self.agenerate(model, prompt, **options), None
+            except Exception as e:
+                reply, error = None, e
+
+    async def awarm_up(self, models):
+        """warm_up without blocking the event loop"""
+        await asyncio.to_thread(self.warm_up, models)
+
+    async def agenerate(self, model, prompt, **options):
+        """Coroutine form of generate(), same arguments, reply, limits and statistics
+
+        The pooled generate() call runs on a worker thread, so the event
+        loop keeps going while the model answers, and threaded and async
+        callers share one session and one concurrency limit per model.
+        """
+        return await asyncio.to_thread(self.generate, model, prompt, **options)
+
+    def stats(self):
+        """Latency histograms and error counts keyed by model/prompt_type"""
+        with self.stats_lock:
+            keys = set(self.latency) | set(self.errors)
+            return {
+                f"{model}/{prompt_type}": {
+                    "latency": self.latency[(model, prompt_type)].snapshot(),
+                    "first_token": self.first_token[(model, prompt_type)].snapshot(),
+                    "errors": self.errors[(model, prompt_type)]
+                }
+                for model, prompt_type in sorted(keys)
+            }
+
+    def metric_samples(self):
+        """Collector for gemnet_metrics.Metrics"""
+        with self.stats_lock:
+            samples = [("histogram", "ollama_seconds", {"model": m, "prompt_type": p}, h) for (m, p), h in self.latency.items()]
+            samples += [("histogram", "ollama_first_token_seconds", {"model": m, "prompt_type": p}, h)
+                        for (m, p), h in self.first_token.items()]
+            samples += [("counter", "ollama_errors_total", {"model": m, "prompt_type": p}, n) for (m, p), n in self.errors.items()]
+        return samples
+
+    def print_stats(self, tag="[OLLAMA]"):
+        for key, entry in self.stats().items():
+            latency, ttft = entry["latency"], entry["first_token"]
+            print(f"{tag} {key}: calls={latency['count']} errors={entry['errors']} avg={latency['avg']:.1f}s "
+                  f"p50<={latency['p50']:.1f}s p95<={latency['p95']:.1f}s max={latency['max']:.1f}s "
+                  f"ttft_p50<={ttft['p50']:.1f}s")
+
+    def close(self):
+        self.session.close()
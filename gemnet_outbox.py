@@ -0,0 +1,320 @@
+# gemnet_outbox.py - Durable outbound send queue with mesh ACKs, retries and airtime pacing
+import hashlib
+import heapq
+import random
+import sqlite3
+import threading
+import time
+from gemnet_metrics import LatencyHistogram
+
+TEXT_PORT = 1  # Meshtastic TEXT_MESSAGE_APP
+BROADCAST = "^all"
+
+# Send classes, lower goes first
+URGENT = 0
+NORMAL = 1
+BULK = 2
+CLASS_NAMES = {URGENT: "urgent", NORMAL: "normal", BULK: "bulk"}
+
+# Delivery latency buckets in seconds (mesh ACKs take seconds to minutes)
+DELIVERY_BUCKETS = (1, 2, 5, 10, 20, 30, 60, 120, 300, 600)
+
+class AirtimeBudget:
+    """Token bucket of transmit seconds, refilled at duty_cycle seconds per second
+
+    Airtime per packet is estimated from the payload size and the preset's
+    effective bitrate (LongFast is roughly 1 kbit/s) plus a fixed preamble and
+    header cost per packet.
+    """
+    def __init__(self, duty_cycle=0.1, burst=10.0, bitrate=1070, overhead=0.12):
+        self.duty_cycle = duty_cycle
+        self.burst = burst
+        self.bitrate = bitrate
+        self.overhead = overhead
+        self.tokens = burst
+        self.updated = time.time()
+        self.used = 0.0
+
+    def airtime(self, size):
+        return self.overhead + (size + 16) * 8 / self.bitrate  # 16 bytes of mesh header
+
+    def wait_time(self, size):
+        """Seconds until a packet of size bytes fits the budget (0 if it fits now)"""
+        self._refill()
+        need = min(self.airtime(size), self.burst)
+        return 0.0 if self.tokens >= need else (need - self.tokens) / self.duty_cycle
+
+    def spend(self, size):
+        self._refill()
+        cost = self.airtime(size)
+        self.tokens -= cost
+        self.used += cost
+
+    def _refill(self):
+        now = time.time()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.duty_cycle)
+        self.updated = now
+
+class Outbox:
+    """Persistent outbound queue shared by the router and both portals
+
+    sendData/sendText mirror the meshtastic interface calls, so existing send
+    code (including gemnet_wire.send_message) can target the outbox instead of
+    the radio. Sends are stored in SQLite first, then a sender thread
+    transmits them in priority order (URGENT before NORMAL before BULK) as the
+    airtime budget allows. Direct sends request a mesh ACK and are retried
+    with exponential backoff on NAK or timeout, up to max_attempts.
+    Broadcasts cannot be ACKed by a single node, so they count as delivered
+    once transmitted; an identical broadcast still waiting is coalesced
+    instead of queued twice. Pending sends survive a restart, on_result
+    callbacks do not.
+    """
+    def __init__(self, path="outbox.db", duty_cycle=0.1, burst=10.0, bitrate=1070, ack_timeout=45,
+                 max_attempts=4, backoff=10, max_backoff=300):
+        self.budget = AirtimeBudget(duty_cycle, burst, bitrate)
+        self.ack_timeout = ack_timeout
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.interface = None
+
+        self.items = {}  # id -> item dict, for sends not yet delivered or failed
+        self.ready = []  # heap of (send class, created, id)
+        self.delayed = []  # heap of (next_try, id) for retries waiting out their backoff
+        self.inflight = {}  # item id -> time sent, for direct sends awaiting an ACK
+        self.coalesce = {}  # broadcast key -> item id
+        self.callbacks = {}  # item id -> on_result(item, delivered)
+        self.cond = threading.Condition()
+        self.running = False
+        self.thread = None
+
+        self.sent = 0
+        self.delivered = 0
+        self.failed = 0
+        self.retries = 0
+        self.coalesced = 0
+        self.delivery = {name: LatencyHistogram(DELIVERY_BUCKETS) for name in CLASS_NAMES.values()}
+
+        self.db = None
+        self.next_id = 1
+        if path:
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("""CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY, dest TEXT, port INTEGER, payload BLOB, send_class INTEGER,
+                created REAL, attempts INTEGER, key TEXT)""")
+            self.db.commit()
+            self.load()
+
+    def load(self):
+        """Requeue sends left over from the last run"""
+        rows = self.db.execute("SELECT id, dest, port, payload, send_class, created, attempts, key FROM outbox").fetchall()
+        for item_id, dest, port, payload, send_class, created, attempts, key in rows:
+            item = {"id": item_id, "dest": dest, "port": port, "payload": bytes(payload), "send_class": send_class,
+                    "created": created, "attempts": attempts, "key": key}
+            self.items[item_id] = item
+            heapq.heappush(self.ready, (send_class, created, item_id))
+            if key:
+                self.coalesce[key] = item_id
+        row = self.db.execute("SELECT MAX(id) FROM outbox").fetchone()
+        self.next_id = (row[0] or 0) + 1
+        if rows:
+            print(f"[OUTBOX] Requeued {len(rows)} pending send(s)")
+
+    def start(self, interface):
+        """Begin transmitting through a connected meshtastic interface"""
+        self.interface = interface
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name="outbox", daemon=True)
+        self.thread.start()
+
+    def sendData(self, data, destinationId=BROADCAST, portNum=256, priority=NORMAL, on_result=None,
+                 coalesce_key=None, **kwargs):
+        """Queue a data packet, returns the outbox id
+
+        coalesce_key identifies a broadcast by content when the payload
+        itself differs between copies (binary frames carry a fresh message id).
+        """
+        return self.enqueue(bytes(data), destinationId, portNum, priority, on_result, coalesce_key)
+
+    def sendText(self, text, destinationId=BROADCAST, priority=NORMAL, on_result=None, **kwargs):
+        """Queue a text message, returns the outbox id"""
+        return self.enqueue(text.encode(), destinationId, TEXT_PORT, priority, on_result)
+
+    def enqueue(self, payload, dest, port, send_class=NORMAL, on_result=None, coalesce_key=None):
+        key = None
+        if dest == BROADCAST:
+            key = coalesce_key or hashlib.sha1(port.to_bytes(2, "big") + payload).hexdigest()
+        with self.cond:
+            if key and key in self.coalesce:
+                self.coalesced += 1
+                return self.coalesce[key]
+
+            item_id = self.next_id
+            self.next_id += 1
+            item = {"id": item_id, "dest": dest, "port": port, "payload": payload, "send_class": send_class,
+                    "created": time.time(), "attempts": 0, "key": key}
+            if self.db:
+                self.db.execute("INSERT INTO outbox VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                (item_id, dest, port, payload, send_class, item["created"], 0, key))
+                self.db.commit()
+            self.items[item_id] = item
+            if key:
+                self.coalesce[key] = item_id
+            if on_result:
+                self.callbacks[item_id] = on_result
+            heapq.heappush(self.ready, (send_class, item["created"], item_id))
+            self.cond.notify()
+            return item_id
+
+    def run(self):
+        """Sender thread: promote due retries, pace by airtime, transmit the most urgent send"""
+        while self.running:
+            with self.cond:
+                now = time.time()
+                while self.delayed and self.delayed[0][0] <= now:
+                    _, item_id = heapq.heappop(self.delayed)
+                    item = self.items.get(item_id)
+                    if item:
+                        heapq.heappush(self.ready, (item["send_class"], item["created"], item_id))
+                self._expire_inflight(now)
+
+                item = None
+                while self.ready and item is None:
+                    item = self.items.get(self.ready[0][2])
+                    if item is None or item["id"] in self.inflight:  # Finished or awaiting ACK
+                        heapq.heappop(self.ready)
+                        item = None
+                if item is None:
+                    wakeups = [self.delayed[0][0]] if self.delayed else []
+                    if self.inflight:
+                        wakeups.append(min(self.inflight.values()) + self.ack_timeout)
+                    self.cond.wait(timeout=max(min(wakeups) - now, 0.05) if wakeups else 1.0)
+                    continue
+
+                wait = self.budget.wait_time(len(item["payload"]))
+                if wait > 0:
+                    self.cond.wait(timeout=wait)
+                    continue
+                heapq.heappop(self.ready)
+                self.budget.spend(len(item["payload"]))
+                item["attempts"] += 1
+                direct = item["dest"] != BROADCAST
+                if direct:
+                    self.inflight[item["id"]] = now  # Before sending, the ACK can beat sendData's return
+
+            self.transmit(item, direct)
+
+    def transmit(self, item, direct):
+        try:
+            self.interface.sendData(item["payload"], destinationId=item["dest"], portNum=item["port"],
+                                    wantAck=direct,
+                                    onResponse=self._ack_handler(item["id"]) if direct else None,
+                                    onResponseAckPermitted=direct)
+        except Exception as e:
+            print(f"[OUTBOX] Send #{item['id']} failed: {type(e).__name__}: {e}")
+            with self.cond:
+                self.inflight.pop(item["id"], None)
+                self._retry(item)
+            return
+
+        with self.cond:
+            self.sent += 1
+            if not direct:
+                self._finish(item, True)
+                return
+            if self.db and item["id"] in self.items:
+                self.db.execute("UPDATE outbox SET attempts = ? WHERE id = ?", (item["attempts"], item["id"]))
+                self.db.commit()
+
+    def _ack_handler(self, item_id):
+        def on_response(packet):
+            routing = packet.get("decoded", {}).get("routing", {})
+            reason = routing.get("errorReason", "NONE")
+            with self.cond:
+                item = self.items.get(item_id)
+                if not item or self.inflight.pop(item_id, None) is None:
+                    return  # Already timed out and requeued
+                if reason == "NONE":
+                    self._finish(item, True)
+                else:
+                    print(f"[OUTBOX] #{item_id} to {item['dest']} NAK {reason}")
+                    self._retry(item)
+                self.cond.notify()
+        return on_response
+
+    def _expire_inflight(self, now):
+        for item_id, sent_at in list(self.inflight.items()):
+            item = self.items.get(item_id)
+            if item and now - sent_at > self.ack_timeout:
+                del self.inflight[item_id]
+                print(f"[OUTBOX] #{item_id} to {item['dest']} not ACKed within {self.ack_timeout}s")
+                self._retry(item)
+
+    def _retry(self, item):
+        if item["attempts"] >= self.max_attempts:
+            self._finish(item, False)
+            return
+        self.retries += 1
+        delay = min(self.backoff * 2 ** (item["attempts"] - 1), self.max_backoff) * random.uniform(0.8, 1.2)
+        heapq.heappush(self.delayed, (time.time() + delay, item["id"]))
+
+    def _finish(self, item, delivered):
+        del self.items[item["id"]]
+        if item["key"]:
+            self.coalesce.pop(item["key"], None)
+        if self.db:
+            self.db.execute("DELETE FROM outbox WHERE id = ?", (item["id"],))
+            self.db.commit()
+        if delivered:
+            self.delivered += 1
+            self.delivery[CLASS_NAMES.get(item["send_class"], "normal")].observe(time.time() - item["created"])
+        else:
+            self.failed += 1
+            print(f"[OUTBOX] #{item['id']} to {item['dest']} failed after {item['attempts']} attempt(s)")
+        callback = self.callbacks.pop(item["id"], None)
+        if callback:
+            threading.Thread(target=callback, args=(item, delivered), daemon=True).start()
+
+    def stats(self):
+        with self.cond:
+            return {
+                "pending": len(self.items) - len(self.inflight),
+                "inflight": len(self.inflight),
+                "sent": self.sent,
+                "delivered": self.delivered,
+                "failed": self.failed,
+                "retries": self.retries,
+                "coalesced": self.coalesced,
+                "airtime": self.budget.used,
+                "delivery": {name: hist.snapshot() for name, hist in self.delivery.items() if hist.count}
+            }
+
+    def metric_samples(self):
+        """Collector for gemnet_metrics.Metrics"""
+        stats = self.stats()
+        samples = [("gauge", "outbox_pending", {}, stats["pending"]), ("gauge", "outbox_inflight", {}, stats["inflight"]),
+                   ("counter", "outbox_airtime_seconds_total", {}, stats["airtime"])]
+        samples += [("counter", f"outbox_{name}_total", {}, stats[name])
+                    for name in ("sent", "delivered", "failed", "retries", "coalesced")]
+        samples += [("histogram", "outbox_delivery_seconds", {"class": name}, hist) for name, hist in self.delivery.items()]
+        return samples
+
+    def print_stats(self, tag="[OUTBOX]"):
+        stats = self.stats()
+        print(f"{tag} pending={stats['pending']} inflight={stats['inflight']} sent={stats['sent']} "
+              f"delivered={stats['delivered']} failed={stats['failed']} retries={stats['retries']} "
+              f"coalesced={stats['coalesced']} airtime={stats['airtime']:.1f}s")
+        for name, latency in stats["delivery"].items():
+            print(f"{tag} {name} delivery: n={latency['count']} avg={latency['avg']:.1f}s "
+                  f"p50<={latency['p50']:.0f}s p95<={latency['p95']:.0f}s max={latency['max']:.1f}s")
+
+    def close(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+        if self.thread:
+            self.thread.join(timeout=2)
+        if self.db:
+            self.db.close()
+            self.db = None
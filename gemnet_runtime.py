@@ -0,0 +1,156 @@
+# gemnet_runtime.py - asyncio event loop shared by the router, user portal and aid provider entry points
+import asyncio
+import inspect
+import sys
+import threading
+
+class NodeRuntime:
+    """One event loop that owns a node's state
+
+    Radio packets, console lines, timers and Ollama calls all run as
+    callbacks and tasks on this loop, so node code never runs on two threads
+    at once and needs no locks of its own. Threads are left only where a
+    library blocks: the meshtastic reader and the console reader just hand
+    their input over with call_soon_threadsafe, and the outbox keeps its
+    sender thread for the radio. Its delivery callbacks come back through
+    threadsafe().
+
+    run() takes over the calling thread, as the node scripts do. start()
+    runs the loop on a background thread instead, so several nodes can share
+    one process (see benchmarks/bench_mesh.py --runtime async).
+    """
+    def __init__(self, name="node"):
+        self.name = name
+        self.loop = None
+        self.stopping = None
+        self.tasks = set()
+        self.receivers = []  # Strong references: pubsub only keeps weak ones to its listeners
+        self.lines = None
+        self.reader = None
+        self.thread = None
+
+    def run(self, main):
+        """Run the coroutine main on a new loop in this thread until it returns or Ctrl-C"""
+        try:
+            asyncio.run(self._serve(main))
+        except KeyboardInterrupt:
+            pass
+
+    def start(self):
+        """Run the loop on a background thread until stop(), returns once it is up"""
+        ready = threading.Event()
+        self.thread = threading.Thread(target=lambda: asyncio.run(self._serve(None, ready)),
+                                       name=f"{self.name}-loop", daemon=True)
+        self.thread.start()
+        ready.wait()
+
+    def stop(self):
+        """End a loop started with start() (or the wait in a main coroutine) from any thread"""
+        if self.loop and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.stopping.set)
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join(timeout=5)
+
+    async def _serve(self, main, ready=None):
+        self.loop = asyncio.get_running_loop()
+        self.stopping = asyncio.Event()
+        if ready:
+            ready.set()
+        try:
+            await (main if main is not None else self.stopping.wait())
+        finally:
+            for task in list(self.tasks):
+                task.cancel()
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+
+    async def wait(self):
+        """Sleep until stop() is called"""
+        await self.stopping.wait()
+
+    def spawn(self, coro, name=None):
+        """Run a coroutine as a task of this node, printing it if it fails"""
+        task = self.loop.create_task(coro, name=name)
+        self.tasks.add(task)
+        task.add_done_callback(self._finished)
+        return task
+
+    def _finished(self, task):
+        self.tasks.discard(task)
+        if not task.cancelled() and task.exception():
+            error = task.exception()
+            print(f"[RUNTIME] {task.get_name()} failed: {type(error).__name__}: {error}")
+
+    def every(self, interval, fn, delay=None, name=None):
+        """Call fn (a function or coroutine function) every interval seconds, first after delay"""
+        async def repeat():
+            await asyncio.sleep(interval if delay is None else delay)
+            while True:
+                try:
+                    result = fn()
+                    if inspect.isawaitable(result):
+                        await result
+                except Exception as e:
+                    print(f"[RUNTIME] {name or fn.__name__} failed: {type(e).__name__}: {e}")
+                await asyncio.sleep(interval)
+        return self.spawn(repeat(), name=name or fn.__name__)
+
+    def bridge(self, handler):
+        """Receive callback for transport.subscribe that runs handler(packet, interface) on the loop
+
+        The radio's thread only queues the call, in arrival order. A handler
+        that returns a coroutine has it run as a task, so a slow reply (a
+        translation, say) does not hold up the packets behind it.
+        """
+        def receive(packet, interface):
+            self.call_soon(self._handle, handler, packet, interface)
+        self.receivers.append(receive)
+        return receive
+
+    def _handle(self, handler, packet, interface):
+        try:
+            result = handler(packet, interface)
+        except Exception as e:
+            print(f"[RUNTIME] receive handler failed: {type(e).__name__}: {e}")
+            return
+        if inspect.isawaitable(result):
+            self.spawn(result, name="receive")
+
+    def threadsafe(self, fn):
+        """Wrap a callback made from another thread (outbox results) so fn runs on the loop"""
+        def callback(*args, **kwargs):
+            self.call_soon(lambda: fn(*args, **kwargs))
+        return callback
+
+    def call_soon(self, fn, *args):
+        """Schedule fn(*args) on the loop from any thread, dropped once the loop has closed"""
+        try:
+            self.loop.call_soon_threadsafe(fn, *args)
+        except RuntimeError:
+            pass  # Shutting down
+
+    def submit(self, fn, *args):
+        """Call fn(*args) on the loop from another thread and wait for its result"""
+        async def call():
+            result = fn(*args)
+            return await result if inspect.isawaitable(result) else result
+        return asyncio.run_coroutine_threadsafe(call(), self.loop).result()
+
+    async def console(self, prompt="> "):
+        """Next line typed at the console, None at end of input
+
+        A single daemon thread reads stdin for the node's lifetime (there is
+        no portable non-blocking console read, Windows included), so output
+        printed by packets and tasks meanwhile is never interleaved with a
+        half-read command.
+        """
+        if self.lines is None:
+            self.lines = asyncio.Queue()
+            self.reader = threading.Thread(target=self._read_console, name=f"{self.name}-console", daemon=True)
+            self.reader.start()
+        print(prompt, end="", flush=True)
+        return await self.lines.get()
+
+    def _read_console(self):
+        for line in sys.stdin:
+            self.call_soon(self.lines.put_nowait, line.rstrip("\n"))
+        self.call_soon(self.lines.put_nowait, None)
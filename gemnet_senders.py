@@ -0,0 +1,249 @@
+# gemnet_senders.py - Per-sender conversation context and rate limiting for the router
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from gemnet_cache import normalize_text
+from gemnet_classifier import PRIORITY_URGENCY, TYPE_BASE_PRIORITY, classify_rules
+from gemnet_incidents import same_place
+from gemnet_matching import locations
+
+# Words that mark a short message as news about the sender's last report rather than a new one
+FOLLOWUP_CUES = re.compile(r"\b(still|more|again|another|also|update|worse|same|hurry)\b", re.IGNORECASE)
+
+def merge_summary(previous, update, limit=60):
+    """Compact running summary: the newest update kept whole, the older text trimmed to fit"""
+    update = " ".join(update.split())
+    if len(update) >= limit - 4 or not previous:
+        return update[:limit]
+    room = limit - len(update) - 2
+    previous = previous if len(previous) <= room else previous[:max(room - 3, 0)] + "..."
+    return f"{previous}; {update}"
+
+class SenderTable:
+    """Bounded state per sender: recent routes for follow-ups, a token bucket, and held messages
+
+    Entries are kept least recently heard first and evicted beyond
+    max_senders or after ttl seconds of silence, so the table stays small
+    however many nodes pass through; one still holding messages is skipped
+    until due() has handed them back. Each keeps the last history routes
+    (ref, type, analysis, compact summary) made for that sender.
+
+    A message of at most followup_words words within window seconds of the
+    sender's last route is a follow-up when the rules see the same category
+    in it, or see nothing in it but it carries a follow-up cue, and it names
+    no place other than the one already reported. It is folded into that
+    route by the rules alone, with the priority only ever raised (by an
+    urgency cue in the new text). A message the rules put in another
+    category is always a new report, whatever words it uses.
+
+    Each sender also has a token bucket of burst messages refilled at rate
+    per second. A message that finds it empty is held; due() hands back the
+    held messages of a sender once a token is available again, so the part
+    of a burst related() to the sender's last route reaches the aid
+    provider as one update instead of one route per packet.
+    """
+    def __init__(self, max_senders=500, ttl=3600, history=4, window=900, followup_words=8, rate=1 / 20,
+                 burst=4):
+        self.max_senders = max_senders
+        self.ttl = ttl
+        self.history = history
+        self.window = window
+        self.followup_words = followup_words
+        self.rate = rate
+        self.burst = burst
+        self.entries = OrderedDict()  # sender -> entry dict, least recently heard first
+        self.lock = threading.Lock()
+        self.admitted = 0
+        self.limited = 0
+        self.followups = 0
+        self.folded = 0
+        self.evicted = 0
+
+    def _entry(self, sender, now):
+        entry = self.entries.get(sender)
+        if entry is None or now - entry['last_seen'] > self.ttl:
+            entry = {"routes": deque(maxlen=self.history), "tokens": float(self.burst), "updated": now,
+                     "last_seen": now, "held": [], "messages": 0, "limited": 0}
+            self.entries[sender] = entry
+        self.entries.move_to_end(sender)
+        entry['last_seen'] = now
+        self._expire(now)
+        return entry
+
+    def _expire(self, now):
+        # Never the last entry, the sender _entry() is handing out; with only held ones
+        # before it the table stays over max_senders until due() releases them
+        for sender, entry in list(self.entries.items())[:-1]:
+            if now - entry['last_seen'] <= self.ttl and len(self.entries) <= self.max_senders:
+                break
+            if entry['held']:
+                continue  # Still owed a due() round, the senders heard after it go first
+            del self.entries[sender]
+            self.evicted += 1
+
+    def _refill(self, entry, now):
+        entry['tokens'] = min(self.burst, entry['tokens'] + (now - entry['updated']) * self.rate)
+        entry['updated'] = now
+
+    def admit(self, sender, msg_type, content, trace=None, claim=None):
+        """Spend a token for a message, True if it may be processed now, else it is held for due()
+
+        claim is the portal's analysis sent with the message, kept with it
+        while held.
+        """
+        now = time.time()
+        with self.lock:
+            entry = self._entry(sender, now)
+            entry['messages'] += 1
+            self._refill(entry, now)
+            if entry['tokens'] >= 1 and not entry['held']:
+                entry['tokens'] -= 1
+                self.admitted += 1
+                return True
+            entry['held'].append((msg_type, content, trace, claim))
+            entry['limited'] += 1
+            self.limited += 1
+            return False
+
+    def due(self, force=()):
+        """(sender, held messages, last route or None) for senders whose bucket has refilled, or in force"""
+        now = time.time()
+        ready = []
+        with self.lock:
+            for sender, entry in self.entries.items():
+                if not entry['held']:
+                    continue
+                self._refill(entry, now)
+                if entry['tokens'] >= 1 or sender in force:
+                    entry['tokens'] = max(entry['tokens'] - 1, 0.0)
+                    ready.append((sender, entry['held'], self._last_route(entry, now)))
+                    entry['held'] = []
+                    self.folded += 1
+        return ready
+
+    def last_route(self, sender):
+        """The sender's most recent route within window, or None"""
+        with self.lock:
+            entry = self.entries.get(sender)
+            return entry and self._last_route(entry, time.time())
+
+    def _last_route(self, entry, now):
+        route = entry['routes'][-1] if entry['routes'] else None
+        return dict(route) if route and now - route['time'] <= self.window else None
+
+    def remember(self, sender, ref, msg_type, content, analysis):
+        """Record (or update, for a ref already known) the route made for a sender's message"""
+        now = time.time()
+        with self.lock:
+            entry = self._entry(sender, now)
+            route = next((route for route in entry['routes'] if route['ref'] == ref), None)
+            if route is None:
+                entry['routes'].append({"ref": ref, "msg_type": msg_type, "analysis": dict(analysis),
+                                        "summary": analysis['summary'][:60] or content[:60], "time": now,
+                                        "places": locations(normalize_text(content)), "updates": 0})
+                return
+            if not route['updates']:  # A refined summary is better than the provisional one
+                route['summary'] = analysis['summary'][:60] or route['summary']
+            route['analysis'] = dict(analysis, summary=route['summary'])
+            route['time'] = now
+
+    def spend(self, sender):
+        """Take a token for something other than a new message (a repeat notice), False if none is left"""
+        now = time.time()
+        with self.lock:
+            entry = self._entry(sender, now)
+            self._refill(entry, now)
+            if entry['tokens'] < 1:
+                return False
+            entry['tokens'] -= 1
+            return True
+
+    def route(self, sender, ref):
+        """The sender's route under ref, or None"""
+        with self.lock:
+            route = self._route(sender, ref)
+            return route and dict(route)
+
+    def _route(self, sender, ref):
+        entry = self.entries.get(sender)
+        return next((route for route in entry['routes'] if route['ref'] == ref), None) if entry else None
+
+    def refine(self, sender, ref, analysis):
+        """A later analysis of a route with follow-ups folded in, keeping their summary and raised priority"""
+        with self.lock:
+            route = self._route(sender, ref)
+            if route is None or not route['updates']:
+                return analysis
+            priority = min(analysis['priority'], route['analysis']['priority'])
+            return dict(analysis, priority=priority, urgency=PRIORITY_URGENCY[priority], summary=route['summary'])
+
+    def followup(self, sender, msg_type, content):
+        """(last route, updated analysis) when content is a short follow-up to that route, else None"""
+        if len(content.split()) > self.followup_words:
+            return None
+        route = self.last_route(sender)
+        if route is None:
+            return None
+        rules = classify_rules(content, route['msg_type'])
+        if not self.related(route, msg_type, content, rules):
+            return None
+        with self.lock:
+            self.followups += 1
+        return route, self.fold(sender, route, [content], rules)
+
+    def related(self, route, msg_type, content, rules):
+        """True when content is news about route: same category (or none, with a cue), type and place"""
+        if msg_type not in (route['msg_type'], "GENERAL"):
+            return False
+        cued = rules['category'] == "OTHER" and FOLLOWUP_CUES.search(content)
+        if rules['category'] != route['analysis']['category'] and not cued:
+            return False  # Fire or bleeding after a water request is a new emergency, not an update
+        # Same words about another house or shelter is a new report
+        return same_place(route['places'], locations(normalize_text(content)))
+
+    def fold(self, sender, route, contents, rules=None):
+        """The route's analysis updated with further messages: same category, priority never lowered"""
+        contents = list(dict.fromkeys(contents))
+        rules = rules or classify_rules(" ".join(contents), route['msg_type'])
+        previous = route['analysis']
+        raised = rules['priority'] < TYPE_BASE_PRIORITY.get(route['msg_type'], 3)  # An urgency cue, not just the type
+        priority = min(previous['priority'], rules['priority']) if raised else previous['priority']
+        summary = merge_summary(route['summary'], " / ".join(contents))
+        with self.lock:
+            entry = self.entries.get(sender)
+            for known in entry['routes'] if entry else ():
+                if known['ref'] == route['ref']:
+                    known['summary'] = summary
+                    known['updates'] += 1
+        return dict(previous, priority=priority, urgency=PRIORITY_URGENCY[priority], summary=summary)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "senders": len(self.entries),
+                "held": sum(len(entry['held']) for entry in self.entries.values()),
+                "admitted": self.admitted,
+                "limited": self.limited,
+                "followups": self.followups,
+                "folded": self.folded,
+                "evicted": self.evicted
+            }
+
+    def metric_samples(self):
+        """Collector for gemnet_metrics.Metrics"""
+        stats = self.stats()
+        return [
+            ("gauge", "senders_tracked", {}, stats['senders']),
+            ("gauge", "sender_messages_held", {}, stats['held']),
+            ("counter", "sender_rate_limited_total", {}, stats['limited']),
+            ("counter", "sender_followups_total", {}, stats['followups']),
+            ("counter", "sender_bursts_folded_total", {}, stats['folded']),
+            ("counter", "senders_evicted_total", {}, stats['evicted'])
+        ]
+
+    def print_stats(self, tag="[SENDERS]"):
+        stats = self.stats()
+        print(f"{tag} tracked={stats['senders']} admitted={stats['admitted']} limited={stats['limited']} "
+              f"held={stats['held']} bursts_folded={stats['folded']} followups={stats['followups']} "
+              f"evicted={stats['evicted']}")
@@ -0,0 +1,278 @@
+# gemnet_store.py - Persistent, indexed message store and triage queue for the aid provider
+import heapq
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+FIELDS = ("id", "sender", "type", "category", "priority", "urgency", "state", "content", "summary", "ref", "created", "time",
+          "repeats", "trace", "reporters")
+PRIORITY = re.compile(r"P(\d)")
+STATES = ("open", "acked", "resolved")
+URGENCY_RANK = {"IMMEDIATE": 0, "HIGH": 1, "MEDIUM": 2, "LOW": 3}
+UNKNOWN_PRIORITY = 9  # Unrouted messages sort after every router priority
+
+def type_priority(msg_type):
+    """Priority digit from a router label like 🚨URGENT-P2, or None for unrouted messages"""
+    match = PRIORITY.search(msg_type or "")
+    return int(match.group(1)) if match else None
+
+class MessageStore:
+    """Messages in SQLite (WAL mode) with a bounded in-memory window of recent ones
+
+    Lookups by id hit the hot window first and otherwise the primary key, so
+    they stay O(1)/O(log n) regardless of history size. sender, category,
+    priority, created, ref and triage state are indexed for the listing
+    queries. On restart only the id counter and the last hot_size messages
+    are read back.
+    """
+    def __init__(self, path="aid_messages.db", hot_size=1000):
+        self.hot_size = hot_size
+        self.hot = OrderedDict()  # id -> message dict, most recently used last
+        self.lock = threading.Lock()
+
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")  # Durable across process crashes, fsync at checkpoints
+        self.db.execute("""CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY, sender TEXT, type TEXT, category TEXT, priority INTEGER,
+            urgency TEXT, state TEXT DEFAULT 'open', content TEXT, summary TEXT, ref TEXT, created REAL, time TEXT,
+            repeats INTEGER DEFAULT 0, trace TEXT, reporters INTEGER DEFAULT 1)""")
+        # Other reporters of an incident routed as this message, answered along with its sender
+        self.db.execute("""CREATE TABLE IF NOT EXISTS incident_members (
+            message_id INTEGER, sender TEXT, trace TEXT, created REAL, PRIMARY KEY (message_id, sender))""")
+        # Databases created before triage states, duplicate counts, trace ids and incidents existed
+        columns = {row["name"] for row in self.db.execute("PRAGMA table_info(messages)")}
+        for column, definition in (("urgency", "TEXT"), ("state", "TEXT DEFAULT 'open'"), ("repeats", "INTEGER DEFAULT 0"),
+                                   ("trace", "TEXT"), ("reporters", "INTEGER DEFAULT 1")):
+            if column not in columns:
+                self.db.execute(f"ALTER TABLE messages ADD COLUMN {column} {definition}")
+        for column in ("sender", "category", "priority", "created", "ref", "state"):
+            self.db.execute(f"CREATE INDEX IF NOT EXISTS messages_{column} ON messages ({column})")
+        self.db.commit()
+        self.recover()
+
+    def recover(self):
+        """Warm the hot window from the newest rows"""
+        start = time.time()
+        rows = self.db.execute("SELECT * FROM messages ORDER BY id DESC LIMIT ?", (self.hot_size,)).fetchall()
+        for row in reversed(rows):
+            self.hot[row["id"]] = dict(row)
+        total = self.count()
+        if total:
+            print(f"[STORE] Recovered {total} message(s), {len(rows)} in memory, in {time.time() - start:.2f}s")
+
+    def _remember(self, msg):
+        self.hot[msg["id"]] = msg
+        self.hot.move_to_end(msg["id"])
+        while len(self.hot) > self.hot_size:
+            self.hot.popitem(last=False)
+
+    def add(self, msg_type, category, sender, content, summary="", ref=None, urgency=None, trace=None):
+        """Insert an open message and return it with its new id"""
+        now = time.time()
+        msg = {
+            "sender": sender,
+            "type": msg_type,
+            "category": category,
+            "priority": type_priority(msg_type),
+            "urgency": urgency,
+            "state": "open",
+            "content": content,
+            "summary": summary,
+            "ref": ref,
+            "created": now,
+            "time": datetime.fromtimestamp(now).strftime("%H:%M:%S"),
+            "repeats": 0,
+            "trace": trace,
+            "reporters": 1
+        }
+        with self.lock:
+            cursor = self.db.execute(f"""INSERT INTO messages ({', '.join(FIELDS[1:])})
+                VALUES ({', '.join('?' * len(FIELDS[1:]))})""", tuple(msg[f] for f in FIELDS[1:]))
+            self.db.commit()
+            msg["id"] = cursor.lastrowid
+            self._remember(msg)
+        return msg
+
+    def get(self, msg_id):
+        with self.lock:
+            msg = self.hot.get(msg_id)
+            if msg is None:
+                row = self.db.execute("SELECT * FROM messages WHERE id = ?", (msg_id,)).fetchone()
+                if row is None:
+                    return None
+                msg = dict(row)
+            self._remember(msg)
+            return msg
+
+    def by_ref(self, ref):
+        """Newest message routed under ref (router refs restart with the router)"""
+        with self.lock:
+            row = self.db.execute("SELECT id FROM messages WHERE ref = ? ORDER BY id DESC LIMIT 1", (ref,)).fetchone()
+        return self.get(row["id"]) if row else None
+
+    def add_members(self, msg_id, members):
+        """Record (sender, trace id) reporters of an incident, returns those not already recorded"""
+        now = time.time()
+        added = []
+        with self.lock:
+            for sender, trace in members:
+                cursor = self.db.execute("INSERT OR IGNORE INTO incident_members VALUES (?, ?, ?, ?)",
+                                         (msg_id, sender, trace, now))
+                if cursor.rowcount:
+                    added.append((sender, trace))
+            self.db.commit()
+        return added
+
+    def members(self, msg_id):
+        """(sender, trace id) of every other reporter of the incident, in arrival order"""
+        with self.lock:
+            rows = self.db.execute("SELECT sender, trace FROM incident_members WHERE message_id = ? ORDER BY created",
+                                   (msg_id,)).fetchall()
+        return [(row["sender"], row["trace"]) for row in rows]
+
+    def update(self, msg_id, **fields):
+        """Change fields of a stored message, keeps priority in step with type"""
+        if "type" in fields:
+            fields["priority"] = type_priority(fields["type"])
+        columns = [f for f in fields if f in FIELDS and f != "id"]
+        if not columns:
+            return
+        with self.lock:
+            self.db.execute(f"UPDATE messages SET {', '.join(c + ' = ?' for c in columns)} WHERE id = ?",
+                            [fields[c] for c in columns] + [msg_id])
+            self.db.commit()
+            if msg_id in self.hot:
+                self.hot[msg_id].update({c: fields[c] for c in columns})
+
+    def recent(self, limit=10, sender=None, category=None, max_priority=None, since=None):
+        """Newest messages matching the filters, returned oldest first"""
+        clauses, args = [], []
+        if sender:
+            clauses.append("sender = ?")
+            args.append(sender)
+        if category:
+            clauses.append("category = ?")
+            args.append(category)
+        if max_priority is not None:
+            clauses.append("priority <= ?")
+            args.append(max_priority)
+        if since is not None:
+            clauses.append("created >= ?")
+            args.append(since)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        with self.lock:
+            rows = self.db.execute(f"SELECT * FROM messages {where} ORDER BY id DESC LIMIT ?", args + [limit]).fetchall()
+        return [dict(row) for row in reversed(rows)]
+
+    def query(self, category=None, sender=None, state=None, page=1, page_size=10):
+        """One page of matching messages, newest first, and the total number of matches"""
+        clauses, args = [], []
+        for column, value in (("category", category), ("sender", sender), ("state", state)):
+            if value:
+                clauses.append(f"{column} = ?")
+                args.append(value)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        with self.lock:
+            total = self.db.execute(f"SELECT COUNT(*) FROM messages {where}", args).fetchone()[0]
+            rows = self.db.execute(f"SELECT * FROM messages {where} ORDER BY id DESC LIMIT ? OFFSET ?",
+                                   args + [page_size, (max(page, 1) - 1) * page_size]).fetchall()
+        return [dict(row) for row in rows], total
+
+    def open_messages(self):
+        """Triage keys of every open message, for rebuilding the queue on start"""
+        with self.lock:
+            rows = self.db.execute("SELECT id, priority, urgency, created FROM messages WHERE state = 'open'").fetchall()
+        return [dict(row) for row in rows]
+
+    def unresolved(self, since=None):
+        """Open and acked messages, oldest first, for rebuilding indexes on start"""
+        where, args = "WHERE state != 'resolved'", []
+        if since is not None:
+            where += " AND created >= ?"
+            args.append(since)
+        with self.lock:
+            rows = self.db.execute(f"SELECT * FROM messages {where} ORDER BY id", args).fetchall()
+        return [dict(row) for row in rows]
+
+    def state_counts(self):
+        with self.lock:
+            rows = self.db.execute("SELECT state, COUNT(*) AS total FROM messages GROUP BY state").fetchall()
+        return {row["state"]: row["total"] for row in rows}
+
+    def senders(self):
+        """(sender, message count, last message) per sender, most recently active first"""
+        with self.lock:
+            rows = self.db.execute("""SELECT m.sender, s.total, m.content FROM
+                (SELECT sender, COUNT(*) AS total, MAX(id) AS last_id FROM messages GROUP BY sender) s
+                JOIN messages m ON m.id = s.last_id ORDER BY s.last_id DESC""").fetchall()
+        return [(row["sender"], row["total"], row["content"]) for row in rows]
+
+    def count(self):
+        return self.db.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+
+    def close(self):
+        if self.db:
+            self.db.commit()
+            self.db.close()
+            self.db = None
+
+class TriageQueue:
+    """Open messages ordered by priority, then urgency, then age (oldest first)
+
+    A binary heap with lazy deletion: answering or re-prioritising a message
+    only updates the live key in self.keys, and stale heap entries are
+    skipped when they reach the top. peek() is O(1) amortised, push and
+    discard O(log n).
+    """
+    def __init__(self, messages=()):
+        self.keys = {}  # id -> current heap key
+        self.heap = []
+        self.lock = threading.Lock()
+        for msg in messages:
+            self.keys[msg["id"]] = self.key(msg)
+        self.heap = list(self.keys.values())
+        heapq.heapify(self.heap)
+
+    @staticmethod
+    def key(msg):
+        priority = msg.get("priority")
+        return (UNKNOWN_PRIORITY if priority is None else priority,
+                URGENCY_RANK.get(msg.get("urgency"), URGENCY_RANK["MEDIUM"]),
+                msg["created"], msg["id"])
+
+    def push(self, msg):
+        """Add an open message, or re-key it after a correction"""
+        key = self.key(msg)
+        with self.lock:
+            self.keys[msg["id"]] = key
+            heapq.heappush(self.heap, key)
+            if len(self.heap) > 2 * len(self.keys) + 64:  # Too many stale entries, rebuild
+                self.heap = list(self.keys.values())
+                heapq.heapify(self.heap)
+
+    def discard(self, msg_id):
+        with self.lock:
+            self.keys.pop(msg_id, None)
+
+    def peek(self):
+        """Id of the most urgent open message, or None"""
+        with self.lock:
+            while self.heap and self.keys.get(self.heap[0][3]) != self.heap[0]:
+                heapq.heappop(self.heap)
+            return self.heap[0][3] if self.heap else None
+
+    def top(self, count):
+        """Ids of the count most urgent open messages"""
+        with self.lock:
+            return [key[3] for key in heapq.nsmallest(count, self.keys.values())]
+
+    def __contains__(self, msg_id):
+        return msg_id in self.keys
+
+    def __len__(self):
+        return len(self.keys)
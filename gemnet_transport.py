@@ -0,0 +1,241 @@
+# gemnet_transport.py - Radio transports: Meshtastic serial, or an in-process simulated mesh
+import heapq
+import itertools
+import queue
+import random
+import threading
+import time
+from collections import deque
+
+TEXT_PORT = 1  # Meshtastic TEXT_MESSAGE_APP
+BROADCAST = "^all"
+PORT_NAMES = {1: "TEXT_MESSAGE_APP", 256: "PRIVATE_APP"}
+
+class SerialTransport:
+    """A Meshtastic radio on a serial port, the default for every node
+
+    open() returns the meshtastic interface itself, so sends and the outbox
+    work exactly as before. meshtastic and pubsub are only imported here,
+    which lets the nodes run on a SimMesh without them installed.
+    """
+    def __init__(self, port):
+        self.port = port
+
+    def open(self):
+        import meshtastic.serial_interface
+        return meshtastic.serial_interface.SerialInterface(self.port)
+
+    def subscribe(self, callback):
+        """Call callback(packet, interface) for every received packet"""
+        from pubsub import pub
+        pub.subscribe(callback, "meshtastic.receive")
+
+class SimMesh:
+    """In-process stand-in for a LoRa mesh of Meshtastic nodes
+
+    All nodes share one channel: a frame occupies it for its airtime
+    (payload plus 16 header bytes at bitrate, plus a fixed preamble cost) and
+    arrives latency +- jitter seconds after it finishes transmitting. Each
+    frame, and each ACK, is lost with probability loss. Payloads larger than
+    frame_size are rejected like the real interface does, and a node that has
+    used more than duty_cycle of the last window seconds of airtime has its
+    frames dropped, as regional duty-cycle limits do in the firmware.
+    """
+    def __init__(self, latency=1.0, jitter=0.5, loss=0.0, frame_size=233, bitrate=1070, duty_cycle=1.0,
+                 window=3600, overhead=0.12, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.frame_size = frame_size
+        self.bitrate = bitrate
+        self.duty_cycle = duty_cycle
+        self.window = window
+        self.overhead = overhead
+        self.random = random.Random(seed)
+
+        self.nodes = {}  # node id -> SimInterface
+        self.events = []  # heap of (due time, seq, fn)
+        self.seq = itertools.count()
+        self.packet_ids = itertools.count(1)
+        self.channel_free = 0.0
+        self.cond = threading.Condition()
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name="sim-mesh", daemon=True)
+        self.thread.start()
+
+        self.frames = 0
+        self.delivered = 0
+        self.lost = 0
+        self.duty_dropped = 0
+        self.acks = 0
+        self.airtime_used = 0.0
+        self.started = time.time()
+
+    def transport(self, node_id):
+        """Transport for a simulated node, node_id like !a0cc6e10"""
+        return SimTransport(self, node_id)
+
+    def airtime(self, size):
+        return self.overhead + (size + 16) * 8 / self.bitrate
+
+    def schedule(self, due, fn):
+        with self.cond:
+            heapq.heappush(self.events, (due, next(self.seq), fn))
+            self.cond.notify()
+
+    def run(self):
+        while self.running:
+            with self.cond:
+                while self.running and (not self.events or self.events[0][0] > time.time()):
+                    self.cond.wait(timeout=self.events[0][0] - time.time() if self.events else None)
+                if not self.running:
+                    return
+                _, _, fn = heapq.heappop(self.events)
+            fn()
+
+    def transmit(self, sender, payload, port, dest, want_ack, on_response):
+        """Put one frame on the channel, returns its packet id"""
+        if len(payload) > self.frame_size:
+            raise ValueError(f"Data payload too big ({len(payload)} > {self.frame_size} bytes)")
+        packet_id = next(self.packet_ids)
+        airtime = self.airtime(len(payload))
+        now = time.time()
+        with self.cond:
+            self.frames += 1
+            if not sender.spend_airtime(now, airtime):
+                self.duty_dropped += 1
+                return packet_id
+            start = max(now, self.channel_free)
+            self.channel_free = start + airtime
+            self.airtime_used += airtime
+            arrive = self.channel_free + max(self.latency + self.random.uniform(-self.jitter, self.jitter), 0)
+            lost = self.random.random() < self.loss
+            ack_lost = self.random.random() < self.loss
+
+        packet = {
+            "id": packet_id,
+            "from": sender.myInfo.my_node_num,
+            "fromId": sender.node_id,
+            "toId": dest,
+            "decoded": {"portnum": PORT_NAMES.get(port, port), "payload": payload}
+        }
+        if port == TEXT_PORT:
+            packet["decoded"]["text"] = payload.decode(errors="replace")
+        receivers = [node for node_id, node in self.nodes.items()
+                     if node is not sender and (dest == BROADCAST or node_id == dest)]
+
+        if lost or not receivers:
+            with self.cond:
+                self.lost += 1
+            return packet_id
+        for node in receivers:
+            self.schedule(arrive, lambda node=node: self._deliver(node, packet))
+        if want_ack and on_response and dest != BROADCAST and not ack_lost:
+            # The ACK is a short routing packet back from the destination
+            ack_at = arrive + self.airtime(0) + max(self.latency + self.random.uniform(-self.jitter, self.jitter), 0)
+            self.schedule(ack_at, lambda: self._ack(on_response, packet_id, dest))
+        return packet_id
+
+    def _deliver(self, node, packet):
+        with self.cond:
+            self.delivered += 1
+        node.inbox.put(dict(packet, rxTime=int(time.time())))
+
+    def _ack(self, on_response, packet_id, dest):
+        with self.cond:
+            self.acks += 1
+        on_response({"fromId": dest, "decoded": {"portnum": "ROUTING_APP", "requestId": packet_id,
+                                                 "routing": {"errorReason": "NONE"}}})
+
+    def stats(self):
+        with self.cond:
+            elapsed = max(time.time() - self.started, 1e-9)
+            return {
+                "frames": self.frames,
+                "delivered": self.delivered,
+                "lost": self.lost,
+                "duty_dropped": self.duty_dropped,
+                "acks": self.acks,
+                "utilisation": min(self.airtime_used / elapsed, 1.0)
+            }
+
+    def close(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+        for node in list(self.nodes.values()):
+            node.close()
+
+class SimTransport:
+    """Transport for one SimMesh node, same open()/subscribe() as SerialTransport"""
+    def __init__(self, mesh, node_id):
+        self.mesh = mesh
+        self.node_id = node_id
+        self.interface = None
+
+    def open(self):
+        self.interface = SimInterface(self.mesh, self.node_id)
+        self.mesh.nodes[self.node_id] = self.interface
+        return self.interface
+
+    def subscribe(self, callback):
+        self.interface.callback = callback
+
+class SimNodeInfo:
+    def __init__(self, node_num):
+        self.my_node_num = node_num
+
+class SimInterface:
+    """The parts of meshtastic's SerialInterface the nodes and the outbox use
+
+    Received packets are handed to the subscribed callback from a per-node
+    thread, like the meshtastic reader thread, so a slow handler on one node
+    does not hold up the rest of the mesh.
+    """
+    def __init__(self, mesh, node_id):
+        self.mesh = mesh
+        self.node_id = node_id
+        self.myInfo = SimNodeInfo(int(node_id.lstrip("!"), 16))
+        self.callback = None
+        self.closed = False
+        self.airtime_log = deque()  # (time, seconds) sent within the duty-cycle window
+        self.airtime_total = 0.0
+        self.inbox = queue.Queue()
+        self.thread = threading.Thread(target=self.run, name=f"sim-{node_id}", daemon=True)
+        self.thread.start()
+
+    def spend_airtime(self, now, airtime):
+        """Record a transmission, False if it would break the duty cycle (called under the mesh lock)"""
+        while self.airtime_log and now - self.airtime_log[0][0] >= self.mesh.window:
+            self.airtime_total -= self.airtime_log.popleft()[1]
+        if self.airtime_total + airtime > self.mesh.duty_cycle * self.mesh.window:
+            return False
+        self.airtime_log.append((now, airtime))
+        self.airtime_total += airtime
+        return True
+
+    def sendData(self, data, destinationId=BROADCAST, portNum=256, wantAck=False, onResponse=None,
+                 onResponseAckPermitted=False, **kwargs):
+        if self.closed:
+            raise OSError(f"{self.node_id} is closed")
+        packet_id = self.mesh.transmit(self, bytes(data), portNum, destinationId, wantAck, onResponse)
+        return {"id": packet_id}
+
+    def sendText(self, text, destinationId=BROADCAST, wantAck=False, onResponse=None, **kwargs):
+        return self.sendData(text.encode(), destinationId, TEXT_PORT, wantAck, onResponse)
+
+    def run(self):
+        while True:
+            packet = self.inbox.get()
+            if packet is None:
+                return
+            if self.callback:
+                try:
+                    self.callback(packet, self)
+                except Exception as e:
+                    print(f"[SIM] {self.node_id} receive handler failed: {type(e).__name__}: {e}")
+
+    def close(self):
+        self.closed = True
+        self.mesh.nodes.pop(self.node_id, None)
+        self.inbox.put(None)
@@ -1,87 +1,176 @@
 # user_interface.py - Run on laptop connected to !a0cc8628
-import meshtastic.serial_interface
-from pubsub import pub
 import threading
 import time
-import requests
 import json
+from collections import OrderedDict
+from gemnet_cache import TranslationCache
+from gemnet_classifier import TYPE_BASE_PRIORITY, build_prompt, classify_rules, parse_analysis
+from gemnet_dispatch import HEARTBEAT_INTERVAL, RouterDirectory
+from gemnet_langid import detect_language
+from gemnet_metrics import MESH_BUCKETS, Metrics
+from gemnet_models import PRIORITY_DEADLINES, ModelSelector
+from gemnet_ollama import JsonWatcher, LineWatcher, OllamaClient
+from gemnet_outbox import NORMAL, URGENT, Outbox
+from gemnet_runtime import NodeRuntime
+from gemnet_transport import SerialTransport
+from gemnet_wire import (Reassembler, WireEncoder, WireError, add_analysis, add_trace, frame_from_packet, new_trace,
+                        send_message, split_trace)
 
 class UserInterface:
-    def __init__(self, port="COM14"):  # Adjust port as needed
+    def __init__(self, port="COM14", wire_format="binary", metrics_port=9102,
+                 metrics_snapshot="portal_metrics.json", outbox_path="portal_outbox.db",
+                 translation_cache_path="translation_cache.db", transport=None, routers=None,
+                 heartbeat_interval=HEARTBEAT_INTERVAL, preclassify=None,
+                 models=("gemma:7b", "gemma:2b")):  # Adjust port as needed
         self.port = port
+        self.transport = transport or SerialTransport(port)  # Or a gemnet_transport.SimMesh node
         self.interface = None
+        self.wire_format = wire_format  # "binary" frames or legacy "text" for e/r/o messages
+        self.encoder = WireEncoder()
+        self.reassembler = Reassembler()
+        self.outbox = Outbox(path=outbox_path)  # ACKed, retried sends that survive a restart
         self.router_id = "!a0cc6e10"  # Router Jetson with Ollama
+        # More routers are found from their heartbeats, each message goes to the least loaded one
+        self.routers = RouterDirectory(routers or [self.router_id], interval=heartbeat_interval)
+        self.dispatched = {}  # trace id -> message handed to a router, until the router is seen alive after it
+        self.dispatch_lock = threading.Lock()
+        # A heartbeat this long after the ACK shows the router handled the message, and for a router never
+        # heard from, the ACK alone does once this long has passed. Longer than the router's incident_flush
+        # and a rate-limited sender's wait for a token, so a held message is not taken as handled.
+        self.settle_time = 45
         self.ollama_url = "http://localhost:11434/api/generate"  # Replace with Jetson IP
+        # Keep the translation models loaded between messages
+        self.ollama = OllamaClient(self.ollama_url, keep_alive="30m", concurrency={model: 1 for model in models})
+        # gemma:7b translates best, gemma:2b when 7b cannot answer in time or sends are piling up
+        self.models = ModelSelector(models)
+        self.translate_timeout = 120  # Longest a send may spend translating and classifying
         self.user_language = None  # Auto-detected from first message
-    def connect(self):
+        self.translations = TranslationCache(path=translation_cache_path, max_entries=2000)
+        # "rules" or "llm": classify here and send the analysis along, so the router can skip its LLM
+        self.preclassify = preclassify
+        self.runtime = None  # gemnet_runtime loop when started by run(), threads otherwise
+        
+        # Trace id -> send time of recent messages, to time the reply that answers them
+        self.traces = OrderedDict()
+        self.max_traces = 500
+        self.metrics = Metrics("portal")
+        self.metrics.set_buckets("response_seconds", MESH_BUCKETS)
+        self.metrics.collector(self.metric_samples)
+        self.metrics.collector(self.ollama.metric_samples)
+        self.metrics.collector(self.models.metric_samples)
+        self.metrics.collector(self.outbox.metric_samples)
+        self.metrics_port = metrics_port
+        self.metrics_snapshot = metrics_snapshot
+        
+    def connect(self, runtime=None):
+        """Open the radio, on runtime's event loop if given (call from the loop)"""
         print("Connecting to V3...")
-        self.interface = meshtastic.serial_interface.SerialInterface(self.port)
-        pub.subscribe(self.on_receive, "meshtastic.receive")
+        self.runtime = runtime
+        self.interface = self.transport.open()
+        self.outbox.start(self.interface)
+        if self.metrics_port:
+            self.metrics.serve(self.metrics_port)
+        if self.metrics_snapshot:
+            self.metrics.start_snapshots(self.metrics_snapshot)
+        if runtime:
+            runtime.spawn(self.ollama.awarm_up(self.models.models), name="ollama-warmup")
+            runtime.every(5, self.check_routers)
+            self.transport.subscribe(runtime.bridge(self.on_receive))
+        else:
+            self.ollama.warm_up_async(self.models.models)
+            threading.Thread(target=self.watch_routers, name="failover", daemon=True).start()
+            self.transport.subscribe(self.on_receive)
         print("Connected! Type 'help' for commands\n")
         
+    def perform(self, steps):
+        """Run a step generator: as a task when on the event loop, on this thread otherwise"""
+        if self.runtime:
+            self.runtime.spawn(self.ollama.arun_steps(steps))
+        else:
+            self.ollama.run_steps(steps)
+            
+    def on_loop(self, callback):
+        """An outbox callback, moved onto the event loop when there is one"""
+        return self.runtime.threadsafe(callback) if self.runtime else callback
+        
     def detect_and_translate(self, text, to_english=True):
-        """Detect language and translate if needed"""
+        """Detect language and translate if needed
         
+        English is recognised locally by the trigram model and never reaches
+        Ollama. Anything else costs one combined detect+translate call, and
+        repeated texts are served from the translation cache.
+        """
+        return self.ollama.run_steps(self.translate_steps(text, to_english))
+        
+    def translate_steps(self, text, to_english=True, deadline=None):
+        """detect_and_translate as a step generator (see OllamaClient.run_steps)
+        
+        deadline is when the translation is needed by, translate_timeout
+        from now if not given; the model is chosen to make it.
+        """
         print(f"[DEBUG] Starting translation for: {text[:30]}...")
+        deadline = deadline or time.time() + self.translate_timeout
         
         if to_english:
-            # Check if already English
-            detect_prompt = f"""Look at this text: "{text}"
-
-Is this text written in Spanish, French, German, or another non-English language? Or is it written in English?
-
-Answer with only: ENGLISH or NON-ENGLISH"""
-            try:
-                print(f"[DEBUG] Calling Ollama at {self.ollama_url}")
-                response = requests.post(self.ollama_url,
-                    json={
-                        "model": "gemma:7b",
-                        "prompt": detect_prompt,
-                        "stream": False,
-                        "temperature": 0.1
-                    },
-                    timeout=60
-                )
-                
-                result = response.json()['response']
-                print(f"[DEBUG] Language check response: {result}")
-                is_english = "ENGLISH" in result.upper() and "NON-ENGLISH" not in result.upper()
-                
-                if is_english:
+            # Local language ID: None means too short or ambiguous to call
+            detected = detect_language(text)
+            if detected == "English":
+                print("[DEBUG] Local language ID: English, skipping Ollama")
+                return text, "en"
+            print(f"[DEBUG] Local language ID: {detected or 'uncertain'}")
+            
+            cached = self.translations.get(text, "auto", "English")
+            if cached is not None:
+                language, translation = cached.split("\n", 1)
+                print(f"[DEBUG] Translation cache hit ({language})")
+                if language == "en":
                     return text, "en"
-                    
-                # Detect language and translate
-                translate_prompt = f"""Translate this text to English. Also identify the source language.
+                self.remember_language(language)
+                return translation, language
+                
+            # Detect language and translate in one call
+            translate_prompt = f"""Identify the language of this text and translate it to English.
 Text: "{text}"
 
 Reply in this format:
 LANGUAGE: [detected language]
-TRANSLATION: [English translation]"""
-                
-                response = requests.post(self.ollama_url,
-                    json={
-                        "model": "gemma:2b",
-                        "prompt": translate_prompt,
-                        "stream": False,
-                        "temperature": 0.3
-                    },
-                    timeout=120
+TRANSLATION: [English translation, or the text unchanged if it is already English]"""
+            
+            plan = self.models.plan("detect_translate", deadline, compact=False)
+            if plan['model'] is None:
+                print("[MODELS] No model can translate in time, sending the text as typed")
+                return text, detected or "unknown"
+                
+            try:
+                print(f"[DEBUG] Calling {plan['model']} at {self.ollama_url}")
+                # Stream and stop once the TRANSLATION: line is complete
+                reply = yield from self.models.call(plan, translate_prompt,
+                    temperature=0.3,
+                    timeout=self.translate_timeout,
+                    stop_when=LineWatcher("TRANSLATION:"),
+                    prompt_type="detect_translate"
                 )
+                self.print_timing(reply)
                 
-                result = response.json()['response']
+                result = reply['response']
+                print(f"[DEBUG] Detect+translate response: {result[:100]}")
                 lines = result.split('\n')
-                language = "unknown"
+                language = detected or "unknown"
                 translation = text
                 
                 for line in lines:
                     if line.startswith("LANGUAGE:"):
-                        language = line.replace("LANGUAGE:", "").strip()
-                        if not self.user_language:
-                            self.user_language = language
-                            print(f"[Detected language: {language}]")
+                        language = line.replace("LANGUAGE:", "").strip() or language
                     elif line.startswith("TRANSLATION:"):
-                        translation = line.replace("TRANSLATION:", "").strip()
+                        translation = line.replace("TRANSLATION:", "").strip() or text
                         
+                if language.upper() == "ENGLISH":
+                    self.translations.put(text, "auto", "English", "en\n" + text)
+                    return text, "en"
+                    
+                self.remember_language(language)
+                if language != "unknown":
+                    self.translations.put(text, "auto", "English", f"{language}\n{translation}")
                 return translation, language
                 
             except Exception as e:
@@ -93,89 +182,327 @@ TRANSLATION: [English translation]"""
             if not self.user_language or self.user_language == "en":
                 return text
                 
+            cached = self.translations.get(text, "English", self.user_language)
+            if cached is not None:
+                print("[DEBUG] Translation cache hit")
+                return cached
+                
             translate_prompt = f"""Translate this English text to {self.user_language}.
 Text: "{text}"
 
 Reply with just the translation, nothing else."""
             
+            plan = self.models.plan("translate_reply", deadline, compact=False)
+            if plan['model'] is None:
+                print("[MODELS] No model can translate in time, showing the reply in English")
+                return text
+                
             try:
-                response = requests.post(self.ollama_url,
-                    json={
-                        "model": "gemma:2b",
-                        "prompt": translate_prompt,
-                        "stream": False,
-                        "temperature": 0.3
-                    },
-                    timeout=120
+                # A reply may run over several lines, so let it finish
+                reply = yield from self.models.call(plan, translate_prompt,
+                    temperature=0.3,
+                    timeout=self.translate_timeout,
+                    prompt_type="translate_reply"
                 )
+                self.print_timing(reply)
                 
-                return response.json()['response'].strip()
+                translation = reply['response'].strip()
+                if not reply['stopped_early']:  # Never cache a cut-off translation
+                    self.translations.put(text, "English", self.user_language, translation)
+                return translation
                 
             except Exception as e:
                 print(f"[Translation error: {e}]")
                 return text
+                
+    def print_timing(self, reply):
+        """Report streaming latency for one Ollama call"""
+        early = ", stopped early" if reply['stopped_early'] else ""
+        print(f"[DEBUG] Ollama took {reply['elapsed']:.1f}s "
+              f"(first token {reply['ttft']:.1f}s, {reply['tokens']} tokens{early})")
+        
+    def print_stats(self):
+        """Ollama latency per model/prompt type, translation cache hit rate and send queue"""
+        print("\n=== Portal Stats ===")
+        self.ollama.print_stats(tag="")
+        self.models.print_stats(tag="")
+        self.outbox.print_stats(tag="Outbox:")
+        cache = self.translations.stats()
+        print(f"Translation cache: {cache['entries']} entries, hit rate {cache['hit_rate']:.0%} "
+              f"({cache['hits']} hits, {cache['misses']} misses)")
+        for router_id, router in self.routers.stats().items():
+            seen = f"heartbeat {router['age']:.0f}s ago" if router['age'] is not None else "no heartbeat yet"
+            print(f"Router {router_id}: {'up' if router['healthy'] else 'DOWN'}, load {router['load']:.0%}, "
+                  f"{seen}, {router['failures']} failure(s)")
+        
+    def metric_samples(self):
+        """Translation cache figures, for the metrics endpoint"""
+        cache = self.translations.stats()
+        return [
+            ("gauge", "translation_cache_entries", {}, cache['entries']),
+            ("counter", "translation_cache_lookups_total", {"result": "hit"}, cache['hits']),
+            ("counter", "translation_cache_lookups_total", {"result": "miss"}, cache['misses'])
+        ]
+        
+    def remember_language(self, language):
+        """Adopt the first detected non-English language for replies"""
+        if not self.user_language and language != "unknown":
+            self.user_language = language
+            print(f"[Detected language: {language}]")
         
     def on_receive(self, packet, interface):
         """Handle incoming messages"""
+        frame = frame_from_packet(packet)
+        if frame is not None:
+            sender = packet.get('fromId', 'Unknown')
+            try:
+                msg = self.reassembler.add(sender, frame)
+            except WireError as e:
+                print(f"\n[WIRE] {e}")
+                return
+            if msg and msg['kind'] == "HEARTBEAT":
+                self.router_heartbeat(sender, msg.get('depth', 0), msg.get('capacity', 0))
+            elif msg and msg['kind'] in ("RESPONSE", "BROADCAST"):
+                self.record_reply(msg['kind'], msg.get('trace'))
+                self.perform(self.reply_steps(msg['kind'], msg['text'], sender))
+            return
+            
         if 'decoded' in packet and 'text' in packet['decoded']:
-            message = packet['decoded']['text']
+            message, trace, _ = split_trace(packet['decoded']['text'])
             sender = packet.get('fromId', 'Unknown')
             
-            # Check if it's a response and translate if needed
-            if message.startswith("RESPONSE|"):
-                content = message.replace("RESPONSE|", "")
-                if self.user_language and self.user_language != "en":
-                    print(f"[Translating response...]")
-                    content = self.detect_and_translate(content, to_english=False)
-                print(f"\n[RECEIVED from {sender}]: {content}")
+            if message.startswith("HEARTBEAT|"):
+                _, depth, capacity = (message.split("|") + ["0", "0"])[:3]
+                try:
+                    depth, capacity = int(depth or 0), int(capacity or 0)
+                except ValueError:
+                    print(f"\n[DISPATCH] Malformed heartbeat from {sender} ignored: {message[:40]!r}")
+                    return
+                self.router_heartbeat(sender, depth, capacity)
+                return
+                
+            # Check if it's a response or broadcast and translate if needed
+            if message.startswith("RESPONSE|") or message.startswith("BROADCAST|"):
+                msg_type, content = message.split("|", 1)
+                self.record_reply(msg_type, trace)
+                self.perform(self.reply_steps(msg_type, content, sender))
             else:
                 print(f"\n[RECEIVED from {sender}]: {message}")
-            print("> ", end="", flush=True)  # Restore prompt
+                print("> ", end="", flush=True)  # Restore prompt
+                
+    def record_reply(self, msg_type, trace):
+        """Count a reply and time it against the message it answers"""
+        self.metrics.inc("replies_received_total", kind=msg_type)
+        sent = self.traces.pop(trace, None) if trace else None
+        if sent:
+            self.metrics.observe("response_seconds", time.time() - sent)
+            
+    def reply_steps(self, msg_type, content, sender):
+        """Print a RESPONSE or BROADCAST, translated to the user's language"""
+        if self.user_language and self.user_language != "en":
+            print(f"[Translating {msg_type.lower()}...]")
+            content = yield from self.translate_steps(content, to_english=False)
+        label = "BROADCAST" if msg_type == "BROADCAST" else "RECEIVED"
+        print(f"\n[{label} from {sender}]: {content}")
+        print("> ", end="", flush=True)  # Restore prompt
+        
+    def classify(self, text, msg_type):
+        """Compact analysis to send with the message, or None
+
+        "rules" costs microseconds; "llm" runs the router's own prompt on the
+        local model and is trusted more when the rules agree. The router
+        re-checks either one before relying on it.
+        """
+        return self.ollama.run_steps(self.classify_steps(text, msg_type))
+        
+    def classify_steps(self, text, msg_type, deadline=None):
+        """classify as a step generator, the model is chosen to answer by deadline (60s from now if not given)"""
+        rules = classify_rules(text, msg_type)
+        analysis = None
+        plan = None
+        if self.preclassify == "llm":
+            plan = self.models.plan("classify", deadline or time.time() + 60)
+        if plan and plan['model']:
+            try:
+                reply = yield from self.models.call(plan, build_prompt(text, msg_type, compact=plan['compact']),
+                    temperature=0.1,
+                    timeout=60,
+                    stop_when=JsonWatcher("{"),
+                    prompt_type="classify_compact" if plan['compact'] else "classify"
+                )
+                analysis = parse_analysis(reply['response'], text, msg_type)
+                analysis['confidence'] = 0.9 if analysis['category'] == rules['category'] else 0.5
+            except Exception as e:
+                print(f"[Classification error: {e}, using rules]")
+
+        source = "llm" if analysis else "rules"
+        analysis = analysis or rules
+        self.metrics.inc("preclassified_total", source=source)
+        fields = ("category", "priority", "urgency", "confidence") + (("summary",) if source == "llm" else ())
+        return {key: analysis[key] for key in fields}
+
+    def send_to_router(self, msg_type, text, analysis=None):
+        """Queue a typed message to the least-loaded router as binary frames or legacy TYPE|text
+
+        analysis is the pre-classification already made for it, if any;
+        otherwise it is made here when preclassify is set.
+        """
+        # New trace id and send time, carried through the router to the aid provider and back
+        trace, sent = new_trace(), time.time()
+        self.traces[trace] = sent
+        while len(self.traces) > self.max_traces:
+            self.traces.popitem(last=False)
+        self.metrics.inc("messages_sent_total", type=msg_type)
+        if self.preclassify and analysis is None:
+            analysis = self.classify(text, msg_type)
+        with self.dispatch_lock:
+            self.dispatched[trace] = {"msg_type": msg_type, "text": text, "sent": sent, "router": None,
+                                      "tried": [], "acked": None, "analysis": analysis}
+        self.dispatch(trace)
+        
+    def dispatch(self, trace):
+        """Send a tracked message to the best router it has not been tried on yet
+        
+        A re-dispatched message keeps its trace id, which the aid provider
+        uses to merge it with the copy the first router may have delivered.
+        """
+        with self.dispatch_lock:
+            entry = self.dispatched.get(trace)
+            if entry is None:
+                return
+            router_id = self.routers.pick(exclude=entry['tried'])
+            if router_id is None and entry['acked']:
+                return  # Nowhere else to go, the router that ACKed it may still come back
+            if router_id is None:
+                del self.dispatched[trace]
+                print(f"\n✗ No router left to take {entry['msg_type']} {trace}, tried {', '.join(entry['tried'])}")
+                print("> ", end="", flush=True)
+                return
+            entry.update(router=router_id, acked=None)
+            entry['tried'].append(router_id)
+            
+        priority = URGENT if entry['msg_type'] == "EMERGENCY" else NORMAL
+        report = self.on_loop(lambda item, delivered: self.dispatch_result(trace, router_id, item, delivered))
+        analysis = entry['analysis']
+        if self.wire_format == "binary":
+            msg = {"kind": entry['msg_type'], "text": entry['text'], "trace": trace, "sent": entry['sent']}
+            if analysis:
+                msg.update(analysis, msg_type=entry['msg_type'])
+            send_message(self.outbox, self.encoder, msg, router_id, priority=priority, on_result=report)
+        else:
+            text = add_analysis(f"{entry['msg_type']}|{entry['text']}", analysis)
+            self.outbox.sendText(add_trace(text, trace, entry['sent']),
+                                 destinationId=router_id, priority=priority, on_result=report)
+        if len(entry['tried']) > 1:
+            self.metrics.inc("redispatches_total")
+            
+    def dispatch_result(self, trace, router_id, item, delivered):
+        """Outbox callback for a message sent to a router: wait for its heartbeat, or fail over"""
+        with self.dispatch_lock:
+            entry = self.dispatched.get(trace)
+            if entry is None or entry['router'] != router_id:
+                return  # Already confirmed, or re-dispatched meanwhile
+            if delivered:
+                entry['acked'] = time.time()
+        if delivered:
+            self.report_delivery(item, delivered)
+            return
+        self.routers.mark_down(router_id)
+        print(f"\n[DISPATCH] Router {router_id} not reachable after {item['attempts']} attempts, trying another")
+        self.dispatch(trace)
+        
+    def router_heartbeat(self, router_id, depth, capacity):
+        """Track a router's load; its heartbeat also confirms the messages it ACKed earlier"""
+        if self.routers.heartbeat(router_id, depth, capacity):
+            print(f"\n[DISPATCH] Found router {router_id} (queue {depth}/{capacity})")
+            print("> ", end="", flush=True)
+        now = time.time()
+        with self.dispatch_lock:
+            for trace, entry in list(self.dispatched.items()):
+                if entry['router'] == router_id and entry['acked'] and now - entry['acked'] >= self.settle_time:
+                    del self.dispatched[trace]
+                    
+    def watch_routers(self):
+        """Check for silent routers every 5 s"""
+        while True:
+            time.sleep(5)
+            self.check_routers()
+            
+    def check_routers(self):
+        """Re-dispatch messages held by routers whose heartbeats have stopped"""
+        now = time.time()
+        with self.dispatch_lock:
+            for trace in [t for t, entry in self.dispatched.items() if now - entry['sent'] > 3600]:
+                del self.dispatched[trace]  # Give up tracking, the message is an hour old
+            settled = [trace for trace, entry in self.dispatched.items()
+                       if entry['acked'] and now - entry['acked'] >= self.settle_time
+                       and not self.routers.heard_from(entry['router'])]
+            for trace in settled:
+                del self.dispatched[trace]  # Router without heartbeats, the ACK is all there is
+            stranded = [trace for trace, entry in self.dispatched.items()
+                        if entry['router'] and self.routers.silent(entry['router'])]
+        for trace in stranded:
+            entry = self.dispatched.get(trace)
+            if entry:
+                print(f"\n[DISPATCH] Router {entry['router']} went silent, re-sending {entry['msg_type']} {trace}")
+                self.dispatch(trace)
+                    
+
+    def report_delivery(self, item, delivered):
+        """Outbox callback once a send is ACKed or has used up its retries"""
+        if delivered:
+            print(f"\n✓ Delivered to {item['dest']} (attempt {item['attempts']})")
+        else:
+            print(f"\n✗ Not delivered to {item['dest']} after {item['attempts']} attempts")
+        print("> ", end="", flush=True)
             
     def send_emergency(self, message):
         """Send emergency message"""
-        # Translate if not English
-        translated, lang = self.detect_and_translate(message, to_english=True)
-        if lang != "en" and lang != "unknown":
-            print(f"[Translated from {lang}: {translated}]")
-        
-        packet = f"EMERGENCY|{translated}"
-        self.interface.sendText(packet, destinationId=self.router_id)
-        print(f"✓ Emergency sent to router")
+        self.perform(self.send_steps("EMERGENCY", message))
         
     def send_request(self, message):
         """Send resource request"""
-        translated, lang = self.detect_and_translate(message, to_english=True)
-        if lang != "en" and lang != "unknown":
-            print(f"[Translated from {lang}: {translated}]")
-            
-        packet = f"REQUEST|{translated}"
-        self.interface.sendText(packet, destinationId=self.router_id)
-        print(f"✓ Request sent to router")
+        self.perform(self.send_steps("REQUEST", message))
         
     def send_offer(self, message):
         """Send help offer"""
-        translated, lang = self.detect_and_translate(message, to_english=True)
+        self.perform(self.send_steps("OFFER", message))
+        
+    def send_steps(self, msg_type, message):
+        """Translate if not English, pre-classify if enabled, and queue for a router
+        
+        Both have to be done within a deadline set by the message type, so
+        an emergency falls back to a faster model sooner.
+        """
+        deadline = time.time() + min(self.translate_timeout, PRIORITY_DEADLINES[TYPE_BASE_PRIORITY[msg_type]])
+        translated, lang = yield from self.translate_steps(message, to_english=True, deadline=deadline)
         if lang != "en" and lang != "unknown":
             print(f"[Translated from {lang}: {translated}]")
             
-        packet = f"OFFER|{translated}"
-        self.interface.sendText(packet, destinationId=self.router_id)
-        print(f"✓ Offer sent to router")
+        analysis = (yield from self.classify_steps(translated, msg_type, deadline)) if self.preclassify else None
+        self.send_to_router(msg_type, translated, analysis)
+        print(f"✓ {msg_type.capitalize()} queued for router")
         
     def send_raw(self, message, dest=None):
         """Send raw message"""
-        translated, lang = self.detect_and_translate(message, to_english=True)
+        self.perform(self.raw_steps(message, dest))
+        
+    def raw_steps(self, message, dest=None):
+        translated, lang = yield from self.translate_steps(message, to_english=True)
         if lang != "en" and lang != "unknown":
             print(f"[Translated from {lang}: {translated}]")
             
-        dest = dest or self.router_id
-        self.interface.sendText(translated, destinationId=dest)
-        print(f"✓ Sent to {dest}")
+        dest = dest or self.routers.pick()
+        self.outbox.sendText(translated, destinationId=dest, on_result=self.on_loop(self.report_delivery))
+        print(f"✓ Queued for {dest}")
         
     def run(self):
-        """Main interaction loop"""
-        self.connect()
+        """Main interaction loop, on an asyncio event loop so replies and sends never wait on the console"""
+        runtime = NodeRuntime("portal")
+        runtime.run(self.main(runtime))
+        
+    async def main(self, runtime):
+        self.connect(runtime)
         
         print("=== GemNet User Terminal ===")
         print("Commands:")
@@ -184,52 +511,67 @@ Reply with just the translation, nothing else."""
         print("  o <message>  - Offer help")
         print("  m <message>  - Send raw message")
         print("  d <id> <msg> - Direct message to node")
+        print("  stats        - Ollama latency, translation cache and send queue stats")
         print("  quit         - Exit\n")
         
-        while True:
-            try:
-                user_input = input("> ").strip()
+        try:
+            while True:
+                user_input = await runtime.console()
+                if user_input is None or self.handle_command(user_input.strip()) is False:
+                    break
+        finally:
+            print("\nShutting down...")
+            self.metrics.close(self.metrics_snapshot)
+            self.translations.close()
+            self.ollama.close()
+            self.outbox.close()
+            self.interface.close()
+            
+    def handle_command(self, user_input):
+        """Run one console command, False for quit
+        
+        Sends start as tasks, so the prompt is back while a translation runs.
+        """
+        try:
+            if not user_input:
+                return
                 
-                if not user_input:
-                    continue
-                    
-                parts = user_input.split(maxsplit=1)
-                cmd = parts[0].lower()
+            parts = user_input.split(maxsplit=1)
+            cmd = parts[0].lower()
+            
+            if cmd == "quit":
+                return False
                 
-                if cmd == "quit":
-                    break
-                    
-                if len(parts) < 2 and cmd != "help":
-                    print("Need a message. Example: e Fire at 123 Main St")
-                    continue
-                    
-                msg = parts[1] if len(parts) > 1 else ""
-                
-                if cmd == "e":
-                    self.send_emergency(msg)
-                elif cmd == "r":
-                    self.send_request(msg)
-                elif cmd == "o":
-                    self.send_offer(msg)
-                elif cmd == "m":
-                    self.send_raw(msg)
-                elif cmd == "d":
-                    # Direct message: d !nodeId message
-                    msg_parts = msg.split(maxsplit=1)
-                    if len(msg_parts) < 2:
-                        print("Format: d <nodeId> <message>")
-                    else:
-                        self.send_raw(msg_parts[1], msg_parts[0])
+            if cmd == "stats":
+                self.print_stats()
+                return
+                
+            if len(parts) < 2 and cmd != "help":
+                print("Need a message. Example: e Fire at 123 Main St")
+                return
+                
+            msg = parts[1] if len(parts) > 1 else ""
+            
+            if cmd == "e":
+                self.send_emergency(msg)
+            elif cmd == "r":
+                self.send_request(msg)
+            elif cmd == "o":
+                self.send_offer(msg)
+            elif cmd == "m":
+                self.send_raw(msg)
+            elif cmd == "d":
+                # Direct message: d !nodeId message
+                msg_parts = msg.split(maxsplit=1)
+                if len(msg_parts) < 2:
+                    print("Format: d <nodeId> <message>")
                 else:
-                    print("Unknown command. Use: e, r, o, m, d, or quit")
-                    
-            except KeyboardInterrupt:
-                break
-            except Exception as e:
-                print(f"Error: {e}")
+                    self.send_raw(msg_parts[1], msg_parts[0])
+            else:
+                print("Unknown command. Use: e, r, o, m, d, stats, or quit")
                 
-        print("\nShutting down...")
-        self.interface.close()
+        except Exception as e:
+            print(f"Error: {e}")
 
 if __name__ == "__main__":
     # Change COM14 to your actual port
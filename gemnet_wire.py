@@ -0,0 +1,358 @@
+# gemnet_wire.py - Compact binary wire format with fragmentation for LoRa frames
+import os
+import re
+import threading
+import time
+import zlib
+
+VERSION = 1
+MAGIC = 0xA0  # High nibble marks a GemNet frame, low nibble is the version
+PORTNUM = 256  # Meshtastic PRIVATE_APP
+MAX_FRAME = 233  # Meshtastic DATA_PAYLOAD_LEN
+HEADER_LEN = 6
+MAX_FRAGMENTS = 255
+
+KINDS = ("EMERGENCY", "REQUEST", "OFFER", "GENERAL", "ROUTED", "CORRECTION", "RESPONSE", "BROADCAST", "HEARTBEAT",
+         "INCIDENT", "REPEAT")
+MSG_TYPES = ("GENERAL", "EMERGENCY", "REQUEST", "OFFER")
+CATEGORIES = ("OTHER", "MEDICAL", "FIRE", "RESCUE", "SUPPLIES", "SHELTER", "TRANSPORT")
+URGENCIES = ("LOW", "MEDIUM", "HIGH", "IMMEDIATE")
+
+# Field tags. Every field is tag, varint length, value, so decoders skip tags they do not know.
+TAG_CLASS = 1  # msg_type, category, priority, urgency packed in 2 bytes
+TAG_ORIGIN = 2  # Original sender node id
+TAG_REF = 3  # Router route ref (varint)
+TAG_TEXT = 4  # UTF-8 text
+TAG_TEXT_Z = 5  # Raw-deflate compressed UTF-8 text
+TAG_SUMMARY = 6  # UTF-8 summary, only sent when it adds to the text
+TAG_TRACE = 7  # 4-byte trace id, the same on every hop of one user message
+TAG_SENT = 8  # Origin send time, epoch milliseconds (varint)
+TAG_LOAD = 9  # Router heartbeat: queue depth and capacity (two varints)
+TAG_CONFIDENCE = 10  # Confidence of a portal's own analysis, 0-100 in one byte
+TAG_COUNT = 11  # Incident update: reports so far; repeat notice: repeats so far (varint)
+TAG_MEMBERS = 12  # Incident update: new reporters, each a length-prefixed node id and a 4-byte trace id (zeros if none)
+
+NODE_ID = re.compile(r"^![0-9a-f]{8}$")
+TRACE_TRAILER = re.compile(r"\|T=([0-9a-f]{8}):(\d+)$")  # Legacy text format: ...|T=<trace>:<sent ms>
+# Legacy text format, before any trace trailer: ...|A=<category>:<priority>:<urgency>:<confidence %>
+ANALYSIS_TRAILER = re.compile(r"\|A=([A-Z]+):([1-7]):([A-Z]+):(\d{1,3})$")
+
+class WireError(ValueError):
+    """Raised for frames or messages that cannot be decoded"""
+
+def _varint(value):
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+def _read_varint(data, pos):
+    value = shift = 0
+    while True:
+        if pos >= len(data):
+            raise WireError("Truncated varint")
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value, pos
+        shift += 7
+
+def _index(table, value, default=0):
+    try:
+        return table.index(str(value).upper())
+    except ValueError:
+        return default
+
+def pack_node(node_id):
+    """'!a0cc6e10' -> 4 bytes, anything else as UTF-8"""
+    if isinstance(node_id, str) and NODE_ID.match(node_id):
+        return bytes.fromhex(node_id[1:])
+    return str(node_id).encode()
+
+def unpack_node(data):
+    return "!" + data.hex() if len(data) == 4 else data.decode(errors="replace")
+
+def new_trace():
+    return os.urandom(4).hex()
+
+def add_trace(text, trace, sent):
+    """Append a trace trailer to a legacy text message"""
+    if not trace:
+        return text
+    return f"{text}|T={trace}:{int((sent or time.time()) * 1000)}"
+
+def split_trace(text):
+    """(text without trailer, trace id, origin send time) for a legacy text message"""
+    match = TRACE_TRAILER.search(text)
+    if not match:
+        return text, None, None
+    return text[:match.start()], match.group(1), int(match.group(2)) / 1000
+
+def add_analysis(text, analysis):
+    """Append a portal's analysis to a legacy text message, before add_trace"""
+    if not analysis:
+        return text
+    return (f"{text}|A={analysis['category']}:{analysis['priority']}:{analysis['urgency']}:"
+            f"{round(analysis.get('confidence', 0) * 100)}")
+
+def split_analysis(text):
+    """(text without trailer, analysis dict or None) for a legacy text message"""
+    match = ANALYSIS_TRAILER.search(text)
+    if not match:
+        return text, None
+    return text[:match.start()], {"category": match.group(1), "priority": int(match.group(2)),
+                                  "urgency": match.group(3), "confidence": int(match.group(4)) / 100}
+
+def _compress(raw):
+    compressor = zlib.compressobj(9, zlib.DEFLATED, -15)
+    return compressor.compress(raw) + compressor.flush()
+
+def _decompress(data):
+    return zlib.decompress(data, -15)
+
+def encode_body(msg):
+    """Serialise a message dict (see KINDS and the TAG_ fields) to bytes, without framing"""
+    kind = msg["kind"]
+    if kind not in KINDS:
+        raise WireError(f"Unknown kind {kind}")
+    fields = []
+
+    if "category" in msg or "priority" in msg:
+        priority = min(7, max(0, int(msg.get("priority", 0))))
+        first = (_index(MSG_TYPES, msg.get("msg_type", "GENERAL")) << 4) | _index(CATEGORIES, msg.get("category", "OTHER"))
+        second = (priority << 2) | _index(URGENCIES, msg.get("urgency", "MEDIUM"), default=1)
+        fields.append((TAG_CLASS, bytes((first, second))))
+    if msg.get("origin"):
+        fields.append((TAG_ORIGIN, pack_node(msg["origin"])))
+    if msg.get("ref"):
+        fields.append((TAG_REF, _varint(int(msg["ref"], 16))))
+    if msg.get("trace"):
+        fields.append((TAG_TRACE, bytes.fromhex(msg["trace"])))
+    if msg.get("sent"):
+        fields.append((TAG_SENT, _varint(int(msg["sent"] * 1000))))
+    if "depth" in msg:
+        fields.append((TAG_LOAD, _varint(int(msg["depth"])) + _varint(int(msg.get("capacity", 0)))))
+    if "count" in msg:
+        fields.append((TAG_COUNT, _varint(int(msg["count"]))))
+    if msg.get("members"):
+        members = bytearray()
+        for node, trace in msg["members"]:
+            packed = pack_node(node)
+            members += bytes((len(packed),)) + packed + (bytes.fromhex(trace) if trace else bytes(4))
+        fields.append((TAG_MEMBERS, bytes(members)))
+    if "confidence" in msg:
+        fields.append((TAG_CONFIDENCE, bytes((min(100, max(0, round(msg["confidence"] * 100))),))))
+
+    summary = msg.get("summary") or ""
+    text = msg.get("text") or ""
+    if summary and not text.startswith(summary):
+        fields.append((TAG_SUMMARY, summary.encode()))
+    if text:
+        raw = text.encode()
+        packed = _compress(raw)
+        fields.append((TAG_TEXT_Z, packed) if len(packed) < len(raw) else (TAG_TEXT, raw))
+
+    body = bytearray((KINDS.index(kind),))
+    for tag, value in fields:
+        body += bytes((tag,)) + _varint(len(value)) + value
+    return bytes(body)
+
+def decode_body(body):
+    """Inverse of encode_body"""
+    if not body or body[0] >= len(KINDS):
+        raise WireError("Unknown message kind")
+    msg = {"kind": KINDS[body[0]]}
+    pos = 1
+    while pos < len(body):
+        tag = body[pos]
+        length, pos = _read_varint(body, pos + 1)
+        value = body[pos:pos + length]
+        if len(value) < length:
+            raise WireError("Truncated field")
+        pos += length
+
+        if tag == TAG_CLASS and length == 2:
+            msg["msg_type"] = MSG_TYPES[value[0] >> 4] if value[0] >> 4 < len(MSG_TYPES) else "GENERAL"
+            msg["category"] = CATEGORIES[value[0] & 0x0F] if value[0] & 0x0F < len(CATEGORIES) else "OTHER"
+            msg["priority"] = value[1] >> 2
+            msg["urgency"] = URGENCIES[value[1] & 0x03]
+        elif tag == TAG_ORIGIN:
+            msg["origin"] = unpack_node(value)
+        elif tag == TAG_REF:
+            msg["ref"] = format(_read_varint(value, 0)[0], "x")
+        elif tag == TAG_TEXT:
+            msg["text"] = value.decode(errors="replace")
+        elif tag == TAG_TEXT_Z:
+            msg["text"] = _decompress(value).decode(errors="replace")
+        elif tag == TAG_SUMMARY:
+            msg["summary"] = value.decode(errors="replace")
+        elif tag == TAG_TRACE:
+            msg["trace"] = value.hex()
+        elif tag == TAG_SENT:
+            msg["sent"] = _read_varint(value, 0)[0] / 1000
+        elif tag == TAG_LOAD:
+            msg["depth"], offset = _read_varint(value, 0)
+            msg["capacity"] = _read_varint(value, offset)[0]
+        elif tag == TAG_COUNT:
+            msg["count"] = _read_varint(value, 0)[0]
+        elif tag == TAG_MEMBERS:
+            msg["members"], offset = [], 0
+            while offset < len(value):
+                size = value[offset]
+                node, trace = value[offset + 1:offset + 1 + size], value[offset + 1 + size:offset + 5 + size]
+                if len(trace) < 4:
+                    raise WireError("Truncated member list")
+                msg["members"].append((unpack_node(bytes(node)), trace.hex() if any(trace) else None))
+                offset += 5 + size
+        elif tag == TAG_CONFIDENCE and length == 1:
+            msg["confidence"] = value[0] / 100
+
+    msg.setdefault("text", "")
+    if "summary" not in msg and msg["kind"] in ("ROUTED", "CORRECTION"):
+        msg["summary"] = msg["text"]
+    return msg
+
+def is_frame(data):
+    return isinstance(data, (bytes, bytearray)) and len(data) >= HEADER_LEN and data[0] == MAGIC | VERSION
+
+class WireEncoder:
+    """Encodes messages into one or more LoRa-sized frames
+
+    Frame header: magic|version, kind, message id (uint16, per sender),
+    fragment index, fragment count. The message id lets the receiver
+    reassemble fragments and drop duplicate deliveries.
+    """
+    def __init__(self, max_frame=MAX_FRAME):
+        self.max_frame = max_frame
+        self.counter = int(time.time()) & 0xFFFF  # Avoid reusing ids right after a restart
+        self.lock = threading.Lock()
+
+    def next_id(self):
+        with self.lock:
+            self.counter = (self.counter + 1) & 0xFFFF
+            return self.counter
+
+    def encode(self, msg):
+        body = encode_body(msg)
+        chunk = self.max_frame - HEADER_LEN
+        parts = [body[i:i + chunk] for i in range(0, len(body), chunk)]
+        if len(parts) > MAX_FRAGMENTS:
+            raise WireError(f"Message needs {len(parts)} fragments, limit is {MAX_FRAGMENTS}")
+        msg_id = self.next_id()
+        return [bytes((MAGIC | VERSION, body[0], msg_id >> 8, msg_id & 0xFF, index, len(parts))) + part
+                for index, part in enumerate(parts)]
+
+class Reassembler:
+    """Collects fragments per (sender, message id) into complete messages
+
+    Fragments may arrive out of order or more than once. Completed ids are
+    remembered for `remember` seconds so retransmissions are not delivered
+    twice; incomplete messages are dropped after `timeout` seconds.
+    """
+    def __init__(self, timeout=120, remember=600, max_pending=256):
+        self.timeout = timeout
+        self.remember = remember
+        self.max_pending = max_pending
+        self.pending = {}  # (sender, msg_id) -> {"count", "parts", "first_seen"}
+        self.completed = {}  # (sender, msg_id) -> completion time
+        self.lock = threading.Lock()
+        self.frames = 0
+        self.messages = 0
+        self.duplicates = 0
+        self.expired = 0
+        self.errors = 0
+
+    def add(self, sender, frame):
+        """Feed one frame, returns the decoded message dict once complete, else None"""
+        if not is_frame(frame):
+            raise WireError("Not a GemNet frame")
+        msg_id = (frame[2] << 8) | frame[3]
+        index, count = frame[4], frame[5]
+        key = (sender, msg_id)
+        now = time.time()
+
+        with self.lock:
+            self.frames += 1
+            self._expire(now)
+            if key in self.completed:
+                self.duplicates += 1
+                return None
+            if index >= count:
+                self.errors += 1
+                return None
+
+            entry = self.pending.setdefault(key, {"count": count, "parts": {}, "first_seen": now})
+            if index in entry["parts"]:
+                self.duplicates += 1
+                return None
+            entry["parts"][index] = frame[HEADER_LEN:]
+            if len(entry["parts"]) < entry["count"]:
+                if len(self.pending) > self.max_pending:
+                    oldest = min(self.pending, key=lambda k: self.pending[k]["first_seen"])
+                    del self.pending[oldest]
+                    self.expired += 1
+                return None
+
+            del self.pending[key]
+            self.completed[key] = now
+            body = b"".join(entry["parts"][i] for i in range(entry["count"]))
+
+        try:
+            msg = decode_body(body)
+        except (WireError, zlib.error, IndexError) as e:
+            with self.lock:
+                self.errors += 1
+            raise WireError(f"Undecodable message {msg_id} from {sender}: {e}")
+        msg["msg_id"] = msg_id
+        with self.lock:
+            self.messages += 1
+        return msg
+
+    def _expire(self, now):
+        for key in [k for k, entry in self.pending.items() if now - entry["first_seen"] > self.timeout]:
+            del self.pending[key]
+            self.expired += 1
+        if len(self.completed) > 1024:
+            for key in [k for k, done in self.completed.items() if now - done > self.remember]:
+                del self.completed[key]
+
+    def stats(self):
+        with self.lock:
+            return {
+                "frames": self.frames,
+                "messages": self.messages,
+                "pending": len(self.pending),
+                "duplicates": self.duplicates,
+                "expired": self.expired,
+                "errors": self.errors
+            }
+
+def frame_from_packet(packet):
+    """GemNet frame bytes from a meshtastic receive packet, or None for anything else"""
+    decoded = packet.get("decoded", {})
+    if decoded.get("portnum") not in ("PRIVATE_APP", PORTNUM):
+        return None
+    payload = decoded.get("payload")
+    return payload if is_frame(payload) else None
+
+def send_message(interface, encoder, msg, destination="^all", on_result=None, coalesce_key=None, **kwargs):
+    """Encode msg and send each frame as PRIVATE_APP data, returns the frame count
+
+    interface may be a meshtastic interface or a gemnet_outbox.Outbox; extra
+    keyword arguments (such as the outbox priority) are passed to sendData.
+    on_result is attached to the last frame only.
+    """
+    frames = encoder.encode(msg)
+    for index, frame in enumerate(frames):
+        if index == len(frames) - 1 and on_result:
+            kwargs["on_result"] = on_result
+        if coalesce_key:
+            kwargs["coalesce_key"] = f"{coalesce_key}#{index}"
+        interface.sendData(frame, destinationId=destination, portNum=PORTNUM, **kwargs)
+    return len(frames)